@@ -0,0 +1,254 @@
+"""
+批量A/B预测命令行工具
+从CSV或JSONL文件读取 (content_a, content_b, platform) 行，在有界并发下批量运行A/B模拟，
+结果写入JSONL或Parquet文件
+
+示例:
+    python batch_predict.py backlog.csv -o results.parquet --provider deepseek --max-users 50
+"""
+import os
+import sys
+import csv
+import json
+import asyncio
+import logging
+import argparse
+from typing import Any, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 加载环境变量
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+from config.model_config import get_available_providers
+from llms.llm import ViralPredictionLLM
+from llms.cache import ResponseCache
+from llms.metrics import get_metrics_registry, start_metrics_server
+from simulation.scheduler import DEFAULT_MAX_CONCURRENCY
+from simulation.engine import PLATFORMS, ComparisonTask, SimulationConfig, run_comparisons
+from simulation.personas import load_populations
+from simulation.surrogate import DEFAULT_TOLERANCE, EngagementSurrogate
+from simulation.content_index import DEFAULT_THRESHOLD, ContentIndex
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 输入文件的必需列
+REQUIRED_COLUMNS = ("content_a", "content_b", "platform")
+
+# Parquet输出每个行组的行数
+PARQUET_ROW_GROUP_SIZE = 500
+
+
+def read_tasks(path: str, platforms: Optional[List[str]] = None) -> Iterator[ComparisonTask]:
+    """
+    逐行读取待比较内容
+
+    Args:
+        path: CSV或JSONL文件路径（按扩展名判断格式）
+        platforms: 指定时每行内容在这些平台上各比较一次（此时输入不需要 platform 列），
+            任务id为 "<id>-<platform>"
+
+    Returns:
+        比较任务迭代器；id列缺失时使用行号
+    """
+    required = REQUIRED_COLUMNS if not platforms else tuple(c for c in REQUIRED_COLUMNS if c != "platform")
+
+    def _to_tasks(line_number: int, row: Dict[str, Any]) -> Iterator[ComparisonTask]:
+        missing = [column for column in required if not row.get(column)]
+        if missing:
+            raise ValueError(f"{path} 第 {line_number} 行缺少字段: {missing}")
+        extra = {key: value for key, value in row.items() if key not in REQUIRED_COLUMNS and key != "id"}
+        task_id = str(row.get("id") or line_number)
+        for platform in platforms or [row["platform"]]:
+            yield ComparisonTask(
+                id=f"{task_id}-{platform}" if platforms else task_id,
+                content_a=row["content_a"],
+                content_b=row["content_b"],
+                platform=platform,
+                extra=extra
+            )
+
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".jsonl"):
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield from _to_tasks(line_number, json.loads(line))
+        else:
+            for line_number, row in enumerate(csv.DictReader(f), start=1):
+                yield from _to_tasks(line_number, row)
+
+
+class ResultWriter:
+    """按完成顺序写出结果行：JSONL逐行追加，Parquet按行组批量写入"""
+    def __init__(self, path: str):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self._buffer: List[Dict[str, Any]] = []
+        self._parquet_writer = None
+        self._file = None if self.parquet else open(path, "w", encoding="utf-8")
+
+    def write(self, row: Dict[str, Any]):
+        """写入一行结果"""
+        if not self.parquet:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self._file.flush()
+            return
+        self._buffer.append(row)
+        if len(self._buffer) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush_parquet()
+
+    def _flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._buffer:
+            return
+        if self._parquet_writer is None:
+            # 首批数据中全为空的列（例如 error）按字符串列处理，避免后续批次类型不一致
+            inferred = pa.Table.from_pylist(self._buffer).schema
+            schema = pa.schema([
+                pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in inferred
+            ])
+            self._parquet_writer = pq.ParquetWriter(self.path, schema)
+        table = pa.Table.from_pylist(self._buffer, schema=self._parquet_writer.schema)
+        self._parquet_writer.write_table(table)
+        self._buffer = []
+
+    def close(self):
+        """写出剩余数据并关闭文件"""
+        if self.parquet:
+            self._flush_parquet()
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+        else:
+            self._file.close()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="批量运行A/B内容互动预测")
+    parser.add_argument("input", help="输入文件（.csv 或 .jsonl），需包含 content_a, content_b, platform 列")
+    parser.add_argument("--platforms", nargs="+", default=None, choices=PLATFORMS + ("all",),
+                        help="在这些平台上各比较一次每行内容（all 为所有平台），此时输入不需要 platform 列")
+    parser.add_argument("-o", "--output", required=True, help="输出文件（.jsonl 或 .parquet）")
+    parser.add_argument("--provider", default="deepseek", choices=get_available_providers(), help="模型提供商")
+    parser.add_argument("--model", default=None, help="模型名称，默认使用提供商的第一个模型")
+    parser.add_argument("--language", default="en", choices=["en", "zh"], help="提示词语言")
+    parser.add_argument("--max-users", type=int, default=20, help="每个版本模拟的用户数")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help="所有比较共享的最大在途LLM调用数")
+    parser.add_argument("--parallel", type=int, default=8, help="同时进行中的比较数")
+    parser.add_argument("--users-per-call", type=int, default=1, help="每次LLM调用模拟的用户数")
+    parser.add_argument("--choices-per-call", type=int, default=None,
+                        help="每次请求的独立候选数（API 的 n 参数），默认按提供商能力取上限，1表示关闭")
+    parser.add_argument("--personas", action="store_true",
+                        help="为模拟用户分配平台受众画像，两个版本在同一批画像上配对比较（分层配对检验）")
+    parser.add_argument("--persona-seed", type=int, default=0, help="受众画像分配的随机种子")
+    parser.add_argument("--persona-file", default=None,
+                        help="受众画像配置JSON文件（{平台: [{name, description, weight}]}），覆盖默认画像")
+    parser.add_argument("--early-stopping", action="store_true", help="启用序贯检验提前停止")
+    parser.add_argument("--stream", action="store_true", help="流式读取响应，完整结果出现后立即停止（推理模型可减少等待与输出token费用）")
+    parser.add_argument("--surrogate", default=None,
+                        help="代理模型训练样本文件（JSONL，不存在时创建）：有把握的比较由本地代理模型直接作答，其余交给LLM并加入训练")
+    parser.add_argument("--surrogate-tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="代理模型作答条件：预测标准差不超过一次新模拟标准误的该倍数")
+    parser.add_argument("--reuse-similar", action="store_true",
+                        help="与已模拟内容近似重复（仅空白、标点、表情或个别词不同）的内容复用其缓存结果，只补充不足的用户")
+    parser.add_argument("--similarity", type=float, default=DEFAULT_THRESHOLD,
+                        help="近似重复的相似度阈值（估计的Jaccard相似度）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用响应缓存")
+    parser.add_argument("--replay", action="store_true", help="只从缓存回放，不发起网络调用")
+    parser.add_argument("--max-cost", type=float, default=None, help="每组比较的费用上限（美元），用完后该组停止发起新调用")
+    parser.add_argument("--runs-dir", default=None, help="保存每组比较逐用户结果的目录（每组一个 <id>.parquet 运行文件）")
+    parser.add_argument("--metrics-file", default=None, help="结束时把调用指标写入该文件（Prometheus文本格式）")
+    parser.add_argument("--openmetrics", action="store_true", help="指标文件使用 OpenMetrics 格式")
+    parser.add_argument("--metrics-port", type=int, default=None, help="运行期间在该端口提供 /metrics 端点")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试日志")
+    args = parser.parse_args(argv)
+    if args.reuse_similar and args.no_cache:
+        parser.error("--reuse-similar 需要响应缓存，不能与 --no-cache 同时使用")
+    return args
+
+
+async def run(args: argparse.Namespace) -> int:
+    """
+    执行批处理
+
+    Returns:
+        失败的比较数
+    """
+    cache = None if args.no_cache else ResponseCache()
+    llm_client = ViralPredictionLLM(provider=args.provider, model=args.model, cache=cache,
+                                    replay=args.replay and cache is not None, stream=args.stream)
+    config = SimulationConfig(
+        max_users=args.max_users,
+        max_concurrency=args.concurrency,
+        users_per_call=args.users_per_call,
+        early_stopping=args.early_stopping,
+        cost_budget=args.max_cost,
+        choices_per_call=args.choices_per_call,
+        personas=args.personas,
+        persona_seed=args.persona_seed,
+        persona_populations=load_populations(args.persona_file) if args.persona_file else None
+    )
+
+    def save_run(task, result):
+        """把一组比较的逐用户结果写入运行文件"""
+        result.store.write(os.path.join(args.runs_dir, f"{task.id}.parquet"))
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    platforms = list(PLATFORMS) if args.platforms and "all" in args.platforms else args.platforms
+    surrogate = None
+    if args.surrogate:
+        surrogate = EngagementSurrogate(f"{llm_client.provider}/{llm_client.model}", path=args.surrogate,
+                                        tolerance=args.surrogate_tolerance)
+    content_index = ContentIndex(threshold=args.similarity) if args.reuse_similar else None
+
+    writer = ResultWriter(args.output)
+    completed = failed = 0
+    try:
+        async for row in run_comparisons(llm_client, read_tasks(args.input, platforms), config,
+                                         language=args.language, max_parallel=args.parallel,
+                                         on_run=save_run if args.runs_dir else None, surrogate=surrogate,
+                                         content_index=content_index):
+            writer.write(row)
+            completed += 1
+            if row["error"] is not None:
+                failed += 1
+            if completed % 10 == 0:
+                logger.info(f"已完成 {completed} 组比较（失败 {failed} 组）")
+    finally:
+        writer.close()
+        if content_index is not None:
+            content_index.close()
+
+    logger.info(f"全部完成: {completed} 组比较，失败 {failed} 组，结果已写入 {args.output}")
+    if surrogate is not None:
+        logger.info(f"代理模型作答 {surrogate.answered} 组，交给LLM模拟 {surrogate.routed} 组")
+    for backend, usage in llm_client.get_usage().items():
+        logger.info(f"{backend} 用量: {usage}")
+    for backend_metrics in get_metrics_registry().summary():
+        logger.info(f"调用指标: {backend_metrics}")
+    if args.metrics_file:
+        get_metrics_registry().write(args.metrics_file, openmetrics=args.openmetrics)
+    return failed
+
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    failed = asyncio.run(run(args))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,456 @@
+"""
+离线基准测试
+基于离线模拟提供商（provider="mock"）测量解析器、统计引擎与端到端模拟流程的吞吐量、耗时与统计准确性，
+流式与完整响应两种调用模式的耗时与输出token数，受众画像配对设计相对独立比较的方差缩减，近似重复内容索引的查找耗时与召回率，
+以及界面所需模块的冷启动导入耗时（python -X importtime）。结果写入JSON；指定基线文件时与之比较，
+超出容差的退化、或本应延迟导入的重量级依赖被提前导入时以非零退出码报告
+
+示例:
+    python benchmarks/run_benchmarks.py -o bench.json
+    python benchmarks/run_benchmarks.py -o bench-new.json --baseline bench.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import subprocess
+import logging
+import argparse
+from typing import Any, Dict, List
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.llm import ViralPredictionLLM
+from llms.mock_provider import MOCK_PROFILES, set_mock_profile, true_rates, _render, _sample_engagement
+from llms.response_parser import ResponseParseError, ResponseParser
+from simulation.engine import SimulationConfig, build_prompt, run_ab_test
+from simulation.content_index import ContentIndex
+from simulation.personas import get_population, persona_prompt
+from simulation.stats import compare_variants, stratified_mean, with_total
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 基准测试使用的模拟模型
+BENCHMARK_MODEL = "mock-fast"
+
+# 比较流式与完整响应的模拟模型（推理前言或结果之后的长篇解释）
+STREAMING_MODEL = "mock-reasoner"
+
+# 基准测试内容：两组真实互动概率不同的内容，以及一组用于A/A检验的相同内容
+CONTENT_A = "We just open-sourced our benchmark suite. Try it on your own workload and tell us what breaks!"
+CONTENT_B = "Version 2.3 release notes are available on the website."
+PLATFORM = "Twitter"
+
+# Streamlit 界面在首次加载时导入的项目模块
+APP_IMPORTS = (
+    "llms.llm", "llms.cache", "llms.client_pool", "llms.router", "llms.metrics",
+    "simulation.scheduler", "simulation.aggregator", "simulation.engine", "simulation.tournament",
+)
+# 只在真正使用时才应导入的重量级依赖
+DEFERRED_MODULES = ("scipy", "statsmodels", "openai", "httpx", "pyarrow")
+
+# 各指标的比较方向：1 表示越大越好，-1 表示越小越好（用于与基线比较）
+DIRECTIONS = {
+    "ops_per_s": 1,
+    "calls_per_s": 1,
+    "comparisons_per_s": 1,
+    "p50_s": -1,
+    "p95_s": -1,
+    "overhead_s": -1,
+    "power": 1,
+    "false_positive_rate": -1,
+    "ci_coverage": 1,
+    "import_ms": -1,
+    "result_p50_s": -1,
+    "output_tokens_mean": -1,
+    "variance_ratio": -1,
+    "lookup_p50_us": -1,
+    "lookup_p95_us": -1,
+    "recall": 1,
+}
+
+
+def bench_parser(samples: int, seed: int) -> Dict[str, Any]:
+    """各响应形态的解析吞吐量"""
+    rng = random.Random(seed)
+    rates = true_rates("parser benchmark")
+    results = {}
+    for shape in ("json", "fenced", "reasoning", "malformed", "prose"):
+        texts = [_render(rng, shape, _sample_engagement(rng, rates, 1)) for _ in range(samples)]
+        parser = ResponseParser()
+        started_at = time.perf_counter()
+        for text in texts:
+            try:
+                parser.parse_engagement(text)
+            except ResponseParseError:
+                pass
+        elapsed = time.perf_counter() - started_at
+        results[shape] = {"ops_per_s": round(samples / elapsed), "reasons": parser.snapshot()}
+    return results
+
+
+def bench_stats(comparisons: int, users: int, seed: int) -> Dict[str, Any]:
+    """批量多指标检验的吞吐量"""
+    rng = np.random.default_rng(seed)
+    values_a = rng.integers(0, 2, size=(comparisons, users, 4))
+    values_b = rng.integers(0, 2, size=(comparisons, users, 4))
+    started_at = time.perf_counter()
+    compare_variants(values_a, values_b, metrics=("like", "comment", "share", "quote"), rng=rng)
+    elapsed = time.perf_counter() - started_at
+    return {"comparisons": comparisons, "users": users, "comparisons_per_s": round(comparisons / elapsed, 1)}
+
+
+def bench_imports(repeats: int) -> Dict[str, Any]:
+    """
+    在全新的解释器中用 -X importtime 测量界面所需模块的冷启动导入耗时（取多次中的最小值），
+    并检查重量级依赖是否被提前导入
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = (f"import sys, json; import {', '.join(APP_IMPORTS)}; "
+            f"print(json.dumps([m for m in {DEFERRED_MODULES!r} if m in sys.modules]))")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [project_root, env.get("PYTHONPATH")]))
+
+    best_total, best_packages, eager = None, {}, []
+    for _ in range(repeats):
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=project_root, env=env,
+                                   capture_output=True, text=True, check=True)
+        # 每行格式: "import time: <自身微秒> | <累计微秒> | <缩进><模块名>"，无缩进的为顶层导入
+        packages = {}
+        for line in completed.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|", 2)
+            if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+                packages[name.strip()] = int(cumulative) / 1000
+        total = sum(packages.values())
+        if best_total is None or total < best_total:
+            best_total, best_packages = total, packages
+        eager = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    slowest = sorted(best_packages.items(), key=lambda item: -item[1])[:10]
+    return {
+        "import_ms": round(best_total, 1),
+        "slowest": {name: round(ms, 1) for name, ms in slowest},
+        "eager_heavy_modules": eager
+    }
+
+
+async def bench_end_to_end(user_counts: List[int], concurrency: int, seed: int) -> Dict[str, Any]:
+    """不同用户数下完整模拟流程的耗时与吞吐量"""
+    llm_client = ViralPredictionLLM(provider="mock", model=BENCHMARK_MODEL)
+    llm_client.client.chat.completions.reset(seed)
+    prompt_a = build_prompt(PLATFORM, CONTENT_A)
+    prompt_b = build_prompt(PLATFORM, CONTENT_B)
+    profile = MOCK_PROFILES[BENCHMARK_MODEL]
+
+    results = {}
+    for users in user_counts:
+        # 每个用户一次调用，测量的是逐调用的调度与解析开销（与多候选采样无关）
+        config = SimulationConfig(max_users=users, max_concurrency=concurrency, choices_per_call=1)
+        started_at = time.perf_counter()
+        run_result = await run_ab_test(llm_client, prompt_a, prompt_b, config)
+        elapsed = time.perf_counter() - started_at
+        metrics = run_result.metrics.summary()[0]
+        # 理想耗时：所有调用按并发上限、以中位延迟完成；超出部分为调度与解析等开销
+        ideal = np.ceil(run_result.total_calls / concurrency) * profile.median_latency
+        results[str(users)] = {
+            "elapsed_s": round(elapsed, 3),
+            "calls_per_s": round(run_result.total_calls / elapsed, 1),
+            "p50_s": metrics["p50_s"],
+            "p95_s": metrics["p95_s"],
+            "overhead_s": round(max(elapsed - ideal, 0.0), 3),
+            "failed": run_result.failed
+        }
+    return results
+
+
+async def bench_streaming(users: int, concurrency: int, latency: float, seed: int) -> Dict[str, Any]:
+    """同一推理模型下完整响应与流式（结果完整即停止）两种模式的耗时与输出token数"""
+    set_mock_profile(STREAMING_MODEL, median_latency=latency)
+    prompt_a = build_prompt(PLATFORM, CONTENT_A)
+    prompt_b = build_prompt(PLATFORM, CONTENT_B)
+    config = SimulationConfig(max_users=users, max_concurrency=concurrency)
+
+    results = {}
+    for mode, stream in (("full", False), ("stream", True)):
+        llm_client = ViralPredictionLLM(provider="mock", model=STREAMING_MODEL, stream=stream)
+        llm_client.client.chat.completions.reset(seed)
+        started_at = time.perf_counter()
+        run_result = await run_ab_test(llm_client, prompt_a, prompt_b, config)
+        elapsed = time.perf_counter() - started_at
+        metrics = run_result.metrics.summary()[0]
+        results[mode] = {
+            "elapsed_s": round(elapsed, 3),
+            "p50_s": metrics["p50_s"],
+            "p95_s": metrics["p95_s"],
+            "result_p50_s": metrics["result_p50_s"],
+            "output_tokens_mean": metrics["output_tokens_mean"],
+            "aborted": metrics["aborted"],
+            "failed": run_result.failed
+        }
+    results["output_token_saving"] = round(
+        1 - results["stream"]["output_tokens_mean"] / results["full"]["output_tokens_mean"], 3
+    )
+    return results
+
+
+async def bench_accuracy(users: int, repeats: int, seed: int) -> Dict[str, Any]:
+    """
+    统计准确性：A/B内容真实概率不同时检出差异的比例（检验效能）、A/A内容的误报率，
+    以及 like 人均差值置信区间对真实差值的覆盖率
+    """
+    llm_client = ViralPredictionLLM(provider="mock", model=BENCHMARK_MODEL)
+    llm_client.client.chat.completions.reset(seed)
+    prompt_a = build_prompt(PLATFORM, CONTENT_A)
+    prompt_b = build_prompt(PLATFORM, CONTENT_B)
+    true_diff = true_rates(prompt_a)["like"] - true_rates(prompt_b)["like"]
+    config = SimulationConfig(max_users=users, max_concurrency=50)
+    rng = np.random.default_rng(seed)
+
+    detected = false_positives = covered = 0
+    for _ in range(repeats):
+        ab = (await run_ab_test(llm_client, prompt_a, prompt_b, config)).compare(rng=rng)
+        like = ab.metric("like")
+        if ab.significant[ab.metrics.index("total")]:
+            detected += 1
+        if like["ci_low"] <= true_diff <= like["ci_high"]:
+            covered += 1
+
+        aa = (await run_ab_test(llm_client, prompt_a, prompt_a, config)).compare(n_bootstrap=0)
+        if aa.significant.any():
+            false_positives += 1
+
+    return {
+        "users": users,
+        "repeats": repeats,
+        "true_like_diff": round(true_diff, 4),
+        "power": round(detected / repeats, 3),
+        "false_positive_rate": round(false_positives / repeats, 3),
+        "ci_coverage": round(covered / repeats, 3)
+    }
+
+
+async def bench_personas(users: int, repeats: int, seed: int) -> Dict[str, Any]:
+    """
+    受众画像配对设计：同一批数据上分层配对检验与独立两样本检验的比较。
+    variance_ratio 为总互动数人均差值估计的方差之比（配对/独立），即达到相同置信度所需用户数的比例
+    """
+    llm_client = ViralPredictionLLM(provider="mock", model=BENCHMARK_MODEL)
+    llm_client.client.chat.completions.reset(seed)
+    prompt_a = build_prompt(PLATFORM, CONTENT_A)
+    prompt_b = build_prompt(PLATFORM, CONTENT_B)
+    population = get_population(PLATFORM)
+    weights = np.array([persona.weight for persona in population])
+    weights = weights / weights.sum()
+    true_diff = sum(weight * (true_rates(persona_prompt(prompt_a, persona))["like"]
+                              - true_rates(persona_prompt(prompt_b, persona))["like"])
+                    for weight, persona in zip(weights, population))
+    rng = np.random.default_rng(seed)
+
+    detected = detected_unpaired = covered = 0
+    ratios = []
+    for repeat in range(repeats):
+        config = SimulationConfig(max_users=users, max_concurrency=50, personas=True, persona_seed=seed + repeat)
+        result = await run_ab_test(llm_client, prompt_a, prompt_b, config, platform=PLATFORM)
+        paired = result.compare(rng=rng)
+        values_a = with_total(result.aggregator.paired_values("A")).astype(np.float64)
+        values_b = with_total(result.aggregator.paired_values("B")).astype(np.float64)
+        unpaired = compare_variants(values_a, values_b, metrics=paired.metrics, n_bootstrap=0)
+
+        total = paired.metrics.index("total")
+        detected += bool(paired.significant[total])
+        detected_unpaired += bool(unpaired.significant[total])
+        like_result = paired.metric("like")
+        if like_result["ci_low"] <= true_diff <= like_result["ci_high"]:
+            covered += 1
+
+        strata = result.personas.strata[result.aggregator.paired_users()]
+        _, paired_variance, _ = stratified_mean(values_a - values_b, strata, result.personas.weights)
+        n = len(values_a)
+        unpaired_variance = (values_a.var(axis=0, ddof=1) + values_b.var(axis=0, ddof=1)) / n
+        ratios.append(paired_variance / unpaired_variance)
+
+    ratios = np.mean(ratios, axis=0)
+    return {
+        "users": users,
+        "repeats": repeats,
+        "true_like_diff": round(true_diff, 4),
+        "power": round(detected / repeats, 3),
+        "unpaired_power": round(detected_unpaired / repeats, 3),
+        "ci_coverage": round(covered / repeats, 3),
+        "variance_ratio": round(float(ratios[total]), 3),
+        "like_variance_ratio": round(float(ratios[paired.metrics.index("like")]), 3)
+    }
+
+
+def bench_dedup(entries: int, queries: int, seed: int) -> Dict[str, Any]:
+    """
+    近似重复内容索引：在 entries 条已模拟内容中查找改动了空白、标点、表情或一个词的内容，
+    测量查找耗时、召回率，以及全新内容被误判为近似重复的比例
+    """
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+
+    def word() -> str:
+        return "".join(rng.choice(letters) for _ in range(rng.randint(2, 9)))
+
+    def post() -> str:
+        return " ".join(word() for _ in range(rng.randint(15, 40)))
+
+    def edit(content: str) -> str:
+        words = content.split()
+        kind = rng.randrange(4)
+        if kind == 0:
+            return "  ".join(words) + "\n"
+        if kind == 1:
+            return ", ".join(words).capitalize() + "!!"
+        if kind == 2:
+            return content + " 🚀🔥"
+        words[rng.randrange(len(words))] = word()
+        return " ".join(words)
+
+    index = ContentIndex(":memory:")
+    contents = [post() for _ in range(entries)]
+    started_at = time.perf_counter()
+    for content in contents:
+        index.add(PLATFORM, f"mock/{BENCHMARK_MODEL}", "en", content, 20)
+    build_s = time.perf_counter() - started_at
+
+    latencies, found = [], 0
+    for content in rng.sample(contents, queries):
+        query = edit(content)
+        started_at = time.perf_counter()
+        similar = index.lookup(PLATFORM, f"mock/{BENCHMARK_MODEL}", "en", query)
+        latencies.append(time.perf_counter() - started_at)
+        found += similar is not None and similar.content == content
+    false_positives = sum(index.lookup(PLATFORM, f"mock/{BENCHMARK_MODEL}", "en", post()) is not None
+                          for _ in range(queries))
+    index.close()
+
+    latencies_us = np.array(latencies) * 1e6
+    return {
+        "entries": entries,
+        "queries": queries,
+        "add_us": round(build_s / entries * 1e6, 1),
+        "lookup_p50_us": round(float(np.percentile(latencies_us, 50)), 1),
+        "lookup_p95_us": round(float(np.percentile(latencies_us, 95)), 1),
+        "recall": round(found / queries, 3),
+        "false_positive_rate": round(false_positives / queries, 4)
+    }
+
+
+def find_regressions(current: Any, baseline: Any, tolerance: float, path: str = "") -> List[str]:
+    """递归比较结果与基线，返回超出容差的退化描述"""
+    regressions = []
+    if isinstance(current, dict) and isinstance(baseline, dict):
+        for key, value in current.items():
+            if key in baseline:
+                regressions.extend(find_regressions(value, baseline[key], tolerance, f"{path}.{key}" if path else key))
+        return regressions
+
+    metric = path.rsplit(".", 1)[-1]
+    direction = DIRECTIONS.get(metric)
+    if direction is None or not isinstance(current, (int, float)) or not isinstance(baseline, (int, float)):
+        return regressions
+    if direction > 0 and current < baseline * (1 - tolerance):
+        regressions.append(f"{path}: {current} < 基线 {baseline}")
+    elif direction < 0 and current > baseline * (1 + tolerance) and current - baseline > 1e-3:
+        regressions.append(f"{path}: {current} > 基线 {baseline}")
+    return regressions
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="基于离线模拟提供商的基准测试")
+    parser.add_argument("-o", "--output", default=None, help="结果JSON文件")
+    parser.add_argument("--baseline", default=None, help="基线结果JSON文件，用于检测性能退化")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对退化幅度")
+    parser.add_argument("--users", type=int, nargs="+", default=[20, 100, 500], help="端到端测试的每版本用户数")
+    parser.add_argument("--concurrency", type=int, default=20, help="端到端测试的最大并发数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟模型的延迟中位数（秒）")
+    parser.add_argument("--stream-latency", type=float, default=0.1, help="流式对比测试中推理模型的延迟中位数（秒）")
+    parser.add_argument("--repeats", type=int, default=20, help="准确性测试的重复次数")
+    parser.add_argument("--accuracy-users", type=int, default=100, help="准确性测试的每版本用户数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--import-repeats", type=int, default=5, help="导入耗时测试的重复次数")
+    parser.add_argument("--dedup-entries", type=int, default=50000, help="近似重复索引测试中已模拟内容的条数")
+    parser.add_argument("--skip", nargs="*", default=[],
+                        choices=["imports", "parser", "stats", "end_to_end", "streaming", "accuracy", "personas", "dedup"],
+                        help="跳过的测试")
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """执行所有基准测试"""
+    set_mock_profile(BENCHMARK_MODEL, median_latency=args.latency)
+    results: Dict[str, Any] = {"config": {
+        "model": BENCHMARK_MODEL, "latency": args.latency, "concurrency": args.concurrency, "seed": args.seed
+    }}
+    if "imports" not in args.skip:
+        results["imports"] = bench_imports(args.import_repeats)
+        logger.info(f"导入耗时: {results['imports']}")
+    if "parser" not in args.skip:
+        results["parser"] = bench_parser(samples=5000, seed=args.seed)
+        logger.info(f"解析器: {results['parser']}")
+    if "stats" not in args.skip:
+        results["stats"] = bench_stats(comparisons=1000, users=100, seed=args.seed)
+        logger.info(f"统计引擎: {results['stats']}")
+    if "end_to_end" not in args.skip:
+        results["end_to_end"] = await bench_end_to_end(args.users, args.concurrency, args.seed)
+        logger.info(f"端到端: {results['end_to_end']}")
+    if "streaming" not in args.skip:
+        results["streaming"] = await bench_streaming(50, args.concurrency, args.stream_latency, args.seed)
+        logger.info(f"流式对比: {results['streaming']}")
+    if "accuracy" not in args.skip:
+        results["accuracy"] = await bench_accuracy(args.accuracy_users, args.repeats, args.seed)
+        logger.info(f"准确性: {results['accuracy']}")
+    if "personas" not in args.skip:
+        results["personas"] = await bench_personas(args.accuracy_users, args.repeats, args.seed)
+        logger.info(f"受众画像配对: {results['personas']}")
+    if "dedup" not in args.skip:
+        results["dedup"] = bench_dedup(args.dedup_entries, queries=2000, seed=args.seed)
+        logger.info(f"近似重复索引: {results['dedup']}")
+    return results
+
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # 逐次调用的日志会淹没基准测试结果
+    logging.getLogger("llms").setLevel(logging.WARNING)
+    logging.getLogger("simulation").setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    regressions = []
+    eager = results.get("imports", {}).get("eager_heavy_modules")
+    if eager:
+        regressions.append(f"界面启动时提前导入了重量级依赖: {eager}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions.extend(find_regressions(results, baseline, args.tolerance))
+    for regression in regressions:
+        logger.error(f"性能退化: {regression}")
+    if regressions:
+        return 1
+    if args.baseline:
+        logger.info("未发现超出容差的退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,52 +3,100 @@
 包含各个LLM提供商的配置信息
 """
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 # 模型配置
+# rate_limits: 每分钟请求数(rpm)与每分钟token数(tpm)预算，None表示不限制；请按账户等级调整
 MODEL_CONFIGS = {
     "openai": {
         "base_url": os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
         "api_key": os.getenv("OPENAI_API_KEY", ""),
-        "models": ["gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"]
+        "models": ["gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"],
+        "rate_limits": {"rpm": 500, "tpm": 200000}
     },
     "openrouter": {
         "base_url": os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
         "api_key": os.getenv("OPENROUTER_API_KEY", ""),
-        "models": ["openai/gpt-4o", "anthropic/claude-3-opus", "anthropic/claude-3-sonnet"]
+        "models": ["openai/gpt-4o", "anthropic/claude-3-opus", "anthropic/claude-3-sonnet"],
+        "rate_limits": {"rpm": 200, "tpm": None}
     },
     "siliconflow": {
         "base_url": os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1"),
         "api_key": os.getenv("SILICONFLOW_API_KEY", ""),
-        "models": ["Pro/deepseek-ai/DeepSeek-R1", "Pro/deepseek-ai/DeepSeek-V3"]
+        "models": ["Pro/deepseek-ai/DeepSeek-R1", "Pro/deepseek-ai/DeepSeek-V3"],
+        "rate_limits": {"rpm": 1000, "tpm": 50000}
     },
     "nebius": {
         "base_url": os.getenv("Nebius_BASE_URL", "https://api.studio.nebius.ai/v1"),
         "api_key": os.getenv("Nebius_DeepSeek_API_KEY", ""),
-        "models": ["deepseek-ai/DeepSeek-V3"]
+        "models": ["deepseek-ai/DeepSeek-V3"],
+        "rate_limits": {"rpm": 600, "tpm": 400000}
     },
     "aliyun": {
         "base_url": os.getenv("ALIYUN_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
         "api_key": os.getenv("ALIYUN_API_KEY", ""),
-        "models": ["qwen-max-latest", "deepseek-v3", "deepseek-r1"]
+        "models": ["qwen-max-latest", "deepseek-v3", "deepseek-r1"],
+        "rate_limits": {"rpm": 600, "tpm": 1000000}
     },
     "zhipuai": {
         "base_url": os.getenv("ZHIPUAI_BASE_URL", "https://open.bigmodel.cn/api/paas/v4"),
         "api_key": os.getenv("ZHIPUAI_API_KEY", ""),
-        "models": ["glm-4-plus", "glm-4"]
+        "models": ["glm-4-plus", "glm-4"],
+        "rate_limits": {"rpm": 300, "tpm": None}
     },
     "deepseek": {
         "base_url": os.getenv("DeepSeek_BASE_URL", "https://api.deepseek.com/v1"),
         "api_key": os.getenv("DeepSeek_API_KEY", ""),
-        "models": ["deepseek-reasoner", "deepseek-coder"]
+        "models": ["deepseek-reasoner", "deepseek-coder"],
+        "rate_limits": {"rpm": None, "tpm": None}
     },
     "tencent": {
         "base_url": os.getenv("TENCENT_BASE_URL", "https://api.lkeap.cloud.tencent.com/v1"),
         "api_key": os.getenv("TENCENT_API_KEY", ""),
-        "models": ["deepseek-r1", "hunyuan"]
+        "models": ["deepseek-r1", "hunyuan"],
+        "rate_limits": {"rpm": 300, "tpm": None}
+    },
+    # 离线模拟提供商（进程内，无需API密钥与网络），行为见 llms.mock_provider.MOCK_PROFILES
+    "mock": {
+        "base_url": "mock://local",
+        "api_key": "mock",
+        "models": ["mock-fast", "mock-realistic", "mock-reasoner", "mock-flaky"],
+        "rate_limits": {"rpm": None, "tpm": None}
     }
 }
 
+# 各模型的价格（美元/百万token）与输出token规模；请按实际账单调整
+# max_tokens: 单用户调用的输出上限（推理模型需要为思考过程预留更多token）
+# typical_output_tokens: 单用户调用的典型输出token数（含思考过程），用于运行前估算
+# typical_latency: 单次调用的典型耗时（秒），用于运行前估算
+# cached_input_price: 命中提供商前缀缓存的输入token价格（未配置时按 input_price 计）
+MODEL_PROFILES = {
+    "gpt-4o": {"input_price": 2.5, "cached_input_price": 1.25, "output_price": 10.0, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 1.5},
+    "gpt-4-turbo": {"input_price": 10.0, "output_price": 30.0, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 3.0},
+    "gpt-3.5-turbo": {"input_price": 0.5, "output_price": 1.5, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 1.0},
+    "openai/gpt-4o": {"input_price": 2.5, "cached_input_price": 1.25, "output_price": 10.0, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 2.0},
+    "anthropic/claude-3-opus": {"input_price": 15.0, "output_price": 75.0, "max_tokens": 256, "typical_output_tokens": 50, "typical_latency": 4.0},
+    "anthropic/claude-3-sonnet": {"input_price": 3.0, "output_price": 15.0, "max_tokens": 256, "typical_output_tokens": 50, "typical_latency": 2.5},
+    "Pro/deepseek-ai/DeepSeek-R1": {"input_price": 0.55, "output_price": 2.2, "max_tokens": 4096, "typical_output_tokens": 800, "typical_latency": 20.0},
+    "Pro/deepseek-ai/DeepSeek-V3": {"input_price": 0.27, "output_price": 1.1, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 3.0},
+    "deepseek-ai/DeepSeek-V3": {"input_price": 0.5, "output_price": 1.5, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 3.0},
+    "qwen-max-latest": {"input_price": 1.6, "output_price": 6.4, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 2.5},
+    "deepseek-v3": {"input_price": 0.27, "cached_input_price": 0.07, "output_price": 1.1, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 3.0},
+    "deepseek-r1": {"input_price": 0.55, "cached_input_price": 0.14, "output_price": 2.2, "max_tokens": 4096, "typical_output_tokens": 800, "typical_latency": 20.0},
+    "glm-4-plus": {"input_price": 0.7, "output_price": 0.7, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 2.0},
+    "glm-4": {"input_price": 0.14, "output_price": 0.14, "max_tokens": 256, "typical_output_tokens": 40, "typical_latency": 2.0},
+    "deepseek-reasoner": {"input_price": 0.55, "cached_input_price": 0.14, "output_price": 2.19, "max_tokens": 4096, "typical_output_tokens": 800, "typical_latency": 20.0},
+    "deepseek-coder": {"input_price": 0.27, "cached_input_price": 0.07, "output_price": 1.1, "max_tokens": 512, "typical_output_tokens": 60, "typical_latency": 3.0},
+    "hunyuan": {"input_price": 0.6, "output_price": 2.0, "max_tokens": 512, "typical_output_tokens": 60, "typical_latency": 3.0},
+    "mock-fast": {"input_price": 0.0, "output_price": 0.0, "max_tokens": 256, "typical_output_tokens": 20, "typical_latency": 0.05},
+    "mock-realistic": {"input_price": 0.0, "output_price": 0.0, "max_tokens": 256, "typical_output_tokens": 25, "typical_latency": 1.0},
+    "mock-reasoner": {"input_price": 0.0, "output_price": 0.0, "max_tokens": 4096, "typical_output_tokens": 300, "typical_latency": 3.5},
+    "mock-flaky": {"input_price": 0.0, "output_price": 0.0, "max_tokens": 256, "typical_output_tokens": 25, "typical_latency": 0.4}
+}
+
+# 未收录模型使用的默认配置（价格未知时按0计，只统计token）
+DEFAULT_MODEL_PROFILE = {"input_price": 0.0, "output_price": 0.0, "max_tokens": 1024, "typical_output_tokens": 200, "typical_latency": 5.0}
+
 # 不支持JSON输出格式的模型列表
 NON_JSON_FORMAT_MODELS = [
     "deepseek-reasoner",  # DeepSeek的推理模型不支持JSON输出
@@ -56,6 +104,37 @@ NON_JSON_FORMAT_MODELS = [
     "hunyuan"             # 腾讯混元模型可能不支持
 ]
 
+# 支持在一次请求中返回多个独立候选（API 的 n 参数）的提供商及单次请求的候选数上限；
+# 未列出的提供商（如 DeepSeek、OpenRouter）忽略或拒绝 n>1，每次请求只采样一个用户
+MULTI_CHOICE_PROVIDERS = {
+    "openai": 16,
+    "mock": 16
+}
+
+# 所在提供商支持、但模型本身不支持 n>1 的模型
+NON_MULTI_CHOICE_MODELS = []
+
+# 流式调用支持 stream_options={"include_usage": True}（在最后一个数据块中返回用量）的提供商；
+# 未列出的提供商可能拒绝未知参数，流式调用不发送该参数，用量按已收到的文本估算
+STREAM_USAGE_PROVIDERS = ["openai", "openrouter", "deepseek", "aliyun", "nebius", "mock"]
+
+# 限流与重试配置（所有提供商共用）
+RETRY_CONFIG = {
+    "max_retries": int(os.getenv("LLM_MAX_RETRIES", "5")),           # 最大重试次数
+    "base_delay": float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),   # 指数退避的初始等待秒数
+    "max_delay": float(os.getenv("LLM_RETRY_MAX_DELAY", "30")),      # 单次等待的最大秒数
+    "burst_seconds": 10                                             # 令牌桶容量相当于多少秒的配额
+}
+
+# HTTP连接池配置（所有提供商共用）
+HTTP_POOL_CONFIG = {
+    "max_connections": int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100")),            # 每个客户端的最大连接数
+    "max_keepalive_connections": int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "50")),     # 保持活动的空闲连接数
+    "keepalive_expiry": float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "300")),        # 空闲连接保留秒数
+    "timeout": float(os.getenv("LLM_HTTP_TIMEOUT", "120")),                          # 请求超时秒数
+    "connect_timeout": float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10"))            # 建立连接超时秒数
+}
+
 def get_available_providers() -> List[str]:
     """获取所有可用的模型提供商"""
     return list(MODEL_CONFIGS.keys())
@@ -72,6 +151,24 @@ def get_provider_config(provider: str) -> Dict[str, Any]:
         return MODEL_CONFIGS[provider]
     raise ValueError(f"不支持的提供商: {provider}。支持的提供商: {list(MODEL_CONFIGS.keys())}")
 
+def get_rate_limits(provider: str) -> Dict[str, Optional[int]]:
+    """获取指定提供商的限流配置"""
+    return get_provider_config(provider).get("rate_limits", {"rpm": None, "tpm": None})
+
+def get_model_profile(model: str) -> Dict[str, Any]:
+    """获取指定模型的价格与输出token配置，未收录的模型返回默认配置"""
+    return MODEL_PROFILES.get(model, DEFAULT_MODEL_PROFILE)
+
 def supports_json_format(model: str) -> bool:
     """检查模型是否支持JSON输出格式"""
     return model not in NON_JSON_FORMAT_MODELS
+
+def supports_stream_usage(provider: str) -> bool:
+    """检查提供商的流式调用是否支持 stream_options 返回用量"""
+    return provider in STREAM_USAGE_PROVIDERS
+
+def get_max_choices(provider: str, model: str) -> int:
+    """单次请求可返回的候选数上限（不支持 n 参数时为1）"""
+    if model in NON_MULTI_CHOICE_MODELS:
+        return 1
+    return MULTI_CHOICE_PROVIDERS.get(provider, 1)
@@ -0,0 +1,197 @@
+"""
+LLM响应缓存
+基于SQLite的持久化、内容寻址缓存：以 (provider, model, prompt, temperature, 样本序号) 的哈希为键，
+保存原始返回文本与解析后的互动指标，支持按条目数/大小与过期时间淘汰，以及零网络调用的回放模式
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认缓存文件位置（可通过环境变量覆盖）
+DEFAULT_CACHE_PATH = os.getenv(
+    "VIRAL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "responses.sqlite3")
+)
+
+# 默认淘汰策略
+DEFAULT_MAX_ENTRIES = 200_000
+DEFAULT_MAX_SIZE_MB = 256
+DEFAULT_MAX_AGE_DAYS = 30
+
+# 每写入多少条记录检查一次淘汰
+EVICTION_INTERVAL = 500
+
+
+class CacheMissError(Exception):
+    """回放模式下缓存未命中"""
+
+
+class ResponseCache:
+    """
+    持久化的LLM响应缓存
+
+    同一个实例可以在多个线程和协程之间共享
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_size_mb: float = DEFAULT_MAX_SIZE_MB, max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        """
+        打开（或创建）缓存数据库
+
+        Args:
+            path: SQLite文件路径
+            max_entries: 最大条目数
+            max_size_mb: 缓存内容的最大总大小（MB）
+            max_age_days: 条目的最长保留天数
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 86400
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                raw TEXT NOT NULL,
+                engagement TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at)")
+        self._writes_since_eviction = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.evict()
+
+    @staticmethod
+    def make_key(provider: str, model: str, prompt: str, temperature: float,
+                 sample_index: int, batch_size: int = 1) -> str:
+        """
+        生成缓存键
+
+        Args:
+            provider: 模型提供商
+            model: 模型名称
+            prompt: user 消息中的提示词（system 消息中的格式要求由 batch_size 决定）
+            temperature: 采样温度
+            sample_index: 样本序号（批量模式下为第一个用户的序号）
+            batch_size: 本次调用模拟的用户数
+
+        Returns:
+            SHA-256十六进制摘要
+        """
+        payload = json.dumps([provider, model, prompt, temperature, sample_index, batch_size], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存条目
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            {"raw": 原始返回文本, "engagement": 解析结果}；未命中或已过期时返回None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT raw, engagement, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[2] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        return {"raw": row[0], "engagement": json.loads(row[1])}
+
+    def put(self, key: str, provider: str, model: str, raw: str, engagement: Any):
+        """
+        写入缓存条目
+
+        Args:
+            key: 缓存键
+            provider: 模型提供商
+            model: 模型名称
+            raw: 模型原始返回文本
+            engagement: 解析后的互动指标（单个字典或字典列表）
+        """
+        engagement_json = json.dumps(engagement, ensure_ascii=False)
+        size = len(raw.encode("utf-8")) + len(engagement_json.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, raw, engagement_json, size, now, now)
+            )
+            self._writes_since_eviction += 1
+            should_evict = self._writes_since_eviction >= EVICTION_INTERVAL
+
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """按过期时间、条目数和总大小淘汰缓存（最久未访问的优先淘汰）"""
+        with self._lock:
+            self._writes_since_eviction = 0
+            expired = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            ).rowcount
+
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if count <= self.max_entries and total_size <= self.max_size_bytes:
+                if expired:
+                    logger.info(f"缓存淘汰: 过期 {expired} 条")
+                return
+
+            # 按访问时间从旧到新累计，找出需要保留的最新条目
+            removed = 0
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall()
+            to_delete = []
+            for key, size in rows:
+                if count - removed <= self.max_entries and total_size <= self.max_size_bytes:
+                    break
+                to_delete.append((key,))
+                removed += 1
+                total_size -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+        logger.info(f"缓存淘汰: 过期 {expired} 条, 超出容量 {removed} 条")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"entries": count, "size_bytes": total_size, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,27 @@
+"""
+调用上下文
+在一次预测任务内传递调用的附加信息（按 asyncio 任务隔离），供调度器记录结果来源、按运行统计用量与耗时
+"""
+from contextvars import ContextVar
+from typing import Any, Optional
+
+# 当前任务中最近一次成功预测由哪个 "provider/model" 提供
+served_by: ContextVar[Optional[str]] = ContextVar("served_by", default=None)
+
+# 当前运行的用量统计（llms.usage.UsageTracker），由模拟引擎在运行开始时设置
+run_usage: ContextVar[Optional[Any]] = ContextVar("run_usage", default=None)
+
+# 当前运行的调用指标（llms.metrics.MetricsRegistry），由模拟引擎在运行开始时设置
+run_metrics: ContextVar[Optional[Any]] = ContextVar("run_metrics", default=None)
+
+class RequestCounter:
+    """一次路由调用中实际发出的网络请求数；子任务复制上下文时共享同一对象，因此其中的请求也计入"""
+    def __init__(self):
+        self.requests = 0
+
+
+# 当前路由调用的网络请求计数（RequestCounter），由路由器设置，LLM客户端每发出一次请求加一；缓存命中不计
+network_requests: ContextVar[Optional[RequestCounter]] = ContextVar("network_requests", default=None)
+
+# 正在进行的调用的耗时记录（llms.metrics.CallTiming），供限流器与HTTP客户端钩子填写
+current_call: ContextVar[Optional[Any]] = ContextVar("current_call", default=None)
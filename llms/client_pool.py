@@ -0,0 +1,160 @@
+"""
+LLM客户端池
+进程级的 AsyncOpenAI 客户端注册表与常驻事件循环。
+httpx连接池中的连接绑定在创建它的事件循环上，因此共享客户端只应在常驻事件循环中使用：
+网络请求通过 run_on_shared_loop() 提交到该事件循环执行，使热连接和TLS会话在多次运行之间得以复用
+"""
+import os
+import sys
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Coroutine, Dict, Optional, Tuple
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.model_config import HTTP_POOL_CONFIG
+from llms.call_context import current_call
+from llms.mock_provider import MOCK_BASE_URL, MockAsyncClient
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+
+class EventLoopThread:
+    """在后台守护线程中常驻运行的事件循环"""
+    def __init__(self, name: str = "llm-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine):
+        """
+        提交协程到常驻事件循环，立即返回 concurrent.futures.Future
+
+        Args:
+            coro: 要执行的协程
+
+        Returns:
+            协程结果的Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        在常驻事件循环中执行协程并阻塞等待结果
+
+        Args:
+            coro: 要执行的协程
+            timeout: 超时秒数，为None时一直等待
+
+        Returns:
+            协程的返回值
+        """
+        return self.submit(coro).result(timeout)
+
+
+async def _record_first_byte(response: "httpx.Response"):
+    """httpx响应钩子：收到响应头（读取响应体之前）时记录首字节时间"""
+    timing = current_call.get()
+    if timing is not None:
+        timing.mark_first_byte()
+
+
+_loop_thread: Optional[EventLoopThread] = None
+_clients: Dict[Tuple[str, str, str], "AsyncOpenAI"] = {}
+_lock = threading.Lock()
+
+
+def get_event_loop_thread() -> EventLoopThread:
+    """获取进程级常驻事件循环（首次调用时创建）"""
+    global _loop_thread
+    with _lock:
+        if _loop_thread is None:
+            _loop_thread = EventLoopThread()
+            logger.info("启动常驻事件循环")
+        return _loop_thread
+
+
+def run_coroutine(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """在进程级常驻事件循环中执行协程并等待结果"""
+    return get_event_loop_thread().run(coro, timeout)
+
+
+def get_async_client(provider: str, base_url: str, api_key: str) -> "AsyncOpenAI":
+    """
+    获取共享的 AsyncOpenAI 客户端（按 provider、base_url、api_key 复用）
+
+    Args:
+        provider: 模型提供商
+        base_url: API地址
+        api_key: API密钥
+
+    Returns:
+        配置了连接池上限与长连接保活的客户端
+    """
+    key = (provider, base_url, api_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None and base_url == MOCK_BASE_URL:
+            client = MockAsyncClient(seed=int(os.getenv("VIRAL_MOCK_SEED", "0")))
+            _clients[key] = client
+            logger.info(f"创建 {provider} 离线模拟客户端")
+        elif client is None:
+            # openai/httpx 导入较慢，延迟到第一次创建客户端时
+            import httpx
+            from openai import AsyncOpenAI
+
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_CONFIG["max_connections"],
+                    max_keepalive_connections=HTTP_POOL_CONFIG["max_keepalive_connections"],
+                    keepalive_expiry=HTTP_POOL_CONFIG["keepalive_expiry"]
+                ),
+                timeout=httpx.Timeout(HTTP_POOL_CONFIG["timeout"], connect=HTTP_POOL_CONFIG["connect_timeout"]),
+                follow_redirects=True,
+                event_hooks={"response": [_record_first_byte]}
+            )
+            # 重试由 llms.rate_limiter 统一处理，关闭SDK自带的重试
+            client = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
+            _clients[key] = client
+            logger.info(f"创建 {provider} 共享客户端: {base_url}")
+        return client
+
+
+async def close_all_clients():
+    """关闭所有共享客户端（需在常驻事件循环中调用）"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        await client.close()
+
+
+async def run_on_shared_loop(coro: Coroutine) -> Any:
+    """
+    在常驻事件循环中执行协程，并在当前事件循环中等待其结果
+
+    调用方所在的事件循环（例如Streamlit脚本线程中的 asyncio.run）每次运行都会重建，
+    而网络请求始终在常驻事件循环中执行，从而复用共享客户端的连接池。
+    取消等待方会同时取消常驻事件循环中的任务
+
+    Args:
+        coro: 要执行的协程
+
+    Returns:
+        协程的返回值
+    """
+    loop_thread = get_event_loop_thread()
+    if asyncio.get_running_loop() is loop_thread.loop:
+        return await coro
+    return await asyncio.wrap_future(loop_thread.submit(coro))
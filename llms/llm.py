@@ -1,17 +1,24 @@
 import os
-import json
-from typing import Dict, Any, Optional, List
-from openai import AsyncOpenAI
+import asyncio
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Callable, Dict, Any, Optional, List, Tuple
 from dotenv import load_dotenv
 import logging
 import sys
-import re
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 导入模型配置
-from config.model_config import MODEL_CONFIGS, get_available_providers, get_available_models, get_provider_config, supports_json_format
+from config.model_config import MODEL_CONFIGS, get_available_providers, get_available_models, get_provider_config, get_model_profile, get_max_choices, supports_json_format, supports_stream_usage
+from llms.cache import ResponseCache, CacheMissError
+from llms.client_pool import get_async_client, run_on_shared_loop
+from llms.rate_limiter import LLMRequestError, call_with_rate_limit, estimate_tokens
+from llms.response_parser import PARSE_BATCH_SHORT, ResponseParseError, ResponseParser, StreamingJsonScanner, batch_items, is_engagement
+from llms.call_context import current_call, network_requests, run_metrics, run_usage, served_by
+from llms.metrics import MODE_FULL, MODE_STREAM, CallTiming, get_metrics_registry
+from llms.usage import STATUS_BUDGET_EXCEEDED, UsageTracker, usage_from_completion
 
 # 配置日志记录器
 logger = logging.getLogger(__name__)
@@ -19,24 +26,61 @@ logger = logging.getLogger(__name__)
 # 加载环境变量
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env'))
 
+# 采样温度
+TEMPERATURE = 0.7
+
+# 批量模式下为每个模拟用户额外预留的输出token数
+BATCH_TOKENS_PER_USER = 48
+
+# 输出格式要求放在每次调用最前面的 system 消息中，随平台与内容变化的提示词放在其后的 user 消息中：
+# 同一次运行（乃至跨运行）的所有调用因此共享同一前缀，可命中提供商侧的前缀缓存（如 DeepSeek 的上下文缓存），
+# 降低首字节时间与输入token费用。格式要求只取决于批量大小，因此缓存键只需包含 user 消息与批量大小
+SINGLE_FORMAT_INSTRUCTION = "请以JSON格式返回结果，格式如下：\n{\"like\": 数字, \"comment\": 数字, \"share\": 数字, \"quote\": 数字}\n请确保返回的是有效的JSON格式，不要添加额外的文本。数值必须是整数，不要使用布尔值。"
+BATCH_FORMAT_INSTRUCTION = "请模拟{batch_size}位背景、兴趣各不相同的用户，分别给出每位用户的反应。请以JSON格式返回结果，格式如下：\n{{\"users\": [{{\"like\": 数字, \"comment\": 数字, \"share\": 数字, \"quote\": 数字}}, ...]}}\nusers数组必须恰好包含{batch_size}个对象，每个对象对应一位用户。请确保返回的是有效的JSON格式，不要添加额外的文本。数值必须是整数，不要使用布尔值。"
+
+
+def build_messages(prompt: str, batch_size: int = 1) -> List[Dict[str, str]]:
+    """
+    组装对话消息：固定的格式要求作为 system 消息在前，提示词作为 user 消息在后
+
+    Args:
+        prompt: 平台与内容提示词
+        batch_size: 本次调用模拟的用户数
+
+    Returns:
+        消息列表
+    """
+    instruction = SINGLE_FORMAT_INSTRUCTION if batch_size <= 1 else BATCH_FORMAT_INSTRUCTION.format(batch_size=batch_size)
+    return [
+        {"role": "system", "content": instruction},
+        {"role": "user", "content": prompt}
+    ]
+
 class ViralPredictionLLM:
     """
     统一的LLM接口，用于内容病毒性预测
     """
-    def __init__(self, provider: str = "openrouter", model: Optional[str] = None):
+    def __init__(self, provider: str = "openrouter", model: Optional[str] = None,
+                 cache: Optional[ResponseCache] = None, replay: bool = False, stream: bool = False):
         """
         初始化LLM客户端
         
         Args:
             provider: 模型提供商 (openai, openrouter, siliconflow, etc.)
             model: 模型名称，如果为None则使用该提供商的第一个模型
+            cache: 响应缓存，为None时不使用缓存
+            replay: 回放模式，只从缓存读取结果，不发起任何网络调用
+            stream: 流式读取响应，完整的互动指标JSON一出现就关闭连接，不再等待（和支付）之后的输出
         """
         if provider not in MODEL_CONFIGS:
             raise ValueError(f"不支持的提供商: {provider}。支持的提供商: {list(MODEL_CONFIGS.keys())}")
         
+        if replay and cache is None:
+            raise ValueError("回放模式需要启用响应缓存")
+        
         config = get_provider_config(provider)
         
-        if not config["api_key"]:
+        if not config["api_key"] and not replay:
             raise ValueError(f"{provider} API密钥未设置。请在.env文件中设置{provider.upper()}_API_KEY")
         
         # 如果未指定模型，使用该提供商的第一个模型
@@ -47,140 +91,402 @@ class ViralPredictionLLM:
         
         self.provider = provider
         self.model = model
-        self.client = AsyncOpenAI(
-            base_url=config["base_url"],
-            api_key=config["api_key"]
+        self.cache = cache
+        self.replay = replay
+        self.stream = stream
+        self.parser = ResponseParser()
+        # 单用户调用的输出token上限按模型配置（推理模型需要更多）
+        self.max_tokens = get_model_profile(model)["max_tokens"]
+        # 一次请求可返回的独立候选数上限（API 的 n 参数），调度器按此把用户分块
+        self.max_choices = get_max_choices(provider, model)
+        # 该客户端生命周期内的累计用量；单次运行的用量由引擎通过 run_usage 上下文单独统计
+        self.usage = UsageTracker()
+        # 使用进程级共享客户端复用连接池；回放模式下不创建API客户端
+        self.client = None if replay else get_async_client(
+            provider,
+            config["base_url"],
+            config["api_key"]
         )
         logger.info(f"初始化 {provider} 客户端，使用模型 {model}")
     
-    async def predict_engagement(self, prompt: str) -> Dict[str, Any]:
+    @contextmanager
+    def _track_call(self):
+        """
+        记录一次网络调用的耗时指标（进程级指标与当前运行的指标）
+        
+        Yields:
+            本次调用的 CallTiming，由限流器、HTTP钩子与解析步骤填写
+        """
+        timing = CallTiming(self.provider, self.model, mode=MODE_STREAM if self.stream else MODE_FULL)
+        try:
+            yield timing
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                timing.status = "cancelled"
+            else:
+                timing.status = getattr(e, "reason", None) or "error"
+            raise
+        finally:
+            # 被预算拒绝的调用没有真正发出，不计入耗时指标
+            if timing.status != STATUS_BUDGET_EXCEEDED:
+                counter = network_requests.get()
+                if counter is not None:
+                    counter.requests += 1
+                timing.finish()
+                get_metrics_registry().record(timing)
+                registry = run_metrics.get()
+                if registry is not None:
+                    registry.record(timing)
+    
+    async def _create_completion(self, messages: List[Dict[str, str]], max_tokens: int,
+                                 timing: Optional[CallTiming] = None,
+                                 is_complete: Callable[[Any], bool] = is_engagement, n: int = 1):
+        """
+        发起一次对话补全调用
+        
+        Args:
+            messages: 对话消息（见 build_messages）
+            max_tokens: 每个候选的最大输出token数
+            timing: 本次调用的耗时记录
+            is_complete: 流式模式下判断已闭合的JSON值是否为完整结果
+            n: 请求的独立候选数
+            
+        Returns:
+            API返回的completion对象
+            
+        Raises:
+            LLMRequestError: 请求在限流重试后仍然失败
+            BudgetExceededError: 当前运行的预算已用完
+        """
+        backend = f"{self.provider}/{self.model}"
+        tracker = run_usage.get()
+        if tracker is not None:
+            tracker.check_budget(backend)
+        
+        # 请求在常驻事件循环中执行，以复用共享客户端的热连接
+        completion = await run_on_shared_loop(
+            self._create_completion_on_shared_loop(messages, max_tokens, timing, is_complete, n)
+        )
+        
+        usage = usage_from_completion(self.model, completion)
+        if timing is not None:
+            timing.mark_result()
+            timing.completion_tokens = usage.completion_tokens
+        self.usage.record(backend, usage)
+        if tracker is not None:
+            tracker.record(backend, usage)
+        return completion
+    
+    async def _create_completion_on_shared_loop(self, messages: List[Dict[str, str]], max_tokens: int,
+                                                timing: Optional[CallTiming] = None,
+                                                is_complete: Callable[[Any], bool] = is_engagement, n: int = 1):
+        """在常驻事件循环中、按提供商限流与重试策略发起对话补全调用"""
+        # 限流器与HTTP响应钩子通过上下文变量填写排队时间、重试次数与首字节时间
+        timing_token = current_call.set(timing)
+        try:
+            return await self._send_completion(messages, max_tokens, is_complete, n)
+        finally:
+            current_call.reset(timing_token)
+    
+    async def _send_completion(self, messages: List[Dict[str, str]], max_tokens: int,
+                               is_complete: Callable[[Any], bool] = is_engagement, n: int = 1):
+        """
+        按提供商限流与重试策略发起对话补全调用（流式模式下每次重试都重新读取整个流）
+        
+        多候选请求（n>1）不使用流式读取：各候选的输出交错到达，提前关闭会丢弃尚未完成的候选
+        """
+        request_args = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": TEMPERATURE,
+            "max_tokens": max_tokens
+        }
+        
+        # 对于支持JSON输出的模型，使用response_format参数
+        if supports_json_format(self.model):
+            request_args["response_format"] = {"type": "json_object"}
+        if n > 1:
+            request_args["n"] = n
+        
+        if self.stream and n == 1:
+            request = lambda: self._stream_completion(request_args, is_complete)
+        else:
+            request = lambda: self.client.chat.completions.create(**request_args)
+        return await call_with_rate_limit(
+            self.provider,
+            request,
+            estimated_tokens=sum(estimate_tokens(message["content"]) for message in messages) + max_tokens * n
+        )
+    
+    async def _stream_completion(self, request_args: Dict[str, Any], is_complete: Callable[[Any], bool]):
+        """
+        流式发起对话补全调用，增量扫描输出；完整结果出现后立即关闭流（连接断开后提供商停止生成）
+        
+        Args:
+            request_args: 对话补全请求参数
+            is_complete: 判断已闭合的JSON值是否为完整结果
+            
+        Returns:
+            与非流式调用结构相同的completion对象。提前关闭、或提供商不支持 stream_options 时收不到用量统计，
+            用量按已收到的文本估算（与限流器的估算方式相同）
+        """
+        if supports_stream_usage(self.provider):
+            request_args = {**request_args, "stream_options": {"include_usage": True}}
+        stream = await self.client.chat.completions.create(**request_args, stream=True)
+        scanner = StreamingJsonScanner(is_complete)
+        reasoning_chars = 0
+        usage = None
+        finish_reason = None
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                # DeepSeek 等提供商把思考过程放在单独的 reasoning_content 字段中，同样按输出计费
+                reasoning_chars += len(getattr(choice.delta, "reasoning_content", None) or "")
+                if scanner.feed(choice.delta.content or ""):
+                    break
+        finally:
+            await stream.close()
+        
+        if usage is None:
+            timing = current_call.get()
+            if timing is not None:
+                timing.aborted = finish_reason is None
+            prompt_tokens = sum(estimate_tokens(message["content"]) for message in request_args["messages"])
+            reasoning_tokens = reasoning_chars // 2
+            completion_tokens = estimate_tokens(scanner.text) + reasoning_tokens
+            usage = SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+                completion_tokens_details=SimpleNamespace(reasoning_tokens=reasoning_tokens)
+            )
+        
+        return SimpleNamespace(
+            model=self.model,
+            choices=[SimpleNamespace(
+                index=0,
+                finish_reason=finish_reason,
+                message=SimpleNamespace(role="assistant", content=scanner.text)
+            )],
+            usage=usage
+        )
+    
+    def _cache_key(self, prompt: str, sample_index: Optional[int], batch_size: int = 1) -> Optional[str]:
+        """生成响应缓存键；未启用缓存或未指定样本序号时返回None"""
+        if self.cache is None or sample_index is None:
+            return None
+        return self.cache.make_key(self.provider, self.model, prompt, TEMPERATURE, sample_index, batch_size)
+    
+    def _cache_lookup(self, cache_key: Optional[str]) -> Optional[Any]:
+        """
+        查询响应缓存
+        
+        Returns:
+            命中时返回缓存的解析结果，否则返回None
+            
+        Raises:
+            CacheMissError: 回放模式下未命中
+        """
+        if cache_key is None:
+            if self.replay:
+                raise CacheMissError("回放模式需要启用缓存并指定样本序号")
+            return None
+        
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached["engagement"]
+        if self.replay:
+            raise CacheMissError(f"回放模式下缓存未命中: {cache_key}")
+        return None
+    
+    async def predict_engagement(self, prompt: str, sample_index: Optional[int] = None) -> Dict[str, Any]:
         """
         使用LLM预测内容的参与度
         
         Args:
             prompt: 提示词
+            sample_index: 样本序号，用于响应缓存；为None时不使用缓存
             
         Returns:
             解析后的JSON响应
+            
+        Raises:
+            LLMRequestError: API调用在限流重试后仍然失败
+            ResponseParseError: 返回内容无法解析（原因计入 parser.metrics）
+            CacheMissError: 回放模式下缓存未命中
         """
-        try:
-            # 检查当前模型是否支持JSON输出格式
-            supports_json = supports_json_format(self.model)
+        cache_key = self._cache_key(prompt, sample_index)
+        cached = self._cache_lookup(cache_key)
+        if cached is not None:
+            served_by.set(f"{self.provider}/{self.model}")
+            return cached
+        
+        raw, result = await self._request_engagement(prompt)
+        # 只有成功解析的响应才会到达这里并写入缓存
+        if cache_key is not None:
+            self.cache.put(cache_key, self.provider, self.model, raw, result)
+        served_by.set(f"{self.provider}/{self.model}")
+        return result
+    
+    async def _request_engagement(self, prompt: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        调用LLM并解析单个用户的反应
+        
+        Args:
+            prompt: 提示词
             
-            # 如果模型不支持JSON输出，在提示词中添加JSON格式要求
-            if not supports_json:
-                # 添加明确的JSON格式要求
-                prompt = f"{prompt}\n\n请以JSON格式返回结果，格式如下：\n{{\"like\": 数字, \"comment\": 数字, \"share\": 数字, \"quote\": 数字}}\n请确保返回的是有效的JSON格式，不要添加额外的文本。数值必须是整数，不要使用布尔值。"
-                
-                # 创建API调用参数，不包含response_format
-                completion = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    temperature=0.7,
-                    max_tokens=1024
-                )
-            else:
-                # 对于支持JSON输出的模型，使用response_format参数
-                completion = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.7,
-                    max_tokens=1024
+        Returns:
+            (模型原始返回文本, 解析后的互动指标)
+            
+        Raises:
+            LLMRequestError: API调用失败或返回空响应
+            ResponseParseError: 返回内容无法解析
+        """
+        # 所有模型都在 system 消息中给出JSON格式要求（json_object 模式也要求消息中提到JSON）
+        with self._track_call() as timing:
+            completion = await self._create_completion(build_messages(prompt), max_tokens=self.max_tokens, timing=timing)
+            
+            if not (completion and hasattr(completion, 'choices') and completion.choices and len(completion.choices) > 0):
+                raise LLMRequestError("API返回空响应", self.provider)
+            
+            raw = completion.choices[0].message.content
+            with timing.parsing():
+                return raw, self.parser.parse_engagement(raw)
+    
+    async def predict_engagement_samples(self, prompt: str, n: int,
+                                         sample_index: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        用API的 n 参数在一次调用中独立采样多个用户（单用户提示词，每个候选对应一个用户）
+        
+        提示词在每次请求中只处理一次，输入token与排队开销由所有候选分摊。每个候选按各自的样本序号缓存，
+        与单用户模式共用缓存条目；返回的候选不足（超出提供商上限或被忽略）或无法解析时，
+        缺少的用户回退到单用户模式逐个补齐
+        
+        Args:
+            prompt: 提示词
+            n: 本次模拟的用户数
+            sample_index: 第一个用户的样本序号，用于响应缓存；为None时不使用缓存
+            
+        Returns:
+            长度为n的列表：互动指标字典，或补齐失败的用户对应的 LLMRequestError / ResponseParseError
+        """
+        if n <= 1:
+            return [await self.predict_engagement(prompt, sample_index=sample_index)]
+        
+        indexes = [None if sample_index is None else sample_index + offset for offset in range(n)]
+        cache_keys = [self._cache_key(prompt, index) for index in indexes]
+        results: List[Optional[Dict[str, Any]]] = [None] * n
+        for offset, cache_key in enumerate(cache_keys):
+            cached = self.cache.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                results[offset] = cached["engagement"]
+        
+        missing = [offset for offset in range(n) if results[offset] is None]
+        if missing and not self.replay:
+            with self._track_call() as timing:
+                completion = await self._create_completion(
+                    build_messages(prompt), max_tokens=self.max_tokens, timing=timing,
+                    n=min(len(missing), self.max_choices)
                 )
+                choices = getattr(completion, "choices", None) or []
+                with timing.parsing():
+                    for offset, choice in zip(missing, choices):
+                        raw = choice.message.content
+                        try:
+                            results[offset] = self.parser.parse_engagement(raw)
+                        except ResponseParseError:
+                            continue
+                        if cache_keys[offset] is not None:
+                            self.cache.put(cache_keys[offset], self.provider, self.model, raw, results[offset])
+                missing = [offset for offset in range(n) if results[offset] is None]
+                if missing:
+                    timing.status = PARSE_BATCH_SHORT
+        
+        if missing:
+            logger.warning(f"多候选结果不完整 ({n - len(missing)}/{n})，回退到单用户模式补齐 {len(missing)} 个用户")
+            # 回放模式下也从这里按样本序号读取缓存；补齐失败的用户以异常占位，不影响同一请求中已成功的用户
+            topped_up = await asyncio.gather(*(
+                self.predict_engagement(prompt, sample_index=indexes[offset]) for offset in missing
+            ), return_exceptions=True)
+            for offset, result in zip(missing, topped_up):
+                if isinstance(result, BaseException) and not isinstance(result, (LLMRequestError, ResponseParseError)):
+                    raise result
+                results[offset] = result
+        
+        served_by.set(f"{self.provider}/{self.model}")
+        return results
+    
+    async def predict_engagement_batch(self, prompt: str, batch_size: int,
+                                       sample_index: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        在一次LLM调用中模拟多个不同用户的反应
+        
+        返回的数组格式错误或数量不足时，缺少的用户回退到单用户模式逐个补齐。批量调用解析出的用户
+        （即使不足 batch_size 个）按批量缓存键缓存，补齐的用户按各自的样本序号缓存，回放时按同样方式重建
+        
+        Args:
+            prompt: 提示词
+            batch_size: 本次调用模拟的用户数
+            sample_index: 第一个用户的样本序号，用于响应缓存；为None时不使用缓存
             
-            if completion and hasattr(completion, 'choices') and completion.choices and len(completion.choices) > 0:
-                prediction = completion.choices[0].message.content
-                
-                # 对于不支持JSON输出的模型，尝试从文本中提取JSON
-                if not supports_json:
-                    # 尝试使用正则表达式提取JSON部分
-                    json_match = re.search(r'({[\s\S]*})', prediction)
-                    if json_match:
-                        prediction = json_match.group(1)
-                
-                try:
-                    # 尝试解析JSON
-                    json_data = json.loads(prediction)
-                    
-                    # 处理可能的布尔值返回
-                    result = {}
-                    for key in ["like", "comment", "share", "quote"]:
-                        if key in json_data:
-                            # 如果是布尔值，转换为0或1
-                            if isinstance(json_data[key], bool):
-                                result[key] = 1 if json_data[key] else 0
-                            # 如果是字符串，尝试转换为整数
-                            elif isinstance(json_data[key], str):
-                                try:
-                                    result[key] = int(json_data[key])
-                                except ValueError:
-                                    # 如果字符串无法转换为整数，检查是否为"true"或"false"
-                                    if json_data[key].lower() == "true":
-                                        result[key] = 1
-                                    elif json_data[key].lower() == "false":
-                                        result[key] = 0
-                                    else:
-                                        result[key] = 0
-                            else:
-                                # 如果是数字，直接使用
-                                result[key] = int(json_data[key])
-                        else:
-                            # 如果键不存在，设为0
-                            result[key] = 0
-                    
-                    return result
-                    
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON解析错误: {str(e)}, 内容: {prediction}")
-                    # 尝试使用正则表达式提取数值或布尔值
-                    try:
-                        # 提取like值
-                        like_match = re.search(r'"like"\s*:\s*(true|false|\d+)', prediction, re.IGNORECASE)
-                        like = 1 if like_match and like_match.group(1).lower() == "true" else 0
-                        if like_match and like_match.group(1).isdigit():
-                            like = int(like_match.group(1))
-                        
-                        # 提取comment值
-                        comment_match = re.search(r'"comment"\s*:\s*(true|false|\d+)', prediction, re.IGNORECASE)
-                        comment = 1 if comment_match and comment_match.group(1).lower() == "true" else 0
-                        if comment_match and comment_match.group(1).isdigit():
-                            comment = int(comment_match.group(1))
-                        
-                        # 提取share值
-                        share_match = re.search(r'"share"\s*:\s*(true|false|\d+)', prediction, re.IGNORECASE)
-                        share = 1 if share_match and share_match.group(1).lower() == "true" else 0
-                        if share_match and share_match.group(1).isdigit():
-                            share = int(share_match.group(1))
-                        
-                        # 提取quote值
-                        quote_match = re.search(r'"quote"\s*:\s*(true|false|\d+)', prediction, re.IGNORECASE)
-                        quote = 1 if quote_match and quote_match.group(1).lower() == "true" else 0
-                        if quote_match and quote_match.group(1).isdigit():
-                            quote = int(quote_match.group(1))
-                        
-                        return {"like": like, "comment": comment, "share": share, "quote": quote}
-                    except Exception as ex:
-                        logger.error(f"正则提取失败: {str(ex)}")
-                        # 如果正则提取失败，返回默认值
-                        return {"like": 0, "comment": 0, "share": 0, "quote": 0}
-            else:
-                logger.error("API返回空响应")
-                return {"like": 0, "comment": 0, "share": 0, "quote": 0}
-                
-        except Exception as e:
-            logger.error(f"调用API时出错: {str(e)}")
-            return {"like": 0, "comment": 0, "share": 0, "quote": 0}
+        Returns:
+            长度为batch_size的互动指标字典列表
+        """
+        if batch_size <= 1:
+            return [await self.predict_engagement(prompt, sample_index=sample_index)]
+        
+        cache_key = self._cache_key(prompt, sample_index, batch_size)
+        cached = self.cache.get(cache_key) if cache_key is not None else None
+        if cached is not None and len(cached["engagement"]) >= batch_size:
+            served_by.set(f"{self.provider}/{self.model}")
+            return cached["engagement"]
+        
+        results = [] if cached is None else list(cached["engagement"])
+        if cached is None and not self.replay:
+            # API调用失败（LLMRequestError）直接上抛，只有返回内容格式错误时才回退到单用户模式
+            with self._track_call() as timing:
+                completion = await self._create_completion(
+                    build_messages(prompt, batch_size),
+                    max_tokens=self.max_tokens + BATCH_TOKENS_PER_USER * batch_size,
+                    timing=timing,
+                    is_complete=lambda data: len(batch_items(data) or ()) >= batch_size
+                )
+                if completion and hasattr(completion, 'choices') and completion.choices and len(completion.choices) > 0:
+                    raw = completion.choices[0].message.content
+                    with timing.parsing():
+                        results = self.parser.parse_engagement_batch(raw, batch_size)
+                    if cache_key is not None and results:
+                        self.cache.put(cache_key, self.provider, self.model, raw, results)
+                else:
+                    logger.error("API返回空响应")
+                if len(results) < batch_size:
+                    timing.status = PARSE_BATCH_SHORT
+        
+        if len(results) < batch_size:
+            missing = batch_size - len(results)
+            logger.warning(f"批量结果不完整 ({len(results)}/{batch_size})，回退到单用户模式补齐 {missing} 个用户")
+            # 回退的单用户调用使用各自的样本序号缓存（回放模式下也从这里读取）
+            first_missing = None if sample_index is None else sample_index + len(results)
+            results.extend(await asyncio.gather(*(
+                self.predict_engagement(prompt, sample_index=None if first_missing is None else first_missing + offset)
+                for offset in range(missing)
+            )))
+        
+        served_by.set(f"{self.provider}/{self.model}")
+        return results
+    
+    def get_usage(self) -> Dict[str, Dict[str, Any]]:
+        """该客户端的累计token用量与费用"""
+        return self.usage.by_backend()
+    
+    def get_parse_stats(self) -> Dict[str, int]:
+        """各解析结果原因的计数"""
+        return self.parser.snapshot()
     
     @staticmethod
     def get_available_providers() -> List[str]:
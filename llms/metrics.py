@@ -0,0 +1,351 @@
+"""
+调用耗时与吞吐量指标
+记录每次LLM调用的首字节时间(TTFB)、得到结果的时间、总耗时、限流排队时间、重试次数、解析耗时与输出token数，
+按 "provider/model" 与调用模式（完整响应 full / 流式 stream）汇总为直方图与分位数，可导出为 Prometheus 文本格式或 OpenMetrics 格式（写入文件或通过本地HTTP端点提供）
+"""
+import os
+import time
+import logging
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+# 输出token数直方图的桶上界
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+# 计算分位数时保留的最近样本数
+QUANTILE_WINDOW = 2000
+# 指标名前缀
+METRIC_PREFIX = "viral_llm"
+
+# 调用模式：等待完整响应 / 流式读取（完整结果出现后即停止）
+MODE_FULL = "full"
+MODE_STREAM = "stream"
+
+# Prometheus 文本格式与 OpenMetrics 格式的 Content-Type
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    计算分位数（线性插值）
+
+    Args:
+        values: 样本
+        q: 分位点，取值 [0, 1]
+
+    Returns:
+        分位数；样本为空时返回None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+@dataclass
+class CallTiming:
+    """单次LLM调用的耗时记录（由调用方、限流器与HTTP客户端钩子共同填写）"""
+    provider: str
+    model: str
+    mode: str = MODE_FULL
+    started_at: float = field(default_factory=time.perf_counter)
+    queue_wait: float = 0.0            # 在限流器中等待的累计秒数
+    sent_at: Optional[float] = None    # 最后一次发出请求的时间
+    ttfb: Optional[float] = None       # 最后一次请求从发出到收到响应头的秒数
+    time_to_result: Optional[float] = None  # 从开始到拿到完整结果文本（解析之前）的秒数
+    latency: Optional[float] = None    # 从开始到解析完成的总秒数
+    parse_time: float = 0.0
+    completion_tokens: Optional[int] = None  # 输出token数（流式提前停止时为估算值）
+    aborted: bool = False              # 流式调用在完整结果出现后提前关闭
+    retries: int = 0
+    status: str = "ok"
+
+    def mark_sent(self):
+        """记录请求发出时间"""
+        self.sent_at = time.perf_counter()
+
+    def mark_first_byte(self):
+        """记录收到响应头的时间"""
+        if self.sent_at is not None:
+            self.ttfb = time.perf_counter() - self.sent_at
+
+    def mark_result(self):
+        """记录拿到完整结果文本的时间"""
+        self.time_to_result = time.perf_counter() - self.started_at
+
+    @contextmanager
+    def parsing(self):
+        """统计解析耗时"""
+        parse_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.parse_time += time.perf_counter() - parse_started
+
+    def finish(self):
+        """记录总耗时"""
+        self.latency = time.perf_counter() - self.started_at
+
+
+class Histogram:
+    """累积直方图（用于导出）加最近样本窗口（用于分位数）"""
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=QUANTILE_WINDOW)
+
+    def observe(self, value: float):
+        """记录一个样本"""
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def quantile(self, q: float) -> Optional[float]:
+        """最近样本的分位数"""
+        return percentile(list(self.samples), q)
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, 累计计数) 列表，末尾为 +Inf"""
+        rows, running = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            rows.append((repr(float(bound)), running))
+        rows.append(("+Inf", self.count))
+        return rows
+
+
+class BackendMetrics:
+    """单个 provider/model/调用模式 的调用指标"""
+    def __init__(self):
+        self.latency = Histogram()
+        self.ttfb = Histogram()
+        self.time_to_result = Histogram()
+        self.queue_wait = Histogram()
+        self.parse_time = Histogram()
+        self.completion_tokens = Histogram(TOKEN_BUCKETS)
+        self.calls = Counter()
+        self.retries = 0
+        self.aborted = 0
+        self.first_started_at: Optional[float] = None
+        self.last_finished_at: Optional[float] = None
+
+    def record(self, timing: CallTiming):
+        """记录一次调用"""
+        self.calls[timing.status] += 1
+        self.retries += timing.retries
+        self.aborted += timing.aborted
+        self.queue_wait.observe(timing.queue_wait)
+        if timing.latency is not None:
+            self.latency.observe(timing.latency)
+        if timing.ttfb is not None:
+            self.ttfb.observe(timing.ttfb)
+        if timing.time_to_result is not None:
+            self.time_to_result.observe(timing.time_to_result)
+        if timing.completion_tokens is not None:
+            self.completion_tokens.observe(timing.completion_tokens)
+        if timing.status == "ok":
+            self.parse_time.observe(timing.parse_time)
+        finished_at = timing.started_at + (timing.latency or 0.0)
+        if self.first_started_at is None or timing.started_at < self.first_started_at:
+            self.first_started_at = timing.started_at
+        if self.last_finished_at is None or finished_at > self.last_finished_at:
+            self.last_finished_at = finished_at
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """从第一次调用开始到最后一次调用结束期间的平均每秒调用数"""
+        if self.first_started_at is None:
+            return None
+        elapsed = self.last_finished_at - self.first_started_at
+        return sum(self.calls.values()) / elapsed if elapsed > 0 else None
+
+
+def _round(value: Optional[float], digits: int = 3) -> Optional[float]:
+    return round(value, digits) if value is not None else None
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(provider: str, model: str, mode: str) -> str:
+    return f'provider="{_escape_label(provider)}",model="{_escape_label(model)}",mode="{_escape_label(mode)}"'
+
+
+class MetricsRegistry:
+    """按 "provider/model" 与调用模式汇总的调用指标（线程安全）"""
+    def __init__(self):
+        self._backends: Dict[Tuple[str, str, str], BackendMetrics] = {}
+        self._lock = threading.Lock()
+
+    def record(self, timing: CallTiming):
+        """记录一次调用"""
+        with self._lock:
+            key = (timing.provider, timing.model, timing.mode)
+            metrics = self._backends.get(key)
+            if metrics is None:
+                metrics = self._backends[key] = BackendMetrics()
+            metrics.record(timing)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """各后端（按调用模式分行）的调用数、吞吐量、耗时分位数（秒）与输出token数"""
+        report = []
+        with self._lock:
+            for (provider, model, mode), metrics in self._backends.items():
+                calls = sum(metrics.calls.values())
+                tokens = metrics.completion_tokens
+                report.append({
+                    "backend": f"{provider}/{model}",
+                    "mode": mode,
+                    "calls": calls,
+                    "errors": calls - metrics.calls["ok"],
+                    "retries": metrics.retries,
+                    "calls_per_s": _round(metrics.throughput, 2),
+                    "p50_s": _round(metrics.latency.quantile(0.5)),
+                    "p95_s": _round(metrics.latency.quantile(0.95)),
+                    "p99_s": _round(metrics.latency.quantile(0.99)),
+                    "ttfb_p50_s": _round(metrics.ttfb.quantile(0.5)),
+                    "result_p50_s": _round(metrics.time_to_result.quantile(0.5)),
+                    "output_tokens_mean": _round(tokens.sum / tokens.count if tokens.count else None, 1),
+                    "aborted": metrics.aborted,
+                    "queue_p95_s": _round(metrics.queue_wait.quantile(0.95)),
+                    "parse_p50_ms": _round(None if metrics.parse_time.count == 0
+                                           else metrics.parse_time.quantile(0.5) * 1000)
+                })
+        return report
+
+    def render(self, openmetrics: bool = False) -> str:
+        """
+        导出为 Prometheus 文本格式或 OpenMetrics 格式
+
+        Args:
+            openmetrics: 为True时输出 OpenMetrics 格式（计数器 TYPE 行不带 _total 后缀，以 # EOF 结尾）
+
+        Returns:
+            指标文本
+        """
+        histograms = (
+            ("request_duration_seconds", "latency", "Total LLM call latency including retries and parsing"),
+            ("time_to_first_byte_seconds", "ttfb", "Time from sending the request to receiving response headers"),
+            ("time_to_result_seconds", "time_to_result", "Time from the start of the call until the complete result text was received"),
+            ("queue_wait_seconds", "queue_wait", "Time spent waiting for the provider rate limiter"),
+            ("parse_duration_seconds", "parse_time", "Time spent parsing successful responses"),
+            ("completion_tokens", "completion_tokens", "Output tokens per call (estimated for aborted streams)")
+        )
+        lines = []
+        with self._lock:
+            backends = list(self._backends.items())
+
+            name = f"{METRIC_PREFIX}_requests"
+            lines.append(f"# HELP {name if openmetrics else name + '_total'} LLM calls by outcome status")
+            lines.append(f"# TYPE {name if openmetrics else name + '_total'} counter")
+            for (provider, model, mode), metrics in backends:
+                for status, count in sorted(metrics.calls.items()):
+                    labels = f'{_labels(provider, model, mode)},status="{_escape_label(status)}"'
+                    lines.append(f"{name}_total{{{labels}}} {count}")
+
+            name = f"{METRIC_PREFIX}_retries"
+            lines.append(f"# HELP {name if openmetrics else name + '_total'} Retried LLM requests")
+            lines.append(f"# TYPE {name if openmetrics else name + '_total'} counter")
+            for (provider, model, mode), metrics in backends:
+                lines.append(f"{name}_total{{{_labels(provider, model, mode)}}} {metrics.retries}")
+
+            name = f"{METRIC_PREFIX}_stream_aborts"
+            lines.append(f"# HELP {name if openmetrics else name + '_total'} Streamed calls closed as soon as the result was complete")
+            lines.append(f"# TYPE {name if openmetrics else name + '_total'} counter")
+            for (provider, model, mode), metrics in backends:
+                lines.append(f"{name}_total{{{_labels(provider, model, mode)}}} {metrics.aborted}")
+
+            for suffix, attribute, help_text in histograms:
+                name = f"{METRIC_PREFIX}_{suffix}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for (provider, model, mode), metrics in backends:
+                    histogram = getattr(metrics, attribute)
+                    labels = _labels(provider, model, mode)
+                    for le, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, openmetrics: bool = False):
+        """
+        原子地写入指标文件（可供 node_exporter 的 textfile collector 读取）
+
+        Args:
+            path: 文件路径
+            openmetrics: 是否使用 OpenMetrics 格式
+        """
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            f.write(self.render(openmetrics=openmetrics))
+        os.replace(temporary_path, path)
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """获取进程级的调用指标"""
+    return _registry
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1",
+                         registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动 /metrics HTTP端点
+
+    请求头 Accept 包含 application/openmetrics-text 时返回 OpenMetrics 格式，否则返回 Prometheus 文本格式
+
+    Args:
+        port: 监听端口
+        host: 监听地址
+        registry: 导出的指标，默认为进程级指标
+
+    Returns:
+        HTTP服务器（调用 shutdown() 停止）
+    """
+    registry = registry or get_metrics_registry()
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+            body = registry.render(openmetrics=openmetrics).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"指标端点已启动: http://{host}:{port}/metrics")
+    return server
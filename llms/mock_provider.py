@@ -0,0 +1,334 @@
+"""
+离线模拟提供商
+进程内的 OpenAI 兼容客户端替身：无需API密钥与网络即可驱动完整的模拟流程（限流、重试、解析、用量、指标）。
+延迟分布、错误率、429比例与响应形态（正常JSON、代码块、推理前言、JSON后跟长篇解释、损坏的JSON、纯文本）均可按模型配置，
+支持 n>1 的多候选请求与 stream=True 的分块流式响应；
+互动结果按提示词派生的“真实”概率抽样（提示词中的受众画像在对数几率上叠加一个与内容无关的偏移），
+基准测试可据此检验统计结论的准确性；
+与 DeepSeek 相同，重复出现的消息前缀计为前缀缓存命中（usage.prompt_cache_hit_tokens）
+"""
+import re
+import json
+import math
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field, replace
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from llms.call_context import current_call
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 模拟提供商的API地址（只作标识，不会发起网络请求）
+MOCK_BASE_URL = "mock://local"
+
+# 互动指标
+ENGAGEMENT_KEYS = ("like", "comment", "share", "quote")
+
+# 流式响应每块的字符数
+STREAM_CHUNK_CHARS = 8
+
+# 批量格式要求中用户数的位置（见 llms.llm.BATCH_FORMAT_INSTRUCTION）
+_BATCH_SIZE = re.compile(r"恰好包含(\d+)个")
+# 注入提示词的受众画像（见 simulation.personas.PERSONA_TEMPLATES）
+_PERSONA = re.compile(r"<persona>(.*?)</persona>", re.S)
+# 受众画像对数几率偏移的标准差：画像之间的互动水平差异远大于两个内容版本之间的差异
+PERSONA_LOGIT_SCALE = 1.2
+
+
+@dataclass
+class MockProfile:
+    """模拟模型的行为配置"""
+    median_latency: float = 0.05      # 延迟中位数（秒），延迟服从对数正态分布
+    latency_sigma: float = 0.5        # 对数正态分布的sigma，越大长尾越重
+    ttfb_fraction: float = 0.8        # 首字节时间占总延迟的比例
+    stream_ttfb_fraction: float = 0.1  # 流式响应的首字节时间占总延迟的比例（其余时间按字符均匀分布）
+    error_rate: float = 0.0           # 返回500错误的概率
+    rate_limit_rate: float = 0.0      # 返回429的概率
+    retry_after: float = 0.05         # 429响应的 Retry-After（秒）
+    # 各响应形态的权重：json / fenced / reasoning / rambling / malformed / prose
+    shapes: Dict[str, float] = field(default_factory=lambda: {"json": 1.0})
+    max_like: int = 1                 # like 的最大取值（>1 时为计数指标）
+
+
+# 各模拟模型的默认配置；基准测试可通过 set_mock_profile 调整
+MOCK_PROFILES: Dict[str, MockProfile] = {
+    "mock-fast": MockProfile(),
+    "mock-realistic": MockProfile(
+        median_latency=0.8, latency_sigma=0.6, error_rate=0.01, rate_limit_rate=0.02,
+        shapes={"json": 0.85, "fenced": 0.05, "reasoning": 0.05, "malformed": 0.03, "prose": 0.02}
+    ),
+    "mock-reasoner": MockProfile(
+        median_latency=3.0, latency_sigma=0.7, ttfb_fraction=0.95,
+        shapes={"reasoning": 0.6, "rambling": 0.35, "malformed": 0.05}
+    ),
+    "mock-flaky": MockProfile(
+        median_latency=0.2, latency_sigma=1.0, error_rate=0.1, rate_limit_rate=0.15,
+        shapes={"json": 0.7, "malformed": 0.15, "prose": 0.15}
+    ),
+}
+
+_profiles_lock = threading.Lock()
+
+
+def set_mock_profile(model: str, profile: Optional[MockProfile] = None, **overrides) -> MockProfile:
+    """
+    设置或调整模拟模型的行为
+
+    Args:
+        model: 模拟模型名称
+        profile: 完整的新配置；为None时在现有配置（或默认配置）上修改
+        **overrides: 要覆盖的 MockProfile 字段
+
+    Returns:
+        生效的配置
+    """
+    with _profiles_lock:
+        base = profile or MOCK_PROFILES.get(model, MockProfile())
+        MOCK_PROFILES[model] = replace(base, **overrides)
+        return MOCK_PROFILES[model]
+
+
+def _stable_hash(*parts: Any) -> int:
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def true_rates(prompt: str) -> Dict[str, float]:
+    """
+    提示词对应的“真实”互动概率（由提示词内容确定性地派生）
+
+    内容部分决定基础概率：like 在 [0.2, 0.8) 内，其余指标在 [0.02, 0.4) 内；
+    含受众画像时，每个指标的对数几率再加上只由画像决定的偏移（同一画像对所有内容相同）。
+    同一提示词总是得到相同的结果
+
+    Args:
+        prompt: 单用户提示词（不含批量要求）
+
+    Returns:
+        各指标的概率
+    """
+    persona = _PERSONA.search(prompt)
+    content = _PERSONA.sub("", prompt) if persona else prompt
+    rng = random.Random(_stable_hash("rates", content))
+    rates = {"like": 0.2 + 0.6 * rng.random()}
+    for key in ENGAGEMENT_KEYS[1:]:
+        rates[key] = 0.02 + 0.38 * rng.random()
+    if persona is None:
+        return rates
+
+    persona_rng = random.Random(_stable_hash("persona", persona.group(1)))
+    shifted = {}
+    for key, rate in rates.items():
+        logit = math.log(rate / (1 - rate)) + persona_rng.gauss(0, PERSONA_LOGIT_SCALE)
+        shifted[key] = 1 / (1 + math.exp(-logit))
+    return shifted
+
+
+def _sample_engagement(rng: random.Random, rates: Dict[str, float], max_like: int) -> Dict[str, int]:
+    """按真实概率抽样一个用户的反应；max_like>1 时 like 为二项分布计数"""
+    engagement = {key: int(rng.random() < rate) for key, rate in rates.items()}
+    if max_like > 1:
+        engagement["like"] = sum(rng.random() < rates["like"] for _ in range(max_like))
+    return engagement
+
+
+def _render(rng: random.Random, shape: str, payload: Any) -> str:
+    """按响应形态渲染模型输出文本"""
+    text = json.dumps(payload, ensure_ascii=False)
+    if shape == "fenced":
+        return f"```json\n{text}\n```"
+    if shape == "reasoning":
+        thoughts = " ".join(rng.choice(["The user", "might", "share {this}", "because", "it is", "[surprising]"])
+                            for _ in range(rng.randint(20, 80)))
+        return f"<think>\n{thoughts}\n</think>\n\n{text}"
+    if shape == "rambling":
+        # 先给出结果，再输出一大段解释（流式模式可在JSON闭合后停止读取）
+        explanation = " ".join(rng.choice(["This post", "would resonate", "with users who", "care about", "the topic,",
+                                           "although", "some readers", "may scroll past."])
+                               for _ in range(rng.randint(80, 300)))
+        return f"{text}\n\nExplanation: {explanation}"
+    if shape == "malformed":
+        return text[:rng.randint(1, max(len(text) - 2, 1))]
+    if shape == "prose":
+        return "This content would probably get some likes but not many shares."
+    return text
+
+
+class _MockCompletions:
+    """chat.completions 接口替身"""
+    def __init__(self, seed: int):
+        self.seed = seed
+        self._call_counts: Dict[str, int] = {}
+        self._seen_prefixes: set = set()
+        self._lock = threading.Lock()
+
+    def reset(self, seed: Optional[int] = None):
+        """重置调用序号（可同时更换种子），使后续调用序列可复现"""
+        with self._lock:
+            self._call_counts.clear()
+            self._seen_prefixes.clear()
+            if seed is not None:
+                self.seed = seed
+
+    def _next_rng(self, model: str, prompt: str) -> random.Random:
+        """每次调用独立的随机数生成器：由种子、模型、提示词与该提示词的调用序号确定"""
+        with self._lock:
+            count = self._call_counts.get(prompt, 0)
+            self._call_counts[prompt] = count + 1
+        return random.Random(_stable_hash(self.seed, model, prompt, count))
+
+    def _cache_hit_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """此前出现过的最长消息前缀的token数（按消息粒度近似提供商的前缀缓存）"""
+        hit_tokens = prefix_tokens = 0
+        with self._lock:
+            for end in range(1, len(messages) + 1):
+                prefix = json.dumps(messages[:end], ensure_ascii=False)
+                prefix_tokens += len(messages[end - 1]["content"]) // 2
+                if prefix in self._seen_prefixes:
+                    hit_tokens = prefix_tokens
+                else:
+                    self._seen_prefixes.add(prefix)
+        return hit_tokens
+
+    async def create(self, model: str, messages: List[Dict[str, str]], max_tokens: int = 1024, n: int = 1,
+                     stream: bool = False, stream_options: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        """模拟一次对话补全调用；n>1 时返回多个独立候选，stream=True 时返回分块的流式响应"""
+        import httpx
+        import openai
+
+        profile = MOCK_PROFILES.get(model, MockProfile())
+        prompt = messages[-1]["content"]
+        rng = self._next_rng(model, json.dumps(messages, ensure_ascii=False))
+
+        latency = profile.median_latency * math.exp(rng.gauss(0, profile.latency_sigma))
+        request = httpx.Request("POST", f"{MOCK_BASE_URL}/chat/completions")
+
+        ttfb_fraction = profile.stream_ttfb_fraction if stream else profile.ttfb_fraction
+        await asyncio.sleep(latency * ttfb_fraction)
+        timing = current_call.get()
+        if timing is not None:
+            timing.mark_first_byte()
+
+        roll = rng.random()
+        if roll < profile.rate_limit_rate:
+            response = httpx.Response(429, request=request, headers={"retry-after": str(profile.retry_after)})
+            raise openai.RateLimitError("mock rate limit", response=response, body=None)
+        if roll < profile.rate_limit_rate + profile.error_rate:
+            raise openai.InternalServerError("mock server error", response=httpx.Response(500, request=request), body=None)
+
+        # 格式要求在 system 消息中，真实概率只由 user 消息中的内容提示词决定
+        match = _BATCH_SIZE.search(messages[0]["content"])
+        rates = true_rates(prompt)
+        batch_size = int(match.group(1)) if match else None
+        # n>1 时每个候选是独立的一次抽样
+        generated = [_generate_choice(rng, profile, rates, batch_size, max_tokens) for _ in range(max(n, 1))]
+
+        completion_tokens = sum(choice[2] for choice in generated)
+        reasoning_tokens = sum(choice[3] for choice in generated)
+        prompt_tokens = sum(len(message["content"]) // 2 for message in messages) + 1
+        cache_hit_tokens = self._cache_hit_tokens(messages)
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            prompt_cache_hit_tokens=cache_hit_tokens,
+            prompt_cache_miss_tokens=prompt_tokens - cache_hit_tokens,
+            completion_tokens_details=SimpleNamespace(reasoning_tokens=reasoning_tokens)
+        )
+
+        generation_time = latency * (1 - ttfb_fraction)
+        if stream:
+            content, finish_reason = generated[0][:2]
+            include_usage = bool((stream_options or {}).get("include_usage"))
+            return _MockStream(model, content, generation_time, finish_reason, usage if include_usage else None)
+
+        await asyncio.sleep(generation_time)
+        return SimpleNamespace(
+            model=model,
+            choices=[
+                SimpleNamespace(
+                    index=index,
+                    finish_reason=finish_reason,
+                    message=SimpleNamespace(role="assistant", content=content)
+                )
+                for index, (content, finish_reason, _, _) in enumerate(generated)
+            ],
+            usage=usage
+        )
+
+
+def _generate_choice(rng: random.Random, profile: MockProfile, rates: Dict[str, float],
+                     batch_size: Optional[int], max_tokens: int) -> Tuple[str, str, int, int]:
+    """
+    生成一个候选的输出
+
+    Returns:
+        (内容, finish_reason, 输出token数, 推理token数)
+    """
+    if batch_size is not None:
+        payload = {"users": [_sample_engagement(rng, rates, profile.max_like) for _ in range(batch_size)]}
+    else:
+        payload = _sample_engagement(rng, rates, profile.max_like)
+
+    shapes, weights = zip(*profile.shapes.items())
+    shape = rng.choices(shapes, weights=weights, k=1)[0]
+    content = _render(rng, shape, payload)
+    # 与真实模型一样，超出输出上限的部分被截断
+    finish_reason = "length" if len(content) // 2 + 1 > max_tokens else "stop"
+    content = content[:max_tokens * 2]
+    completion_tokens = min(len(content) // 2 + 1, max_tokens)
+    reasoning_tokens = len(content.split("</think>")[0]) // 2 if shape == "reasoning" else 0
+    return content, finish_reason, completion_tokens, reasoning_tokens
+
+
+class _MockStream:
+    """流式响应替身：按生成时间均匀地逐块返回内容，最后返回 finish_reason 与（可选的）用量块"""
+    def __init__(self, model: str, content: str, generation_time: float, finish_reason: str, usage: Optional[Any]):
+        self.model = model
+        self.content = content
+        self.generation_time = generation_time
+        self.finish_reason = finish_reason
+        self.usage = usage
+        self.closed = False
+
+    def _chunk(self, content: Optional[str], finish_reason: Optional[str] = None) -> Any:
+        return SimpleNamespace(
+            model=self.model,
+            choices=[SimpleNamespace(index=0, finish_reason=finish_reason,
+                                     delta=SimpleNamespace(role="assistant", content=content))],
+            usage=None
+        )
+
+    async def _generate(self):
+        per_char = self.generation_time / max(len(self.content), 1)
+        for start in range(0, len(self.content), STREAM_CHUNK_CHARS):
+            piece = self.content[start:start + STREAM_CHUNK_CHARS]
+            await asyncio.sleep(per_char * len(piece))
+            if self.closed:
+                return
+            yield self._chunk(piece)
+        yield self._chunk(None, finish_reason=self.finish_reason)
+        if self.usage is not None:
+            yield SimpleNamespace(model=self.model, choices=[], usage=self.usage)
+
+    def __aiter__(self):
+        return self._generate()
+
+    async def close(self):
+        """与 AsyncStream.close 兼容：停止生成"""
+        self.closed = True
+
+
+class MockAsyncClient:
+    """与 AsyncOpenAI 接口兼容的进程内模拟客户端（只实现 chat.completions.create）"""
+    def __init__(self, seed: int = 0):
+        self.chat = SimpleNamespace(completions=_MockCompletions(seed))
+
+    async def close(self):
+        """与 AsyncOpenAI.close 兼容"""
@@ -0,0 +1,254 @@
+"""
+提供商限流器
+按 MODEL_CONFIGS 中声明的每分钟请求数(rpm)/每分钟token数(tpm)预算，用令牌桶控制请求速率；
+遇到429、超时或5xx时遵循 Retry-After 并进行带抖动的指数退避重试，重试耗尽后抛出 LLMRequestError，
+而不是把失败静默地当作“零互动”
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.model_config import RETRY_CONFIG, get_rate_limits
+from llms.call_context import current_call
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+
+class LLMRequestError(Exception):
+    """LLM请求在重试后仍然失败"""
+    def __init__(self, message: str, provider: Optional[str] = None, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """
+    令牌桶
+
+    令牌按 rate_per_minute/60 的速度持续补充，最多累积到 capacity；
+    允许余额暂时为负（用实际用量结算预估值时），此时后续请求会等待余额恢复
+    """
+    def __init__(self, rate_per_minute: float, capacity: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """距离余额足以支付 amount 还需等待的秒数"""
+        self._refill()
+        # 单次请求超过桶容量时，只要求桶是满的
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """扣除令牌（允许为负）"""
+        self._refill()
+        self.tokens -= amount
+
+
+class ProviderRateLimiter:
+    """单个提供商的限流器，组合请求数令牌桶与token数令牌桶"""
+    def __init__(self, provider: str, rpm: Optional[int] = None, tpm: Optional[int] = None,
+                 burst_seconds: float = RETRY_CONFIG["burst_seconds"]):
+        """
+        初始化限流器
+
+        Args:
+            provider: 模型提供商
+            rpm: 每分钟请求数上限，None表示不限制
+            tpm: 每分钟token数上限，None表示不限制
+            burst_seconds: 令牌桶容量相当于多少秒的配额
+        """
+        self.provider = provider
+        self.request_bucket = TokenBucket(rpm, max(1.0, rpm * burst_seconds / 60)) if rpm else None
+        self.token_bucket = TokenBucket(tpm, max(1.0, tpm * burst_seconds / 60)) if tpm else None
+        # 收到429后整个提供商暂停到该时间点
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        """暂停该提供商的所有请求"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, estimated_tokens: int = 0):
+        """
+        等待直到请求数与token预算都允许发起一次请求
+
+        Args:
+            estimated_tokens: 本次请求预估消耗的token数
+        """
+        while True:
+            with self._lock:
+                wait = self._paused_until - time.monotonic()
+                if self.request_bucket is not None:
+                    wait = max(wait, self.request_bucket.wait_time(1))
+                if self.token_bucket is not None and estimated_tokens:
+                    wait = max(wait, self.token_bucket.wait_time(estimated_tokens))
+                if wait <= 0:
+                    if self.request_bucket is not None:
+                        self.request_bucket.consume(1)
+                    if self.token_bucket is not None:
+                        self.token_bucket.consume(estimated_tokens)
+                    return
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """用实际token用量修正预估值"""
+        if self.token_bucket is None or actual_tokens is None:
+            return
+        with self._lock:
+            self.token_bucket.consume(actual_tokens - estimated_tokens)
+
+
+_limiters: Dict[str, ProviderRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> ProviderRateLimiter:
+    """获取进程级共享的提供商限流器"""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limits = get_rate_limits(provider)
+            limiter = ProviderRateLimiter(provider, rpm=limits.get("rpm"), tpm=limits.get("tpm"))
+            _limiters[provider] = limiter
+        return limiter
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数（中英文混合，按约每2个字符1个token计）"""
+    return len(text) // 2 + 1
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """从错误响应头中读取 Retry-After（秒数或HTTP日期）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _request_errors() -> Tuple[Type[BaseException], ...]:
+    """
+    请求本身失败时的异常类型：API返回的错误状态、连接与读取错误、超时
+
+    其他异常（如代码错误）不重试也不包装，直接上抛
+    """
+    # openai/httpx 导入较慢，延迟到第一次处理请求错误时（此时SDK必然已被客户端导入）
+    import httpx
+    import openai
+
+    return openai.APIError, httpx.HTTPError, asyncio.TimeoutError
+
+
+def _is_retryable(error: Exception) -> bool:
+    """判断错误是否值得重试：429、超时、连接错误（包括流式读取中断）、5xx"""
+    import httpx
+    import openai
+
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code == 408 or status_code >= 500)
+
+
+async def call_with_rate_limit(provider: str, request: Callable[[], Awaitable[Any]],
+                               estimated_tokens: int = 0) -> Any:
+    """
+    在提供商限流与重试策略下执行一次API请求
+
+    Args:
+        provider: 模型提供商
+        request: 发起请求的无参协程函数（每次重试都会重新调用）
+        estimated_tokens: 预估消耗的token数（提示词+输出）
+
+    Returns:
+        请求的返回值
+
+    Raises:
+        LLMRequestError: 请求失败且不可重试，或重试次数耗尽；其他异常原样上抛
+    """
+    limiter = get_rate_limiter(provider)
+    max_retries = RETRY_CONFIG["max_retries"]
+    timing = current_call.get()
+
+    for attempt in range(max_retries + 1):
+        wait_started = time.perf_counter()
+        await limiter.acquire(estimated_tokens)
+        if timing is not None:
+            timing.queue_wait += time.perf_counter() - wait_started
+            timing.mark_sent()
+        try:
+            response = await request()
+        except _request_errors() as e:
+            # 未真正消耗的token预算退回
+            limiter.settle(estimated_tokens, 0)
+            status_code = getattr(e, "status_code", None)
+
+            if not _is_retryable(e):
+                raise LLMRequestError(f"{provider} 请求失败: {str(e)}", provider, status_code) from e
+            if attempt >= max_retries:
+                raise LLMRequestError(f"{provider} 请求在重试 {max_retries} 次后仍然失败: {str(e)}",
+                                      provider, status_code) from e
+
+            # 带完全抖动的指数退避；有 Retry-After 时至少等待该时长
+            delay = random.uniform(0, min(RETRY_CONFIG["max_delay"], RETRY_CONFIG["base_delay"] * 2 ** attempt))
+            retry_after = _retry_after_seconds(e)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if getattr(e, "status_code", None) == 429:
+                # 429说明已触达提供商限制，暂停该提供商的所有请求
+                limiter.pause(delay)
+
+            logger.warning(f"{provider} 请求失败 (第{attempt + 1}次, status={status_code}): {str(e)}，{delay:.2f}秒后重试")
+            if timing is not None:
+                timing.retries += 1
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            limiter.settle(estimated_tokens, 0)
+            raise
+
+        usage = getattr(response, "usage", None)
+        limiter.settle(estimated_tokens, getattr(usage, "total_tokens", None))
+        return response
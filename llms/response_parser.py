@@ -0,0 +1,405 @@
+"""
+模型响应解析
+从模型返回文本中提取互动指标：先廉价地去掉推理模型的思考过程，再单次扫描找出最后一个完整的JSON值，
+按预编译的模式校验并转换为整数；解析失败时抛出带原因的 ResponseParseError，并按原因计数，
+而不是静默地映射为零互动。流式响应由 StreamingJsonScanner 增量扫描，完整的结果对象一出现即可停止读取
+"""
+import re
+import json
+import math
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 单个用户的互动指标
+ENGAGEMENT_KEYS = ("like", "comment", "share", "quote")
+
+# 推理模型思考过程的开始与结束标记
+_REASONING_START_MARKERS = ("<think>", "<thinking>", "<reasoning>")
+_REASONING_END_MARKERS = ("</think>", "</thinking>", "</reasoning>")
+
+# JSON结构字符（在C层面跳过其余文本）
+_STRUCTURAL = re.compile(r'[{}\[\]"\\]')
+
+# JSON无法解析时，一次扫描提取所有 "指标": 值
+_KEY_VALUE = re.compile(r'"(like|comment|share|quote)"\s*:\s*"?(true|false|-?\d+)"?', re.IGNORECASE)
+
+# 解析结果原因
+PARSE_OK = "ok"
+PARSE_REGEX_FALLBACK = "regex_fallback"
+PARSE_EMPTY = "empty"
+PARSE_NO_JSON = "no_json"
+PARSE_DECODE_ERROR = "decode_error"
+PARSE_NOT_OBJECT = "not_object"
+PARSE_MISSING_KEYS = "missing_keys"
+PARSE_INVALID_VALUE = "invalid_value"
+PARSE_BATCH_SHORT = "batch_short"
+
+
+class ResponseParseError(ValueError):
+    """模型响应无法解析为互动指标"""
+    def __init__(self, reason: str, message: str = ""):
+        super().__init__(f"{reason}: {message}" if message else reason)
+        self.reason = reason
+
+
+def strip_reasoning(text: str) -> str:
+    """
+    去掉推理模型输出的思考过程（只保留最后一个结束标记之后的内容）
+
+    Args:
+        text: 模型返回文本
+
+    Returns:
+        去掉思考过程后的文本
+    """
+    end = -1
+    marker_length = 0
+    for marker in _REASONING_END_MARKERS:
+        position = text.rfind(marker)
+        if position > end:
+            end, marker_length = position, len(marker)
+    return text[end + marker_length:] if end >= 0 else text
+
+
+def find_json_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    单次扫描找出文本中所有顶层的、括号配平的JSON对象/数组
+
+    顶层之外的引号视为普通文本；字符串内部的括号与转义字符被正确跳过
+
+    Args:
+        text: 待扫描文本
+
+    Returns:
+        (起始位置, 结束位置) 列表，按出现顺序排列
+    """
+    spans = []
+    depth = 0
+    start = 0
+    in_string = False
+    escaped_position = -1
+
+    for match in _STRUCTURAL.finditer(text):
+        position = match.start()
+        char = match.group()
+        if in_string:
+            if position == escaped_position:
+                continue
+            if char == "\\":
+                escaped_position = position + 1
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char in "{[":
+            if depth == 0:
+                start = position
+            depth += 1
+        elif char in "}]":
+            if depth == 0:
+                continue
+            depth -= 1
+            if depth == 0:
+                spans.append((start, position + 1))
+        elif char == '"' and depth > 0:
+            in_string = True
+
+    return spans
+
+
+def batch_items(data: Any) -> Optional[list]:
+    """批量模式返回值中的用户数组：兼容 {"users": [...]}、键名不同的包装对象以及直接的数组"""
+    if isinstance(data, dict):
+        users = data.get("users")
+        if not isinstance(users, list):
+            users = next((value for value in data.values() if isinstance(value, list)), None)
+        data = users
+    return data if isinstance(data, list) else None
+
+
+def is_engagement(data: Any) -> bool:
+    """是否为单个用户的互动指标对象（至少包含一个指标）"""
+    return isinstance(data, dict) and any(key in data for key in ENGAGEMENT_KEYS)
+
+
+class StreamingJsonScanner:
+    """
+    流式响应的增量JSON扫描器
+
+    逐块输入模型输出，延续 find_json_spans 的括号深度与字符串状态（跨块的转义字符同样正确跳过），
+    开头的思考过程整体跳过；每当一个顶层JSON值闭合且能解析时交给 is_complete 判断，
+    返回True即表示结果已完整、可以停止读取
+    """
+    def __init__(self, is_complete: Callable[[Any], bool] = is_engagement):
+        """
+        初始化扫描器
+
+        Args:
+            is_complete: 判断一个已闭合的顶层JSON值是否为完整结果
+        """
+        self.is_complete = is_complete
+        self.text = ""
+        self.complete = False
+        self._position = 0           # 下一次扫描的起始位置
+        self._reasoning: Optional[bool] = None   # 是否处于思考过程中（None表示尚不能判断）
+        self._depth = 0
+        self._start = 0
+        self._in_string = False
+        self._escaped_position = -1
+
+    def _skip_reasoning(self) -> bool:
+        """处理开头的思考过程；返回是否可以开始扫描JSON"""
+        if self._reasoning is None:
+            head = self.text.lstrip()
+            if any(len(head) < len(marker) and marker.startswith(head) for marker in _REASONING_START_MARKERS):
+                return False  # 开始标记可能尚未接收完整
+            self._reasoning = head.startswith(_REASONING_START_MARKERS)
+        if self._reasoning:
+            for marker in _REASONING_END_MARKERS:
+                position = self.text.find(marker, max(self._position - len(marker), 0))
+                if position >= 0:
+                    self._position = position + len(marker)
+                    self._reasoning = False
+                    return True
+            self._position = len(self.text)
+            return False
+        return True
+
+    def feed(self, chunk: str) -> bool:
+        """
+        输入一块输出文本
+
+        Args:
+            chunk: 新收到的文本
+
+        Returns:
+            是否已得到完整结果
+        """
+        if self.complete or not chunk:
+            return self.complete
+        self.text += chunk
+        if not self._skip_reasoning():
+            return False
+
+        text = self.text
+        for match in _STRUCTURAL.finditer(text, self._position):
+            position = match.start()
+            char = match.group()
+            if self._in_string:
+                if position == self._escaped_position:
+                    continue
+                if char == "\\":
+                    self._escaped_position = position + 1
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char in "{[":
+                if self._depth == 0:
+                    self._start = position
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        data = json.loads(text[self._start:position + 1])
+                    except json.JSONDecodeError:
+                        continue
+                    if self.is_complete(data):
+                        self._position = position + 1
+                        self.complete = True
+                        return True
+            elif char == '"' and self._depth > 0:
+                self._in_string = True
+
+        self._position = len(text)
+        return False
+
+
+def _coerce_int(value: Any) -> int:
+    """把布尔值、数字或数字字符串转换为非负整数；无穷大与NaN（如 Infinity、1e999）视为无效取值"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return max(value, 0)
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered == "true":
+            return 1
+        if lowered == "false":
+            return 0
+        value = float(lowered)
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise ValueError(f"非有限的取值: {value}")
+        return max(int(value), 0)
+    raise TypeError(f"不支持的取值类型: {type(value).__name__}")
+
+
+class EngagementSchema:
+    """预编译的互动指标模式：键名到转换函数的映射"""
+    def __init__(self, keys: Sequence[str] = ENGAGEMENT_KEYS, coerce: Callable[[Any], int] = _coerce_int):
+        self.keys = tuple(keys)
+        self._fields = tuple((key, coerce) for key in self.keys)
+
+    def validate(self, data: Any) -> Tuple[Dict[str, int], Optional[str]]:
+        """
+        校验并转换单个用户的反应
+
+        缺少部分指标时按0处理（并返回 missing_keys 作为提示原因）；一个指标都没有时视为解析失败，
+        以免把无关的对象（如 {}）当作零互动
+
+        Returns:
+            (互动指标字典, 提示原因或None)
+
+        Raises:
+            ResponseParseError: 不是对象、不含任何指标或存在无法转换的取值
+        """
+        if not isinstance(data, dict):
+            raise ResponseParseError(PARSE_NOT_OBJECT, type(data).__name__)
+        if not any(key in data for key in self.keys):
+            raise ResponseParseError(PARSE_MISSING_KEYS, f"没有任何互动指标: {sorted(data)[:10]}")
+
+        result = {}
+        missing = False
+        for key, coerce in self._fields:
+            if key not in data:
+                result[key] = 0
+                missing = True
+                continue
+            try:
+                result[key] = coerce(data[key])
+            except (TypeError, ValueError, OverflowError) as e:
+                raise ResponseParseError(PARSE_INVALID_VALUE, f"{key}={data[key]!r}") from e
+        return result, PARSE_MISSING_KEYS if missing else None
+
+
+class ResponseParser:
+    """互动指标解析器，按原因统计解析结果（线程安全）"""
+    def __init__(self, schema: Optional[EngagementSchema] = None):
+        self.schema = schema or EngagementSchema()
+        self.metrics: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _record(self, reason: str, count: int = 1):
+        with self._lock:
+            self.metrics[reason] += count
+
+    def _fail(self, reason: str, message: str = "") -> ResponseParseError:
+        self._record(reason)
+        return ResponseParseError(reason, message)
+
+    def _load_last_json(self, text: str) -> Any:
+        """从后向前尝试解析完整的JSON值，返回第一个成功解析的结果"""
+        spans = find_json_spans(text)
+        if not spans:
+            raise ResponseParseError(PARSE_NO_JSON)
+        for start, end in reversed(spans):
+            try:
+                return json.loads(text[start:end])
+            except json.JSONDecodeError:
+                continue
+        raise ResponseParseError(PARSE_DECODE_ERROR)
+
+    def _regex_fallback(self, text: str) -> Optional[Dict[str, int]]:
+        """JSON无法解析时一次扫描提取各指标；缺少任何指标或存在无法转换的取值则视为失败"""
+        found = {}
+        for match in _KEY_VALUE.finditer(text):
+            found[match.group(1).lower()] = match.group(2)
+        if not all(key in found for key in self.schema.keys):
+            return None
+        try:
+            return {key: _coerce_int(found[key]) for key in self.schema.keys}
+        except ValueError:
+            return None
+
+    def parse_engagement(self, text: Optional[str]) -> Dict[str, int]:
+        """
+        解析单个用户的反应
+
+        Args:
+            text: 模型返回文本
+
+        Returns:
+            互动指标字典
+
+        Raises:
+            ResponseParseError: 无法解析（原因已计入 metrics）
+        """
+        if not text or not text.strip():
+            raise self._fail(PARSE_EMPTY)
+
+        body = strip_reasoning(text)
+        try:
+            data = self._load_last_json(body)
+        except ResponseParseError as e:
+            fallback = self._regex_fallback(body)
+            if fallback is not None:
+                self._record(PARSE_REGEX_FALLBACK)
+                return fallback
+            logger.error(f"响应解析失败 ({e.reason}), 内容: {text[-500:]}")
+            raise self._fail(e.reason)
+
+        try:
+            result, note = self.schema.validate(data)
+        except ResponseParseError as e:
+            logger.error(f"响应校验失败 ({e}), 内容: {text[-500:]}")
+            raise self._fail(e.reason, str(e))
+
+        self._record(note or PARSE_OK)
+        return result
+
+    def parse_engagement_batch(self, text: Optional[str], batch_size: int) -> List[Dict[str, int]]:
+        """
+        解析批量模式返回的用户反应数组（{"users": [...]} 或直接的数组）
+
+        无效的数组元素会被跳过，调用方负责补齐缺少的用户
+
+        Args:
+            text: 模型返回文本
+            batch_size: 期望的用户数
+
+        Returns:
+            有效的互动指标字典列表（最多 batch_size 个）；整体无法解析时返回空列表
+        """
+        if not text or not text.strip():
+            self._record(PARSE_EMPTY)
+            return []
+
+        try:
+            data = self._load_last_json(strip_reasoning(text))
+        except ResponseParseError as e:
+            logger.error(f"批量结果解析失败 ({e.reason}), 内容: {text[-500:]}")
+            self._record(e.reason)
+            return []
+
+        data = batch_items(data)
+        if data is None:
+            self._record(PARSE_NOT_OBJECT)
+            return []
+
+        results = []
+        for item in data[:batch_size]:
+            try:
+                result, note = self.schema.validate(item)
+            except ResponseParseError as e:
+                self._record(e.reason)
+                continue
+            self._record(note or PARSE_OK)
+            results.append(result)
+
+        if len(results) < batch_size:
+            self._record(PARSE_BATCH_SHORT)
+        return results
+
+    def snapshot(self) -> Dict[str, int]:
+        """各解析原因的计数"""
+        with self._lock:
+            return dict(self.metrics)
@@ -0,0 +1,258 @@
+"""
+多提供商路由
+把一次运行中的模拟用户分散到多个 (provider, model) 后端，按观测到的延迟和错误率加权选择；
+可选的对冲请求：调用超过该后端近期延迟的p95仍未返回时，向另一个后端发送重复请求，取先返回的结果
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.rate_limiter import LLMRequestError
+from llms.call_context import RequestCounter, network_requests, served_by
+from llms.metrics import percentile
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 延迟/错误率指数滑动平均的平滑系数
+EWMA_ALPHA = 0.2
+# 计算延迟分位数时保留的最近样本数
+LATENCY_WINDOW = 200
+# 开始对冲前每个后端至少需要的延迟样本数
+MIN_HEDGE_SAMPLES = 20
+
+
+class BackendStats:
+    """单个后端的运行统计"""
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.hedges = 0
+
+    def record(self, latency: float, success: bool):
+        """记录一次调用"""
+        self.calls += 1
+        if success:
+            self.latencies.append(latency)
+            self.ewma_latency = latency if self.ewma_latency is None else \
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+        else:
+            self.errors += 1
+        self.ewma_error = EWMA_ALPHA * (0.0 if success else 1.0) + (1 - EWMA_ALPHA) * self.ewma_error
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        """近期成功调用延迟的分位数"""
+        return percentile(list(self.latencies), q)
+
+
+class RoutingLLM:
+    """
+    多后端路由客户端，接口与 ViralPredictionLLM 的预测方法一致，可直接交给调度器使用
+    """
+    def __init__(self, backends: List[Any], hedge: bool = False, hedge_percentile: float = 0.95):
+        """
+        初始化路由客户端
+
+        Args:
+            backends: ViralPredictionLLM 实例列表
+            hedge: 是否对慢请求发送对冲请求
+            hedge_percentile: 触发对冲的延迟分位点
+        """
+        if not backends:
+            raise ValueError("至少需要一个后端")
+
+        self.backends = backends
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.stats = [BackendStats() for _ in backends]
+        self.provider = "router"
+        self.model = ",".join(f"{backend.provider}/{backend.model}" for backend in backends)
+        # 请求可能被路由到任何一个后端，因此按所有后端中最小的候选数上限分块
+        self.max_choices = min(getattr(backend, "max_choices", 1) for backend in backends)
+
+    def _weight(self, index: int) -> float:
+        """后端权重：成功率越高、延迟越低权重越大；尚无样本的后端使用已知后端的平均延迟以保证探索"""
+        stats = self.stats[index]
+        known = [s.ewma_latency for s in self.stats if s.ewma_latency is not None]
+        latency = stats.ewma_latency or (sum(known) / len(known) if known else 1.0)
+        return max(1.0 - stats.ewma_error, 0.05) / max(latency, 1e-3)
+
+    def _choose(self, exclude: Set[int]) -> Optional[int]:
+        """按权重随机选择一个后端"""
+        candidates = [index for index in range(len(self.backends)) if index not in exclude]
+        if not candidates:
+            return None
+        weights = [self._weight(index) for index in candidates]
+        return random.choices(candidates, weights=weights, k=1)[0]
+
+    async def _timed_call(self, index: int, call: Callable[[Any], Awaitable[Any]]) -> Any:
+        """
+        在指定后端执行调用并记录延迟与成败
+
+        只记录真正发出网络请求的调用：缓存命中几乎不耗时，计入后会把对冲阈值（延迟p95）拉向0，
+        使几乎所有未命中缓存的请求都被对冲
+        """
+        counter = RequestCounter()
+        token = network_requests.set(counter)
+        started_at = time.perf_counter()
+        try:
+            result = await call(self.backends[index])
+        except LLMRequestError:
+            if counter.requests:
+                self.stats[index].record(time.perf_counter() - started_at, success=False)
+            raise
+        finally:
+            network_requests.reset(token)
+        if counter.requests:
+            self.stats[index].record(time.perf_counter() - started_at, success=True)
+        return result
+
+    def _hedge_delay(self, index: int) -> Optional[float]:
+        """触发对冲前的等待时间；样本不足时不对冲"""
+        if not self.hedge or len(self.stats[index].latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return self.stats[index].latency_percentile(self.hedge_percentile)
+
+    def _served(self, index: int, result: Any) -> Any:
+        """记录结果来源（对冲请求在子任务中执行，子任务对上下文变量的修改不会传回调用方）"""
+        backend = self.backends[index]
+        served_by.set(f"{backend.provider}/{backend.model}")
+        return result
+
+    async def _hedged_call(self, primary: int, call: Callable[[Any], Awaitable[Any]], delay: float) -> Any:
+        """先调用主后端，超过 delay 秒未返回时向另一个后端发送重复请求，取先成功的结果"""
+        primary_task = asyncio.create_task(self._timed_call(primary, call))
+        indexes = {primary_task: primary}
+        pending = {primary_task}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return self._served(primary, primary_task.result())
+
+            # 只有一个后端时，重复请求发往同一个后端
+            secondary = self._choose(exclude={primary})
+            secondary = primary if secondary is None else secondary
+            self.stats[primary].hedges += 1
+            secondary_task = asyncio.create_task(self._timed_call(secondary, call))
+            indexes[secondary_task] = secondary
+            pending.add(secondary_task)
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return self._served(indexes[task], task.result())
+                    error = task.exception()
+            raise error
+        finally:
+            # 取消较慢的请求（调用方被取消时也一并取消）
+            for task in pending:
+                task.cancel()
+
+    async def _route(self, call: Callable[[Any], Awaitable[Any]]) -> Any:
+        """选择后端执行调用；后端失败时换一个后端重试，全部失败时抛出最后一个错误"""
+        tried: Set[int] = set()
+        last_error = None
+        while True:
+            index = self._choose(exclude=tried)
+            if index is None:
+                raise last_error
+            tried.add(index)
+            try:
+                delay = self._hedge_delay(index)
+                if delay is None:
+                    return await self._timed_call(index, call)
+                return await self._hedged_call(index, call, delay)
+            except LLMRequestError as e:
+                last_error = e
+                logger.warning(f"后端 {self.backends[index].provider}/{self.backends[index].model} 调用失败，尝试其他后端: {str(e)}")
+
+    async def predict_engagement(self, prompt: str, sample_index: Optional[int] = None) -> Dict[str, Any]:
+        """
+        经路由预测单个用户的参与度
+
+        Args:
+            prompt: 提示词
+            sample_index: 样本序号，用于响应缓存
+
+        Returns:
+            解析后的JSON响应
+        """
+        return await self._route(lambda backend: backend.predict_engagement(prompt, sample_index=sample_index))
+
+    async def predict_engagement_samples(self, prompt: str, n: int,
+                                         sample_index: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        经路由用API的 n 参数在一次调用中独立采样多个用户
+
+        Args:
+            prompt: 提示词
+            n: 本次模拟的用户数
+            sample_index: 第一个用户的样本序号，用于响应缓存
+
+        Returns:
+            互动指标字典列表
+        """
+        return await self._route(
+            lambda backend: backend.predict_engagement_samples(prompt, n, sample_index=sample_index)
+        )
+
+    async def predict_engagement_batch(self, prompt: str, batch_size: int,
+                                       sample_index: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        经路由在一次调用中模拟多个用户
+
+        Args:
+            prompt: 提示词
+            batch_size: 本次调用模拟的用户数
+            sample_index: 第一个用户的样本序号，用于响应缓存
+
+        Returns:
+            互动指标字典列表
+        """
+        return await self._route(
+            lambda backend: backend.predict_engagement_batch(prompt, batch_size, sample_index=sample_index)
+        )
+
+    def get_usage(self) -> Dict[str, Dict[str, Any]]:
+        """各后端的累计token用量与费用"""
+        usage = {}
+        for backend in self.backends:
+            usage.update(backend.get_usage())
+        return usage
+
+    def get_parse_stats(self) -> Dict[str, int]:
+        """所有后端合计的解析结果原因计数"""
+        totals: Dict[str, int] = {}
+        for backend in self.backends:
+            for reason, count in backend.get_parse_stats().items():
+                totals[reason] = totals.get(reason, 0) + count
+        return totals
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """各后端的调用统计"""
+        report = []
+        for backend, stats in zip(self.backends, self.stats):
+            p50 = stats.latency_percentile(0.5)
+            p95 = stats.latency_percentile(0.95)
+            report.append({
+                "backend": f"{backend.provider}/{backend.model}",
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "hedges": stats.hedges,
+                "p50_s": round(p50, 3) if p50 is not None else None,
+                "p95_s": round(p95, 3) if p95 is not None else None
+            })
+        return report
@@ -0,0 +1,168 @@
+"""
+token用量与费用统计
+记录每次调用返回的 prompt / completion / 推理 token 数以及命中提供商前缀缓存的输入token数，
+按 "provider/model" 汇总并按模型价格（缓存命中部分按缓存价格）折算费用；
+可设置硬性预算，超出后拒绝发起新的调用
+"""
+import os
+import sys
+import logging
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.model_config import get_model_profile
+from llms.rate_limiter import LLMRequestError
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 超出预算时的结果状态
+STATUS_BUDGET_EXCEEDED = "budget_exceeded"
+
+
+class BudgetExceededError(LLMRequestError):
+    """运行预算已用完，不再发起新的调用"""
+    reason = STATUS_BUDGET_EXCEEDED
+
+
+@dataclass
+class TokenUsage:
+    """token用量与费用"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_tokens: int = 0
+    cache_hit_tokens: int = 0   # 命中提供商前缀缓存的输入token数（已包含在 prompt_tokens 中）
+    cost: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        """输入与输出token之和（推理token已包含在输出中）"""
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cache_miss_tokens(self) -> int:
+        """未命中前缀缓存的输入token数"""
+        return self.prompt_tokens - self.cache_hit_tokens
+
+    def add(self, other: "TokenUsage"):
+        """累加另一份用量"""
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.reasoning_tokens += other.reasoning_tokens
+        self.cache_hit_tokens += other.cache_hit_tokens
+        self.cost += other.cost
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（含总token数与缓存未命中的输入token数，费用保留6位小数）"""
+        report = asdict(self)
+        report["total_tokens"] = self.total_tokens
+        report["cache_miss_tokens"] = self.cache_miss_tokens
+        report["cost"] = round(self.cost, 6)
+        return report
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cache_hit_tokens: int = 0) -> float:
+    """按模型价格（美元/百万token）计算费用；命中前缀缓存的输入token按缓存价格计（未配置时按输入价格）"""
+    profile = get_model_profile(model)
+    cached_price = profile.get("cached_input_price", profile["input_price"])
+    return ((prompt_tokens - cache_hit_tokens) * profile["input_price"] + cache_hit_tokens * cached_price
+            + completion_tokens * profile["output_price"]) / 1_000_000
+
+
+def usage_from_completion(model: str, completion: Any) -> TokenUsage:
+    """
+    从API返回的completion对象中读取用量
+
+    前缀缓存命中数兼容 DeepSeek（usage.prompt_cache_hit_tokens）与 OpenAI（usage.prompt_tokens_details.cached_tokens）两种字段
+
+    Args:
+        model: 模型名称（用于计价）
+        completion: API返回的completion对象；没有 usage 字段时按0计
+
+    Returns:
+        本次调用的用量
+    """
+    usage = getattr(completion, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    details = getattr(usage, "completion_tokens_details", None)
+    reasoning_tokens = getattr(details, "reasoning_tokens", None) or 0
+    cache_hit_tokens = getattr(usage, "prompt_cache_hit_tokens", None) \
+        or getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    return TokenUsage(
+        calls=1,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        reasoning_tokens=reasoning_tokens,
+        cache_hit_tokens=cache_hit_tokens,
+        cost=estimate_cost(model, prompt_tokens, completion_tokens, cache_hit_tokens)
+    )
+
+
+class UsageTracker:
+    """
+    按 "provider/model" 汇总的用量统计（线程安全），可选的硬性预算
+
+    预算只在发起新调用前检查，因此已在途的调用仍会完成，实际用量最多超出约“并发数 × 单次调用”的量
+    """
+    def __init__(self, max_cost: Optional[float] = None, max_tokens: Optional[int] = None):
+        """
+        初始化用量统计
+
+        Args:
+            max_cost: 费用预算（美元），None表示不限制
+            max_tokens: token预算，None表示不限制
+        """
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self._by_backend: Dict[str, TokenUsage] = {}
+        self._total = TokenUsage()
+        self._lock = threading.Lock()
+
+    def record(self, backend: str, usage: TokenUsage):
+        """记录一次调用的用量"""
+        with self._lock:
+            self._by_backend.setdefault(backend, TokenUsage()).add(usage)
+            self._total.add(usage)
+
+    def merge(self, other: "UsageTracker"):
+        """累加另一份用量统计（例如汇总多次运行）"""
+        with other._lock:
+            backends = [(backend, TokenUsage(**vars(usage))) for backend, usage in other._by_backend.items()]
+        for backend, usage in backends:
+            self.record(backend, usage)
+
+    @property
+    def exhausted(self) -> bool:
+        """预算是否已用完"""
+        with self._lock:
+            return (self.max_cost is not None and self._total.cost >= self.max_cost) or \
+                (self.max_tokens is not None and self._total.total_tokens >= self.max_tokens)
+
+    def check_budget(self, backend: str):
+        """
+        发起新调用前检查预算
+
+        Raises:
+            BudgetExceededError: 预算已用完
+        """
+        if self.exhausted:
+            raise BudgetExceededError(f"运行预算已用完: {self.total().to_dict()}", backend)
+
+    def total(self) -> TokenUsage:
+        """所有后端的合计用量（副本）"""
+        with self._lock:
+            total = TokenUsage()
+            total.add(self._total)
+            return total
+
+    def by_backend(self) -> Dict[str, Dict[str, Any]]:
+        """各后端的用量"""
+        with self._lock:
+            return {backend: usage.to_dict() for backend, usage in self._by_backend.items()}
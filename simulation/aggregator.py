@@ -0,0 +1,186 @@
+"""
+流式结果聚合
+按完成顺序消费调度器产出的逐用户结果，存入预分配的NumPy数组并维护两个版本配对后的累计值，
+配合 FrameThrottle 以有界的帧率向界面推送增量更新，使界面开销不随用户数增长
+"""
+import time
+import logging
+from dataclasses import dataclass
+from typing import Dict, Hashable, Sequence, Set, Tuple
+
+import numpy as np
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认互动指标
+ENGAGEMENT_KEYS = ("like", "comment", "share", "quote")
+
+# 界面更新的默认最大帧率
+DEFAULT_MAX_FPS = 8.0
+
+
+class FrameThrottle:
+    """帧率节流：两次更新之间至少间隔 1/max_fps 秒"""
+    def __init__(self, max_fps: float = DEFAULT_MAX_FPS):
+        self.min_interval = 1.0 / max_fps
+        self._last = float("-inf")
+
+    def ready(self) -> bool:
+        """距离上次更新是否已超过最小间隔（返回True时视为已更新）"""
+        now = time.monotonic()
+        if now - self._last < self.min_interval:
+            return False
+        self._last = now
+        return True
+
+
+@dataclass(frozen=True)
+class AggregatorSnapshot:
+    """聚合器某一时刻的只读快照，供其他线程（例如界面轮询）展示部分结果"""
+    variants: Tuple[Hashable, ...]
+    paired: int
+    finished: int
+    cumulative_totals: Dict[Hashable, np.ndarray]  # 各版本配对用户的累计总互动数（只读副本）
+
+    def chart_rows(self, start: int, end: int) -> Dict[Hashable, np.ndarray]:
+        """配对用户 [start, end) 的累计总互动数，用于增量追加图表数据"""
+        return {variant: self.cumulative_totals[variant][start:end] for variant in self.variants}
+
+
+class StreamingAggregator:
+    """
+    A/B（或多版本）结果的流式聚合器
+
+    每个版本的结果按到达顺序写入 (max_users, 指标数) 的预分配数组；
+    所有版本都已到达第 i 个结果时，第 i 个用户才算“配对完成”，统计与图表只使用配对完成的用户
+
+    pair_by_index=True 时按用户序号配对（配对设计：同一序号在各版本中是同一受众画像）：
+    同一序号在所有版本中都成功后才写入一行，任一版本失败则整对排除
+    """
+    def __init__(self, max_users: int, variants: Sequence[Hashable] = ("A", "B"),
+                 metrics: Sequence[str] = ENGAGEMENT_KEYS, pair_by_index: bool = False):
+        """
+        初始化聚合器
+
+        Args:
+            max_users: 每个版本的最大用户数
+            variants: 版本标识
+            metrics: 互动指标名称
+            pair_by_index: 是否按用户序号配对
+        """
+        self.max_users = max_users
+        self.variants = tuple(variants)
+        self.metrics = tuple(metrics)
+        self.values = {variant: np.zeros((max_users, len(self.metrics)), dtype=np.int32) for variant in self.variants}
+        # 配对完成用户的累计总互动数，用于图表
+        self.cumulative_totals = {variant: np.zeros(max_users, dtype=np.int64) for variant in self.variants}
+        self.completed = {variant: 0 for variant in self.variants}
+        # 各版本每个用户序号是否成功（与配对方式无关）
+        self.succeeded = {variant: np.zeros(max_users, dtype=bool) for variant in self.variants}
+        self.paired = 0
+        self.finished = 0
+        self.failed = 0
+        self.pair_by_index = pair_by_index
+        # 第 i 个配对行对应的用户序号
+        self.paired_index = np.arange(max_users, dtype=np.int32)
+        # 按序号配对时尚未凑齐的结果，以及因某个版本失败而排除的序号
+        self._pending: Dict[int, Dict[Hashable, list]] = {}
+        self._dropped: Set[int] = set()
+
+    def add(self, result) -> Tuple[int, int]:
+        """
+        加入一个用户的结果
+
+        Args:
+            result: 调度器产出的 PredictionResult
+
+        Returns:
+            本次新配对完成的用户序号范围 [start, end)
+        """
+        self.finished += 1
+        if result.error is not None:
+            # 请求失败的用户不计入统计，避免被当作零互动
+            self.failed += 1
+            if self.pair_by_index:
+                self._pending.pop(result.index, None)
+                self._dropped.add(result.index)
+            return self.paired, self.paired
+        if result.index < self.max_users:
+            self.succeeded[result.variant][result.index] = True
+        if self.pair_by_index:
+            return self._add_by_index(result)
+
+        variant = result.variant
+        row = self.completed[variant]
+        if row >= self.max_users:
+            return self.paired, self.paired
+        self.values[variant][row] = [result.engagement[metric] for metric in self.metrics]
+        self.completed[variant] = row + 1
+
+        start = self.paired
+        end = min(self.completed.values())
+        self._accumulate(start, end)
+        return start, end
+
+    def _accumulate(self, start: int, end: int):
+        """更新配对行 [start, end) 的累计总互动数"""
+        for variant in self.variants:
+            totals = self.values[variant][start:end].sum(axis=1)
+            previous = self.cumulative_totals[variant][start - 1] if start > 0 else 0
+            self.cumulative_totals[variant][start:end] = previous + np.cumsum(totals)
+        self.paired = end
+
+    def _add_by_index(self, result) -> Tuple[int, int]:
+        """按用户序号配对加入结果"""
+        if result.index in self._dropped or result.index >= self.max_users:
+            return self.paired, self.paired
+        self.completed[result.variant] += 1
+        arrived = self._pending.setdefault(result.index, {})
+        arrived[result.variant] = [result.engagement[metric] for metric in self.metrics]
+        if len(arrived) < len(self.variants):
+            return self.paired, self.paired
+
+        del self._pending[result.index]
+        start = self.paired
+        for variant in self.variants:
+            self.values[variant][start] = arrived[variant]
+        self.paired_index[start] = result.index
+        self._accumulate(start, start + 1)
+        return start, start + 1
+
+    def user_totals(self, index: int) -> Tuple[int, ...]:
+        """第 index 个配对用户在各版本中的总互动数"""
+        return tuple(int(self.values[variant][index].sum()) for variant in self.variants)
+
+    def paired_values(self, variant: Hashable) -> np.ndarray:
+        """某版本所有配对用户的逐用户指标，形状 (配对用户数, 指标数)"""
+        return self.values[variant][:self.paired]
+
+    def paired_users(self) -> np.ndarray:
+        """各配对行对应的用户序号（按到达顺序配对时即 0..paired-1）"""
+        return self.paired_index[:self.paired]
+
+    def contiguous_users(self, variant: Hashable) -> int:
+        """某版本从序号0起连续成功的用户数，即响应缓存中可按序号复用的样本数"""
+        succeeded = self.succeeded[variant]
+        return self.max_users if succeeded.all() else int(succeeded.argmin())
+
+    def totals(self, variant: Hashable) -> Dict[str, int]:
+        """某版本所有配对用户的各指标累计值"""
+        sums = self.values[variant][:self.paired].sum(axis=0)
+        return {metric: int(value) for metric, value in zip(self.metrics, sums)}
+
+    def chart_rows(self, start: int, end: int) -> Dict[Hashable, np.ndarray]:
+        """配对用户 [start, end) 的累计总互动数，用于增量追加图表数据"""
+        return {variant: self.cumulative_totals[variant][start:end] for variant in self.variants}
+
+    def snapshot(self) -> AggregatorSnapshot:
+        """当前配对结果的只读快照（复制已配对部分，之后的结果不会改变快照）"""
+        cumulative_totals = {}
+        for variant in self.variants:
+            totals = self.cumulative_totals[variant][:self.paired].copy()
+            totals.flags.writeable = False
+            cumulative_totals[variant] = totals
+        return AggregatorSnapshot(variants=self.variants, paired=self.paired, finished=self.finished,
+                                  cumulative_totals=cumulative_totals)
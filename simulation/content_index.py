@@ -0,0 +1,307 @@
+"""
+近似重复内容索引
+记录每个 (平台, 模型, 提示词语言) 下已经模拟过的内容及其模拟用户数，提交新内容时查找近似重复：
+内容先归一化（Unicode兼容分解、统一大小写，去掉标点、符号与表情，合并空白），归一化后相同的内容直接命中；
+否则用字符三元组的 MinHash 签名做 LSH 分带检索，再按签名估计的Jaccard相似度确认。
+查找只做常数次字典访问与少量候选比较，与索引大小基本无关。
+
+复用的方式是改用相似内容的提示词：其已模拟的样本由响应缓存直接返回，只有超出部分的用户才发起新调用
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认索引文件位置（与响应缓存放在一起，可通过环境变量覆盖）
+DEFAULT_INDEX_PATH = os.getenv(
+    "VIRAL_CONTENT_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "contents.sqlite3")
+)
+
+# MinHash 签名长度与 LSH 分带：8 带 × 4 行，相似度 0.8 的内容成为候选的概率约 98%
+NUM_PERMUTATIONS = 32
+BANDS = 8
+ROWS = NUM_PERMUTATIONS // BANDS
+# 默认的相似度阈值（估计的Jaccard相似度）
+DEFAULT_THRESHOLD = 0.8
+
+# MinHash 的哈希族：乘法移位哈希 (a·x + b) mod 2^64 的高32位（a 为奇数），参数固定，保证持久化的签名跨进程可比
+_PERMUTATION_RNG = np.random.default_rng(20240611)
+_HASH_A = _PERMUTATION_RNG.integers(0, np.iinfo(np.uint64).max, size=NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_HASH_B = _PERMUTATION_RNG.integers(0, np.iinfo(np.uint64).max, size=NUM_PERMUTATIONS, dtype=np.uint64)
+# 字符三元组哈希的乘数
+_SHINGLE_MULTIPLIERS = (np.uint64(0x9E3779B1), np.uint64(0x85EBCA77), np.uint64(0xC2B2AE3D))
+# 字母、数字以外的字符（标点、符号、表情、变体选择符、零宽连接符、下划线等）
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_content(text: str) -> str:
+    """
+    归一化内容：NFKC、统一大小写，字母与数字以外的字符（标点、符号、表情、零宽连接符等）替换为空格，再合并空白
+
+    Args:
+        text: 内容文本
+
+    Returns:
+        归一化后的文本
+    """
+    return _NON_WORD.sub(" ", unicodedata.normalize("NFKC", text).casefold()).strip()
+
+
+def exact_key(normalized: str) -> int:
+    """归一化文本的64位摘要（有符号，可直接存入SQLite整数列）"""
+    digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def minhash_signature(normalized: str) -> np.ndarray:
+    """
+    归一化文本字符三元组集合的 MinHash 签名（向量化计算，不逐个三元组调用Python）
+
+    Args:
+        normalized: 归一化后的文本
+
+    Returns:
+        形状 (NUM_PERMUTATIONS,) 的 uint32 数组
+    """
+    codes = np.frombuffer(f" {normalized} ".encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < 3:
+        codes = np.pad(codes, (0, 3 - len(codes)))
+    first, second, third = _SHINGLE_MULTIPLIERS
+    # 重复的三元组不影响最小值，无需去重
+    shingles = (codes[:-2] * first ^ codes[1:-1] * second ^ codes[2:] * third) & np.uint64(0xFFFFFFFF)
+    hashed = (shingles[:, None] * _HASH_A[None, :] + _HASH_B[None, :]) >> np.uint64(32)
+    return hashed.min(axis=0).astype(np.uint32)
+
+
+def content_similarity(content_a: str, content_b: str) -> float:
+    """
+    两段内容的相似度
+
+    Args:
+        content_a: 内容A
+        content_b: 内容B
+
+    Returns:
+        归一化后相同时为1.0，否则为 MinHash 签名估计的Jaccard相似度
+    """
+    normalized_a, normalized_b = normalize_content(content_a), normalize_content(content_b)
+    if normalized_a == normalized_b:
+        return 1.0
+    return float((minhash_signature(normalized_a) == minhash_signature(normalized_b)).mean())
+
+
+@dataclass
+class SimilarContent:
+    """查找到的已模拟内容"""
+    content: str        # 已模拟过的内容原文
+    similarity: float   # 估计的Jaccard相似度；归一化后完全相同时为1.0
+    users: int          # 该内容已模拟的每版本用户数，即可从缓存复用的样本数
+
+
+class _Segment:
+    """一个 (平台, 模型, 语言) 分段的内存索引"""
+    def __init__(self):
+        self.contents: List[str] = []
+        self.users: List[int] = []
+        self.signatures = np.zeros((1024, NUM_PERMUTATIONS), dtype=np.uint32)
+        self.positions: Dict[str, int] = {}
+        self.exact: Dict[int, int] = {}
+        self.bands: List[Dict[bytes, List[int]]] = [{} for _ in range(BANDS)]
+
+    def add(self, content: str, key: int, signature: np.ndarray, users: int):
+        """加入内容；已存在时更新用户数（取较大值）"""
+        position = self.positions.get(content)
+        if position is not None:
+            self.users[position] = max(self.users[position], users)
+            return
+        position = len(self.contents)
+        if position >= len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+        self.contents.append(content)
+        self.users.append(users)
+        self.signatures[position] = signature
+        self.positions[content] = position
+        self.exact.setdefault(key, position)
+        for band, rows in enumerate(signature.reshape(BANDS, ROWS)):
+            self.bands[band].setdefault(rows.tobytes(), []).append(position)
+
+    def lookup(self, key: int, signature: np.ndarray, threshold: float) -> Optional[Tuple[int, float]]:
+        """查找最相似的内容，返回 (位置, 相似度)"""
+        position = self.exact.get(key)
+        if position is not None:
+            return position, 1.0
+
+        candidates = set()
+        for band, rows in enumerate(signature.reshape(BANDS, ROWS)):
+            candidates.update(self.bands[band].get(rows.tobytes(), ()))
+        if not candidates:
+            return None
+        positions = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = (self.signatures[positions] == signature).mean(axis=1)
+        best = similarities.max()
+        if best < threshold:
+            return None
+        # 相似度相同时优先选择已模拟用户更多的内容
+        tied = positions[similarities == best]
+        position = max(tied.tolist(), key=self.users.__getitem__)
+        return position, float(best)
+
+
+class ContentIndex:
+    """
+    已模拟内容的近似重复索引
+
+    持久化到SQLite（保存签名，加载时无需重新计算），每个分段在首次查找时加载到内存；
+    同一个实例可以在多个线程和协程之间共享
+    """
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, threshold: float = DEFAULT_THRESHOLD):
+        """
+        打开（或创建）索引
+
+        Args:
+            path: SQLite文件路径（":memory:" 表示不持久化）
+            threshold: 相似度阈值，估计的Jaccard相似度不低于该值才算近似重复
+        """
+        self.path = path
+        self.threshold = threshold
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS contents (
+                segment TEXT NOT NULL,
+                content TEXT NOT NULL,
+                exact_key INTEGER NOT NULL,
+                signature BLOB NOT NULL,
+                users INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (segment, content)
+            )
+        """)
+        self._segments: Dict[str, _Segment] = {}
+
+    @staticmethod
+    def _segment_key(platform: str, model: str, language: str) -> str:
+        return json.dumps([platform, model, language], ensure_ascii=False)
+
+    def _segment(self, segment_key: str) -> _Segment:
+        """获取分段的内存索引，首次访问时从数据库加载（调用方持有锁）"""
+        segment = self._segments.get(segment_key)
+        if segment is None:
+            segment = _Segment()
+            rows = self._conn.execute(
+                "SELECT content, exact_key, signature, users FROM contents WHERE segment = ? ORDER BY rowid",
+                (segment_key,)
+            ).fetchall()
+            for content, key, signature, users in rows:
+                segment.add(content, key, np.frombuffer(signature, dtype=np.uint32), users)
+            self._segments[segment_key] = segment
+            if rows:
+                logger.info(f"内容索引加载了 {len(rows)} 条 {segment_key} 的记录")
+        return segment
+
+    def lookup(self, platform: str, model: str, language: str, content: str) -> Optional[SimilarContent]:
+        """
+        查找近似重复的已模拟内容
+
+        Args:
+            platform: 发布平台
+            model: 模型标识（"provider/model"）
+            language: 提示词语言
+            content: 待模拟的内容
+
+        Returns:
+            最相似的已模拟内容；没有达到阈值的内容时返回None
+        """
+        normalized = normalize_content(content)
+        key, signature = exact_key(normalized), minhash_signature(normalized)
+        with self._lock:
+            segment = self._segment(self._segment_key(platform, model, language))
+            found = segment.lookup(key, signature, self.threshold)
+            if found is None:
+                return None
+            position, similarity = found
+            return SimilarContent(content=segment.contents[position], similarity=similarity,
+                                  users=segment.users[position])
+
+    def lookup_pair(self, platform: str, model: str, language: str, content_a: str,
+                    content_b: str) -> Tuple[Optional[SimilarContent], Optional[SimilarContent]]:
+        """
+        为A/B比较的两个版本查找近似重复的已模拟内容
+
+        两个版本互为近似重复（被测试的正是这点细微差别），或替换后两个版本的内容近似重复时不复用：
+        否则两个版本会使用相同的提示词与缓存键，回放同样的样本，比较必然显示没有差异
+
+        Args:
+            platform: 发布平台
+            model: 模型标识（"provider/model"）
+            language: 提示词语言
+            content_a: 版本A的内容
+            content_b: 版本B的内容
+
+        Returns:
+            (版本A的相似内容, 版本B的相似内容)；不复用的版本为None
+        """
+        if content_similarity(content_a, content_b) >= self.threshold:
+            return None, None
+        similar_a = self.lookup(platform, model, language, content_a)
+        similar_b = self.lookup(platform, model, language, content_b)
+        resolved_a = similar_a.content if similar_a is not None else content_a
+        resolved_b = similar_b.content if similar_b is not None else content_b
+        if content_similarity(resolved_a, resolved_b) >= self.threshold:
+            return None, None
+        return similar_a, similar_b
+
+    def add(self, platform: str, model: str, language: str, content: str, users: int):
+        """
+        记录一段已模拟的内容
+
+        Args:
+            platform: 发布平台
+            model: 模型标识（"provider/model"）
+            language: 提示词语言
+            content: 内容原文（用于重建提示词）
+            users: 从序号0起连续完成（可由响应缓存复用）的用户数；内容已存在时保留较大值
+        """
+        if users <= 0:
+            return
+        normalized = normalize_content(content)
+        key, signature = exact_key(normalized), minhash_signature(normalized)
+        segment_key = self._segment_key(platform, model, language)
+        with self._lock:
+            self._segment(segment_key).add(content, key, signature, users)
+            self._conn.execute(
+                """
+                INSERT INTO contents VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (segment, content) DO UPDATE SET
+                    users = MAX(users, excluded.users), updated_at = excluded.updated_at
+                """,
+                (segment_key, content, key, signature.tobytes(), users, time.time())
+            )
+
+    def stats(self) -> Dict[str, int]:
+        """索引统计信息"""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM contents").fetchone()[0]
+        return {"entries": count, "loaded_segments": len(self._segments)}
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
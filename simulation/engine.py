@@ -0,0 +1,663 @@
+"""
+模拟引擎
+与界面无关的A/B模拟核心：可被Streamlit应用、命令行批处理或其他脚本直接导入使用
+"""
+import os
+import sys
+import math
+import time
+import asyncio
+import logging
+from contextlib import aclosing, contextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.model_config import get_max_choices, get_model_profile, get_rate_limits
+from llms.call_context import run_metrics, run_usage
+from llms.metrics import MetricsRegistry
+from llms.rate_limiter import estimate_tokens
+from llms.usage import STATUS_BUDGET_EXCEEDED, UsageTracker, estimate_cost
+from simulation.scheduler import PredictionScheduler, interleave_jobs, DEFAULT_MAX_CONCURRENCY
+from simulation.sequential import SequentialABTest, SequentialDecision
+from simulation.aggregator import StreamingAggregator
+from simulation.run_store import RunStore
+from simulation.personas import (
+    DEFAULT_POPULATION, Persona, PersonaAssignment, assign_personas, get_population, persona_block_size
+)
+from simulation.stats import ComparisonStats, compare_paired, compare_variants, with_total
+from simulation.surrogate import EngagementSurrogate
+from simulation.content_index import ContentIndex
+from prompt.content_prediction import get_engagement_prompt
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 支持的发布平台
+PLATFORMS = ("Twitter", "Facebook", "Instagram", "LinkedIn", "TikTok")
+
+# 运行前估算时，每次调用在内容提示词之外附加的格式要求约占的token数
+PROMPT_OVERHEAD_TOKENS = 80
+# 批量模式下每多模拟一个用户预计增加的输出token数
+BATCH_OUTPUT_TOKENS_PER_USER = 24
+# 注入受众画像后每次调用增加的输入token数
+PERSONA_PROMPT_TOKENS = 30
+
+# 结果行中的用量列
+USAGE_COLUMNS = ("prompt_tokens", "cache_hit_tokens", "completion_tokens", "reasoning_tokens")
+
+
+def comparison_columns(comparison: ComparisonStats) -> Dict[str, Any]:
+    """比较结果的逐指标列：A/B累计值、胜出版本、置信度与校正后的p值"""
+    columns = {}
+    for metric in comparison.metrics:
+        result = comparison.metric(metric)
+        columns[f"{metric}_a"] = result["a"]
+        columns[f"{metric}_b"] = result["b"]
+        columns[f"{metric}_winner"] = result["winner"]
+        columns[f"{metric}_confidence"] = round(result["confidence"], 2)
+        columns[f"{metric}_p"] = result["p_value"]
+    return columns
+
+
+@dataclass
+class SimulationConfig:
+    """一次A/B模拟的参数"""
+    max_users: int = 20
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    users_per_call: int = 1
+    early_stopping: bool = False
+    cost_budget: Optional[float] = None   # 单次运行的费用上限（美元），None表示不限制
+    token_budget: Optional[int] = None    # 单次运行的token上限，None表示不限制
+    # 单用户提示词模式下每次调用请求的独立候选数（API 的 n 参数）：None表示按提供商能力取上限，1表示关闭
+    choices_per_call: Optional[int] = None
+    # 受众画像抽样：按平台画像分层分配用户，A/B在同一画像上配对比较
+    personas: bool = False
+    persona_seed: int = 0
+    persona_populations: Optional[Dict[str, Tuple[Persona, ...]]] = None  # 覆盖默认画像配置，None表示使用默认值
+
+    def resolve_choices(self, max_choices: int, strata: int = len(DEFAULT_POPULATION)) -> int:
+        """
+        实际每次调用请求的候选数；批量提示词模式（users_per_call>1）下为1
+
+        启用受众画像时同一次调用的候选共享画像，候选数按画像数 strata 受 persona_block_size 限制
+        """
+        if self.users_per_call > 1:
+            return 1
+        requested = max_choices if self.choices_per_call is None else self.choices_per_call
+        choices = max(min(requested, max_choices), 1)
+        if self.personas:
+            choices = persona_block_size(choices, self.max_users, strata)
+        return choices
+
+    def resolve_users_per_call(self, strata: int = len(DEFAULT_POPULATION)) -> int:
+        """实际每次批量提示词调用模拟的用户数（启用受众画像时同样受 persona_block_size 限制）"""
+        if self.personas:
+            return persona_block_size(self.users_per_call, self.max_users, strata)
+        return self.users_per_call
+
+    def call_size(self, max_choices: int, strata: int = len(DEFAULT_POPULATION)) -> int:
+        """每次LLM调用覆盖的用户数"""
+        return max(self.resolve_users_per_call(strata), self.resolve_choices(max_choices, strata))
+
+
+@dataclass
+class ABRunResult:
+    """一次A/B模拟的结果"""
+    aggregator: StreamingAggregator
+    decision: Optional[SequentialDecision]
+    calls_started: int
+    total_calls: int
+    store: Optional[RunStore] = None
+    usage: Optional[UsageTracker] = None
+    budget_exhausted: bool = False
+    metrics: Optional[MetricsRegistry] = None
+    personas: Optional[PersonaAssignment] = None
+
+    @property
+    def users(self) -> int:
+        """两个版本都已完成的用户数"""
+        return self.aggregator.paired
+
+    @property
+    def failed(self) -> int:
+        """请求失败、被排除在统计之外的用户数"""
+        return self.aggregator.failed
+
+    @property
+    def saved_calls(self) -> int:
+        """提前停止节省的LLM调用数"""
+        return self.total_calls - self.calls_started
+
+    def compare(self, **kwargs) -> ComparisonStats:
+        """
+        一次性检验所有指标（含总互动数）；使用受众画像时按画像分层做配对检验
+
+        Args:
+            **kwargs: 传给 compare_variants / compare_paired 的参数（alpha、correction、n_bootstrap 等）
+        """
+        values_a = with_total(self.aggregator.paired_values("A"))
+        values_b = with_total(self.aggregator.paired_values("B"))
+        metrics = self.aggregator.metrics + ("total",)
+        if self.personas is not None:
+            return compare_paired(values_a, values_b, metrics=metrics,
+                                  strata=self.personas.strata[self.aggregator.paired_users()],
+                                  weights=self.personas.weights, **kwargs)
+        return compare_variants(values_a, values_b, metrics=metrics, **kwargs)
+
+    def summary(self) -> Dict[str, Any]:
+        """结果摘要：各指标的累计值、胜出版本、置信度与校正后的p值"""
+        comparison = self.compare(n_bootstrap=0)
+        summary = {
+            "users": self.users,
+            "failed": self.failed,
+            "calls_started": self.calls_started,
+            "early_stopped": self.decision is not None,
+            "budget_exhausted": self.budget_exhausted,
+            "paired": self.personas is not None
+        }
+        if self.usage is not None:
+            total = self.usage.total()
+            summary.update({column: getattr(total, column) for column in USAGE_COLUMNS})
+            summary["cost"] = round(total.cost, 6)
+        summary.update(comparison_columns(comparison))
+        return summary
+
+
+def surrogate_summary(comparison: ComparisonStats) -> Dict[str, Any]:
+    """代理模型作答的结果行：列与 ABRunResult.summary 一致，没有模拟用户，也没有发起调用"""
+    summary = {
+        "users": 0,
+        "failed": 0,
+        "calls_started": 0,
+        "early_stopped": False,
+        "budget_exhausted": False,
+        "paired": False,
+        **{column: 0 for column in USAGE_COLUMNS},
+        "cost": 0.0
+    }
+    summary.update(comparison_columns(comparison))
+    return summary
+
+
+@dataclass
+class RunEstimate:
+    """运行前的用量估算（未考虑缓存命中与提前停止，因此是上限估计）"""
+    calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    duration: float  # 秒
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def estimate_run(provider: str, model: str, prompts: Sequence[Tuple[str, int]],
+                 config: SimulationConfig) -> RunEstimate:
+    """
+    运行前估算一组提示词模拟的token数、费用与耗时
+
+    耗时取并发执行耗时与提供商每分钟请求数限制两者中较大者
+
+    Args:
+        provider: 模型提供商
+        model: 模型名称
+        prompts: (提示词, 模拟用户数) 列表
+        config: 模拟参数
+
+    Returns:
+        估算结果
+    """
+    profile = get_model_profile(model)
+    choices = config.resolve_choices(get_max_choices(provider, model))
+    call_size = config.call_size(get_max_choices(provider, model))
+    calls = prompt_tokens = 0
+    for prompt, users in prompts:
+        prompt_calls = math.ceil(users / call_size)
+        calls += prompt_calls
+        # 提示词每次请求只处理一次，多候选请求的输入token由所有候选分摊
+        prompt_tokens += prompt_calls * (estimate_tokens(prompt) + PROMPT_OVERHEAD_TOKENS)
+        if config.personas:
+            prompt_tokens += prompt_calls * PERSONA_PROMPT_TOKENS
+
+    output_per_choice = (profile["typical_output_tokens"]
+                         + BATCH_OUTPUT_TOKENS_PER_USER * (config.resolve_users_per_call() - 1))
+    completion_tokens = calls * output_per_choice * choices
+
+    # 多个候选并行生成，单次调用的耗时按单个候选的输出长度估算
+    latency = profile["typical_latency"] * output_per_choice / profile["typical_output_tokens"]
+    duration = math.ceil(calls / config.max_concurrency) * latency
+    rpm = get_rate_limits(provider).get("rpm")
+    if rpm:
+        duration = max(duration, calls / rpm * 60)
+
+    return RunEstimate(
+        calls=calls,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cost=estimate_cost(model, prompt_tokens, completion_tokens),
+        duration=duration
+    )
+
+
+def estimate_ab_test(provider: str, model: str, prompt_a: str, prompt_b: str,
+                     config: SimulationConfig) -> RunEstimate:
+    """
+    运行前估算一次A/B模拟的token数、费用与耗时
+
+    Args:
+        provider: 模型提供商
+        model: 模型名称
+        prompt_a: 版本A的提示词
+        prompt_b: 版本B的提示词
+        config: 模拟参数
+
+    Returns:
+        估算结果
+    """
+    return estimate_run(provider, model, [(prompt_a, config.max_users), (prompt_b, config.max_users)], config)
+
+
+def build_prompt(platform: str, content: str, language: str = "en") -> str:
+    """
+    生成指定平台与内容的预测提示词
+
+    Args:
+        platform: 发布平台
+        content: 内容文本
+        language: 提示词语言 ("en" / "zh")
+
+    Returns:
+        提示词
+    """
+    return get_engagement_prompt(language).format(platform=platform, content=content)
+
+
+@contextmanager
+def run_accounting(config: SimulationConfig) -> Iterator[Tuple[UsageTracker, MetricsRegistry]]:
+    """
+    本次运行的用量统计、预算与调用指标，通过上下文变量传给调度器发起的每个调用
+
+    Args:
+        config: 模拟参数（费用与token预算）
+
+    Returns:
+        (用量统计, 调用指标)
+    """
+    usage = UsageTracker(max_cost=config.cost_budget, max_tokens=config.token_budget)
+    metrics = MetricsRegistry()
+    usage_token = run_usage.set(usage)
+    metrics_token = run_metrics.set(metrics)
+    try:
+        yield usage, metrics
+    finally:
+        run_metrics.reset(metrics_token)
+        run_usage.reset(usage_token)
+
+
+async def run_ab_test(llm_client, prompt_a: str, prompt_b: str, config: SimulationConfig,
+                      scheduler: Optional[PredictionScheduler] = None,
+                      on_result: Optional[Callable[[StreamingAggregator], None]] = None,
+                      platform: Optional[str] = None, language: str = "en") -> ABRunResult:
+    """
+    运行一次A/B模拟
+
+    Args:
+        llm_client: ViralPredictionLLM / RoutingLLM 等提供预测方法的客户端
+        prompt_a: 版本A的提示词
+        prompt_b: 版本B的提示词
+        config: 模拟参数
+        scheduler: 共享的调度器；为None时按 config.max_concurrency 新建（多个模拟共享调度器即共享并发上限）
+        on_result: 每收到一个用户结果后的回调，参数为聚合器
+        platform: 发布平台，用于选择受众画像（config.personas 为True时必需）
+        language: 提示词语言，用于画像说明
+
+    Returns:
+        模拟结果
+
+    Raises:
+        CacheMissError: 回放模式下缓存未命中
+    """
+    if config.personas and platform is None:
+        raise ValueError("受众画像抽样需要指定平台")
+    with run_accounting(config) as (usage, metrics):
+        result = await _run_ab_test(llm_client, prompt_a, prompt_b, config, usage, scheduler, on_result,
+                                    platform, language)
+    result.metrics = metrics
+    return result
+
+
+async def _run_ab_test(llm_client, prompt_a: str, prompt_b: str, config: SimulationConfig, usage: UsageTracker,
+                       scheduler: Optional[PredictionScheduler],
+                       on_result: Optional[Callable[[StreamingAggregator], None]],
+                       platform: Optional[str], language: str) -> ABRunResult:
+    if scheduler is None:
+        scheduler = PredictionScheduler(llm_client, max_concurrency=config.max_concurrency)
+
+    # 按客户端支持的候选数上限把每个版本的用户分块
+    max_choices = getattr(llm_client, "max_choices", 1)
+    # 受众画像按调用分块分配，同一次调用覆盖的用户共享画像（块大小按画像数限制）；两个版本按用户序号配对
+    personas = None
+    strata = len(DEFAULT_POPULATION)
+    if config.personas:
+        population = get_population(platform, config.persona_populations)
+        strata = len(population)
+        personas = assign_personas(population, config.max_users, block_size=config.call_size(max_choices, strata),
+                                   seed=config.persona_seed, language=language)
+    choices = config.resolve_choices(max_choices, strata)
+    users_per_call = config.resolve_users_per_call(strata)
+    aggregator = StreamingAggregator(max_users=config.max_users, pair_by_index=personas is not None)
+    store = RunStore(capacity=2 * config.max_users, metadata={
+        "provider": getattr(llm_client, "provider", None),
+        "model": getattr(llm_client, "model", None),
+        "max_users": config.max_users,
+        "users_per_call": users_per_call,
+        "choices_per_call": choices,
+        "early_stopping": config.early_stopping,
+        "started_at": time.time(),
+        **(personas.to_metadata() if personas is not None else {})
+    })
+    sequential_test = SequentialABTest(max_users=config.max_users) if config.early_stopping else None
+    decision = None
+
+    calls_started = 0
+    budget_exhausted = False
+
+    def _counted(jobs: Iterable):
+        """统计实际发起的调用数；预算用完后不再发起新调用，已在途的调用正常完成"""
+        nonlocal calls_started, budget_exhausted
+        for job in jobs:
+            if usage.exhausted:
+                budget_exhausted = True
+                logger.warning(f"运行预算已用完，停止发起新调用: {usage.total().to_dict()}")
+                return
+            calls_started += 1
+            yield job
+
+    jobs = interleave_jobs({"A": prompt_a, "B": prompt_b}, config.max_users,
+                           users_per_call=users_per_call, choices_per_call=choices,
+                           personalize=personas.prompt if personas is not None else None)
+    total_calls = 2 * math.ceil(config.max_users / config.call_size(max_choices, strata))
+
+    async with aclosing(scheduler.run(_counted(jobs))) as results:
+        async for result in results:
+            if result.status == STATUS_BUDGET_EXCEEDED:
+                # 检查预算与发起调用之间的竞争：被拒绝的调用不算作失败用户
+                budget_exhausted = True
+                continue
+            start, end = aggregator.add(result)
+            store.add(result)
+
+            # 序贯检验：越过停止边界后关闭结果流，取消在途请求且不再发起新调用
+            if sequential_test is not None:
+                for index in range(start, end):
+                    decision = sequential_test.add_pair(*aggregator.user_totals(index))
+                    if decision is not None:
+                        break
+
+            if on_result is not None:
+                on_result(aggregator)
+
+            if decision is not None:
+                break
+
+    return ABRunResult(aggregator=aggregator, decision=decision, calls_started=calls_started,
+                       total_calls=total_calls, store=store, usage=usage, budget_exhausted=budget_exhausted,
+                       personas=personas)
+
+
+@dataclass
+class PlatformSweepResult:
+    """同一组A/B内容在多个平台上的模拟结果"""
+    results: Dict[str, ABRunResult]
+
+    @property
+    def calls_started(self) -> int:
+        """所有平台实际发起的LLM调用数"""
+        return sum(result.calls_started for result in self.results.values())
+
+    @property
+    def budget_exhausted(self) -> bool:
+        """是否有平台因预算用完而提前停止"""
+        return any(result.budget_exhausted for result in self.results.values())
+
+    @property
+    def usage(self) -> UsageTracker:
+        """所有平台的合计用量"""
+        total = UsageTracker()
+        for result in self.results.values():
+            total.merge(result.usage)
+        return total
+
+    def matrix(self, **kwargs) -> List[Dict[str, Any]]:
+        """
+        平台 × 指标的比较矩阵：每个平台一行，各指标的A/B累计值、胜出版本、置信度与校正后的p值
+
+        Args:
+            **kwargs: 传给 ABRunResult.compare 的参数
+
+        Returns:
+            每个平台一行（按平台顺序）
+        """
+        rows = []
+        for platform, result in self.results.items():
+            row = {"platform": platform, "users": result.users, "failed": result.failed}
+            row.update(comparison_columns(result.compare(**kwargs)))
+            rows.append(row)
+        return rows
+
+
+async def run_platform_sweep(llm_client, content_a: str, content_b: str, platforms: Sequence[str],
+                             config: SimulationConfig, language: str = "en",
+                             scheduler: Optional[PredictionScheduler] = None,
+                             on_result: Optional[Callable[[str, StreamingAggregator], None]] = None
+                             ) -> PlatformSweepResult:
+    """
+    在多个平台上同时运行同一组A/B内容的模拟
+
+    所有平台 × 版本的调用共用一个调度器（一个并发上限）与客户端的响应缓存，
+    因此总耗时约等于最慢平台的耗时，而不是各平台耗时之和；预算对每个平台分别生效
+
+    Args:
+        llm_client: 提供预测方法的客户端
+        content_a: 版本A的内容
+        content_b: 版本B的内容
+        platforms: 发布平台
+        config: 每个平台的模拟参数
+        language: 提示词语言
+        scheduler: 共享的调度器；为None时按 config.max_concurrency 新建
+        on_result: 每收到一个用户结果后的回调，参数为平台与该平台的聚合器
+
+    Returns:
+        各平台的模拟结果
+
+    Raises:
+        CacheMissError: 回放模式下缓存未命中
+    """
+    if scheduler is None:
+        scheduler = PredictionScheduler(llm_client, max_concurrency=config.max_concurrency)
+
+    async def _run(platform: str) -> ABRunResult:
+        result = await run_ab_test(
+            llm_client,
+            build_prompt(platform, content_a, language),
+            build_prompt(platform, content_b, language),
+            config,
+            scheduler=scheduler,
+            on_result=(lambda aggregator: on_result(platform, aggregator)) if on_result is not None else None,
+            platform=platform,
+            language=language
+        )
+        result.store.metadata.update({"platform": platform})
+        return result
+
+    tasks = [asyncio.create_task(_run(platform)) for platform in platforms]
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        # 某个平台出错（例如回放时缓存未命中）时取消其余平台
+        for task in tasks:
+            task.cancel()
+    return PlatformSweepResult(results=dict(zip(platforms, results)))
+
+
+def reuse_similar_contents(content_index: ContentIndex, platform: str, model: str, language: str,
+                           content_a: str, content_b: str) -> Tuple[Tuple[str, float], Tuple[str, float]]:
+    """
+    为A/B比较的两个版本查找近似重复的已模拟内容，找到时改为模拟该内容
+
+    改用已模拟内容的提示词后，其已完成的样本由响应缓存直接返回，只有超出部分的用户才发起新调用；
+    两个版本互为近似重复或会被替换为近似重复的内容时不复用（见 ContentIndex.lookup_pair）
+
+    Args:
+        content_index: 内容索引
+        platform: 发布平台
+        model: 模型标识（"provider/model"）
+        language: 提示词语言
+        content_a: 版本A的内容
+        content_b: 版本B的内容
+
+    Returns:
+        两个版本的 (实际模拟的内容, 相似度)；不复用的版本为原内容与0.0
+    """
+    resolved = []
+    for variant, content, similar in zip(("A", "B"), (content_a, content_b),
+                                         content_index.lookup_pair(platform, model, language, content_a, content_b)):
+        if similar is None:
+            resolved.append((content, 0.0))
+            continue
+        logger.info(f"版本 {variant} 与已模拟内容近似重复（相似度 {similar.similarity:.2f}），"
+                    f"复用其 {similar.users} 个已模拟用户")
+        resolved.append((similar.content, similar.similarity))
+    return resolved[0], resolved[1]
+
+
+@dataclass
+class ComparisonTask:
+    """批处理中的一组待比较内容"""
+    id: str
+    content_a: str
+    content_b: str
+    platform: str
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+async def run_comparisons(llm_client, tasks: Iterable[ComparisonTask], config: SimulationConfig,
+                          language: str = "en", max_parallel: int = 8,
+                          on_run: Optional[Callable[[ComparisonTask, ABRunResult], None]] = None,
+                          surrogate: Optional[EngagementSurrogate] = None,
+                          content_index: Optional[ContentIndex] = None
+                          ) -> AsyncIterator[Dict[str, Any]]:
+    """
+    并发运行多组A/B比较，按完成顺序逐个返回结果行
+
+    所有比较共享同一个调度器（同一个LLM并发上限），同时进行中的比较数不超过 max_parallel。
+    指定代理模型时，两段内容都有把握的比较直接由代理模型作答（结果行 source 为 "surrogate"），
+    其余比较照常模拟（source 为 "llm"），模拟结果再加入代理模型的训练集。
+    指定内容索引时，与已模拟内容近似重复的内容改为模拟该内容（复用其缓存的样本，结果行记录 reuse_similarity_a/_b），
+    模拟完成后把内容与用户数记入索引
+
+    Args:
+        llm_client: 提供预测方法的客户端
+        tasks: 待比较的内容（可以是惰性迭代器）
+        config: 每组比较的模拟参数
+        language: 提示词语言
+        max_parallel: 同时进行中的比较数
+        on_run: 每组比较完成后的回调，参数为任务与完整的模拟结果（例如用于保存逐用户结果）
+        surrogate: 代理模型；为None时所有比较都由LLM模拟
+        content_index: 近似重复内容索引；需要启用响应缓存才能真正复用样本
+
+    Returns:
+        结果行（字典）的异步迭代器
+    """
+    scheduler = PredictionScheduler(llm_client, max_concurrency=config.max_concurrency)
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(max_parallel)
+    model_key = f"{llm_client.provider}/{llm_client.model}"
+
+    async def _compare(task: ComparisonTask):
+        row = {"id": task.id, "platform": task.platform, **task.extra}
+        if surrogate is not None:
+            row["source"] = "llm"
+            # 拟合与预测在线程中执行（代理模型内部串行），不阻塞其他比较的LLM调用
+            try:
+                estimate = await asyncio.to_thread(surrogate.compare, task.platform, task.content_a,
+                                                   task.content_b, config.max_users)
+            except Exception as e:
+                # 代理模型出错时改用LLM模拟，不影响其他比较
+                logger.warning(f"比较 {task.id} 的代理模型预测失败，改用LLM模拟: {str(e)}")
+                estimate = None
+            if estimate is not None:
+                row.update(surrogate_summary(estimate))
+                row.update({"source": "surrogate", "error": None})
+                return row
+        content_a, content_b = task.content_a, task.content_b
+        try:
+            if content_index is not None:
+                reused = reuse_similar_contents(content_index, task.platform, model_key, language, content_a, content_b)
+                (content_a, row["reuse_similarity_a"]), (content_b, row["reuse_similarity_b"]) = reused
+            result = await run_ab_test(
+                llm_client,
+                build_prompt(task.platform, content_a, language),
+                build_prompt(task.platform, content_b, language),
+                config,
+                scheduler=scheduler,
+                platform=task.platform,
+                language=language
+            )
+            row.update(result.summary())
+            row["error"] = None
+            if content_index is not None:
+                # 只记录从序号0起连续完成的用户：提前停止或预算用完时之后的序号不在缓存中
+                content_index.add(task.platform, model_key, language, content_a,
+                                  result.aggregator.contiguous_users("A"))
+                content_index.add(task.platform, model_key, language, content_b,
+                                  result.aggregator.contiguous_users("B"))
+            if surrogate is not None:
+                # 训练样本记在实际模拟的内容（复用近似重复内容时为已模拟过的内容）下
+                await asyncio.to_thread(surrogate.observe, task.platform, content_a,
+                                        result.aggregator.paired_values("A"))
+                await asyncio.to_thread(surrogate.observe, task.platform, content_b,
+                                        result.aggregator.paired_values("B"))
+            if on_run is not None:
+                result.store.metadata.update({"id": task.id, "platform": task.platform})
+                on_run(task, result)
+        except Exception as e:
+            logger.error(f"比较 {task.id} 失败: {str(e)}")
+            row["error"] = str(e)
+        return row
+
+    async def _run_one(task: ComparisonTask):
+        try:
+            await queue.put(await _compare(task))
+        finally:
+            slots.release()
+
+    async def _submit():
+        try:
+            for task in tasks:
+                await slots.acquire()
+                running_task = asyncio.create_task(_run_one(task))
+                running.add(running_task)
+                running_task.add_done_callback(running.discard)
+            await asyncio.gather(*running)
+        finally:
+            queue.put_nowait(None)
+
+    running = set()
+    submitter = asyncio.create_task(_submit())
+    try:
+        while True:
+            row = await queue.get()
+            if row is None:
+                break
+            yield row
+        await submitter
+    finally:
+        submitter.cancel()
+        for running_task in list(running):
+            running_task.cancel()
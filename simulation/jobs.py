@@ -0,0 +1,223 @@
+"""
+后台任务管理
+在独立的常驻事件循环线程中运行模拟任务：提交后立即返回任务ID，调用方（例如每次交互都会重新运行的
+Streamlit脚本）轮询进度与部分结果，可随时取消。脚本重新运行或切换语言不会中断任务，
+同一进程中多个会话的任务也可以同时进行，只受 max_running 限制
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.client_pool import EventLoopThread
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_PENDING = "pending"        # 等待空闲的运行槽位
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+# 同时运行的任务数上限
+DEFAULT_MAX_RUNNING = 4
+# 已结束任务的保留秒数（超过后在提交新任务时清理）
+DEFAULT_RETENTION = 3600.0
+
+
+@dataclass
+class Job:
+    """
+    一个后台任务
+
+    progress、partial、status 等字段由任务事件循环线程写入、由其他线程读取；
+    partial 应是不再改变的快照（例如 StreamingAggregator.snapshot()），与进度一起在锁内发布，
+    读取方用 latest() 同时取得两者
+    """
+    id: str
+    kind: str
+    owner: Optional[str] = None                 # 提交方标识（例如会话ID），用于列出某个会话的任务
+    context: Dict[str, Any] = field(default_factory=dict)  # 提交时的参数，供展示结果时使用
+    status: str = JOB_PENDING
+    progress: float = 0.0                       # 0~1
+    partial: Any = None                         # 最近一次报告的部分结果
+    result: Any = None
+    error: Optional[BaseException] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _future: Optional[concurrent.futures.Future] = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        """任务是否已结束（完成、失败或取消）"""
+        return self.status in FINISHED_STATES
+
+    @property
+    def elapsed(self) -> float:
+        """已运行的秒数（未开始时为0）"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def report(self, progress: Optional[float] = None, partial: Any = None):
+        """
+        由任务协程调用：更新进度与部分结果
+
+        Args:
+            progress: 进度（0~1），为None时不更新
+            partial: 部分结果的快照，为None时不更新
+        """
+        with self._lock:
+            if progress is not None:
+                self.progress = min(max(progress, 0.0), 1.0)
+            if partial is not None:
+                self.partial = partial
+
+    def latest(self) -> Tuple[float, Any]:
+        """由其他线程调用：最近一次报告的 (进度, 部分结果快照)"""
+        with self._lock:
+            return self.progress, self.partial
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        阻塞等待任务结束
+
+        Args:
+            timeout: 超时秒数，为None时一直等待
+
+        Returns:
+            任务是否已结束
+        """
+        if self._future is not None:
+            concurrent.futures.wait([self._future], timeout=timeout)
+        return self.finished
+
+
+class JobManager:
+    """在专用事件循环线程中运行任务的管理器（线程安全）"""
+    def __init__(self, max_running: int = DEFAULT_MAX_RUNNING, retention: float = DEFAULT_RETENTION):
+        """
+        初始化任务管理器
+
+        Args:
+            max_running: 同时运行的任务数上限，超出的任务排队等待
+            retention: 已结束任务的保留秒数
+        """
+        if max_running < 1:
+            raise ValueError(f"同时运行的任务数必须大于0: {max_running}")
+        self.max_running = max_running
+        self.retention = retention
+        self._loop_thread = EventLoopThread(name="simulation-jobs")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        # 信号量只在任务事件循环中创建与使用
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def submit(self, run: Callable[[Job], Awaitable[Any]], kind: str = "run", owner: Optional[str] = None,
+               context: Optional[Dict[str, Any]] = None) -> Job:
+        """
+        提交任务
+
+        Args:
+            run: 任务协程函数，参数为任务本身（用于 job.report 报告进度），返回值即任务结果
+            kind: 任务类型
+            owner: 提交方标识
+            context: 提交时的参数
+
+        Returns:
+            任务（立即返回，任务在后台运行）
+        """
+        job = Job(id=uuid.uuid4().hex[:12], kind=kind, owner=owner, context=dict(context or {}))
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        job._future = self._loop_thread.submit(self._run(job, run))
+        # 任务在开始运行前就被取消时，协程不会执行，由这里标记状态
+        job._future.add_done_callback(lambda future: self._on_future_done(job, future))
+        logger.info(f"提交后台任务 {job.id} ({kind})")
+        return job
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[Any]]):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_running)
+        try:
+            async with self._slots:
+                job.status = JOB_RUNNING
+                job.started_at = time.time()
+                job.result = await run(job)
+                job.progress = 1.0
+                job.status = JOB_DONE
+        except asyncio.CancelledError:
+            job.status = JOB_CANCELLED
+            logger.info(f"后台任务 {job.id} 已取消")
+            raise
+        except Exception as e:
+            job.error = e
+            job.status = JOB_FAILED
+            logger.error(f"后台任务 {job.id} 失败: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+
+    @staticmethod
+    def _on_future_done(job: Job, future: concurrent.futures.Future):
+        if future.cancelled() and not job.finished:
+            job.status = JOB_CANCELLED
+            job.finished_at = time.time()
+
+    def _prune(self):
+        """清理超过保留期的已结束任务（调用方持有锁）"""
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """按ID获取任务，不存在（或已被清理）时返回None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, owner: Optional[str] = None) -> List[Job]:
+        """按提交时间排列的任务，可只列出某个提交方的任务"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if owner is None or job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created_at)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消任务：正在运行的任务会取消其在途的LLM请求
+
+        Returns:
+            是否发出了取消（任务不存在或已结束时返回False）
+        """
+        job = self.get(job_id)
+        if job is None or job.finished or job._future is None:
+            return False
+        job._future.cancel()
+        return True
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """获取进程级的任务管理器（首次调用时创建）"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(max_running=int(os.getenv("VIRAL_MAX_RUNNING_JOBS", str(DEFAULT_MAX_RUNNING))))
+        return _manager
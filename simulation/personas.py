@@ -0,0 +1,241 @@
+"""
+受众画像抽样
+每个平台配置一组带权重的受众画像（可从JSON文件覆盖）；按权重分层、以种子确定地为每个模拟用户分配画像，
+并把画像注入提示词。A/B两个版本在同一用户序号上使用同一画像（配对设计），
+画像带来的用户间差异在逐用户差值中相互抵消，检验只需面对剩余的抽样噪声
+"""
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 每个画像至少应分到的调用块数：同一次调用覆盖的用户共享画像，块过大时大部分画像分不到用户，分层失去意义
+BLOCKS_PER_STRATUM = 2
+
+# 注入提示词的画像说明；画像文本放在 <persona> 标签中，便于模型（以及模拟提供商）识别
+PERSONA_TEMPLATES = {
+    "en": "\n\nAnswer as this member of the audience: <persona>{description}</persona>",
+    "zh": "\n\n请以这位受众的身份作答：<persona>{description}</persona>"
+}
+
+
+@dataclass(frozen=True)
+class Persona:
+    """一类受众画像"""
+    name: str
+    description: str
+    weight: float = 1.0  # 在该平台受众中的占比（无需归一化）
+
+
+# 未单独配置的平台使用的画像
+DEFAULT_POPULATION = (
+    Persona("casual", "A casual user who scrolls quickly and rarely interacts beyond an occasional like.", 0.5),
+    Persona("engaged", "A regular who often likes and comments on posts that match their interests.", 0.3),
+    Persona("skeptic", "A critical reader who distrusts hype and engages mainly to disagree.", 0.1),
+    Persona("sharer", "A connector who shares content their friends or followers would find useful.", 0.1)
+)
+
+# 各平台的受众画像
+PERSONA_POPULATIONS: Dict[str, Tuple[Persona, ...]] = {
+    "Twitter": (
+        Persona("lurker", "A lurker who reads the timeline but rarely likes or replies.", 0.4),
+        Persona("news_junkie", "A news follower who quote-tweets and replies to timely takes.", 0.25),
+        Persona("fan", "A fan of the author's niche who likes and retweets almost anything on topic.", 0.2),
+        Persona("contrarian", "A contrarian who replies and quote-tweets mostly to argue.", 0.15)
+    ),
+    "Facebook": (
+        Persona("friend", "A friend or relative who likes posts out of goodwill.", 0.35),
+        Persona("group_member", "An active community group member who comments and asks questions.", 0.25),
+        Persona("scroller", "An older casual scroller who rarely interacts.", 0.25),
+        Persona("sharer", "A heavy sharer who reposts anything emotional or useful.", 0.15)
+    ),
+    "Instagram": (
+        Persona("scroller", "A fast scroller who double-taps attractive visuals and moves on.", 0.45),
+        Persona("follower", "A loyal follower who likes and leaves short comments.", 0.3),
+        Persona("creator", "A fellow creator who comments to network and shares to stories.", 0.15),
+        Persona("shopper", "A shopper looking for products who saves and shares useful posts.", 0.1)
+    ),
+    "LinkedIn": (
+        Persona("recruiter", "A recruiter skimming for talent who likes but rarely comments.", 0.2),
+        Persona("peer", "An industry peer who comments with their own experience.", 0.35),
+        Persona("job_seeker", "A job seeker who likes and shares career advice.", 0.25),
+        Persona("executive", "A busy executive who engages only with substantial insights.", 0.2)
+    ),
+    "TikTok": (
+        Persona("teen", "A teenager on the For You page who likes and comments on trends.", 0.4),
+        Persona("passive", "A passive viewer who watches to the end but rarely interacts.", 0.3),
+        Persona("duetter", "A creator who duets, stitches and shares content to react to it.", 0.15),
+        Persona("niche", "A niche-community member who engages heavily with on-topic videos.", 0.15)
+    )
+}
+
+
+def load_populations(path: str) -> Dict[str, Tuple[Persona, ...]]:
+    """
+    从JSON文件读取受众画像配置
+
+    文件格式为 {平台: [{"name": ..., "description": ..., "weight": ...}, ...]}，weight 可省略
+
+    Args:
+        path: JSON文件路径
+
+    Returns:
+        平台到受众画像的映射
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    populations = {}
+    for platform, personas in data.items():
+        population = tuple(Persona(name=item["name"], description=item["description"],
+                                   weight=float(item.get("weight", 1.0))) for item in personas)
+        if not population or any(persona.weight <= 0 for persona in population):
+            raise ValueError(f"平台 {platform} 的受众画像为空或权重不为正")
+        populations[platform] = population
+    return populations
+
+
+def get_population(platform: str,
+                   populations: Optional[Dict[str, Sequence[Persona]]] = None) -> Tuple[Persona, ...]:
+    """
+    平台的受众画像
+
+    Args:
+        platform: 发布平台
+        populations: 覆盖默认配置的画像映射
+
+    Returns:
+        受众画像；未配置的平台返回 DEFAULT_POPULATION
+    """
+    if populations and platform in populations:
+        return tuple(populations[platform])
+    return PERSONA_POPULATIONS.get(platform, DEFAULT_POPULATION)
+
+
+def stratified_strata(weights: Sequence[float], size: int, seed: int = 0) -> np.ndarray:
+    """
+    按权重分层分配画像编号
+
+    逐个分配时总是选择“应得份额 - 已分配数”最大的画像，因此任意前缀中各画像的数量与按权重的应得数量
+    相差不到1——提前停止或预算用完时已完成的用户仍然是分层的。种子决定初始份额，从而决定分配顺序
+
+    Args:
+        weights: 各画像的权重
+        size: 分配数量
+        seed: 随机种子
+
+    Returns:
+        形状 (size,) 的画像编号数组
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    weights = weights / weights.sum()
+    rng = np.random.default_rng(seed)
+    credit = rng.random(len(weights))
+    strata = np.empty(size, dtype=np.int16)
+    for position in range(size):
+        credit += weights
+        stratum = int(np.argmax(credit))
+        credit[stratum] -= 1.0
+        strata[position] = stratum
+    return strata
+
+
+@dataclass
+class PersonaAssignment:
+    """一次运行中每个模拟用户的画像（各版本共用）"""
+    population: Tuple[Persona, ...]
+    strata: np.ndarray   # 每个用户序号的画像编号
+    seed: int = 0
+    block_size: int = 1  # 同一画像连续分配的用户数（与每次调用覆盖的用户数一致）
+    language: str = "en"
+
+    @property
+    def weights(self) -> np.ndarray:
+        """归一化后的画像权重"""
+        weights = np.array([persona.weight for persona in self.population], dtype=np.float64)
+        return weights / weights.sum()
+
+    def persona(self, index: int) -> Persona:
+        """第 index 个用户的画像"""
+        return self.population[int(self.strata[index])]
+
+    def prompt(self, prompt: str, index: int) -> str:
+        """把第 index 个用户的画像注入提示词"""
+        return persona_prompt(prompt, self.persona(index), self.language)
+
+    def to_metadata(self) -> Dict[str, object]:
+        """写入运行元数据的画像信息（每块用户一个画像编号）"""
+        return {
+            "personas": [persona.name for persona in self.population],
+            "persona_weights": [float(weight) for weight in self.weights],
+            "persona_seed": self.seed,
+            "persona_block_size": self.block_size,
+            "persona_blocks": [int(stratum) for stratum in self.strata[::self.block_size]]
+        }
+
+
+def persona_prompt(prompt: str, persona: Persona, language: str = "en") -> str:
+    """
+    在提示词末尾注入受众画像
+
+    画像放在用户消息的末尾，不影响 system 消息中固定格式要求的前缀缓存
+
+    Args:
+        prompt: 内容提示词
+        persona: 受众画像
+        language: 提示词语言 ("en" / "zh")
+
+    Returns:
+        注入画像后的提示词
+    """
+    template = PERSONA_TEMPLATES.get(language, PERSONA_TEMPLATES["en"])
+    return prompt + template.format(description=persona.description)
+
+
+def persona_block_size(call_size: int, max_users: int, strata: int) -> int:
+    """
+    启用受众画像时每次调用实际覆盖的用户数
+
+    把调用块大小限制在约 max_users / (BLOCKS_PER_STRATUM × 画像数)，使每个画像都能分到若干块；
+    用户数足够多时不受影响
+
+    Args:
+        call_size: 未启用画像时每次调用覆盖的用户数
+        max_users: 每个版本的用户数
+        strata: 画像数
+
+    Returns:
+        调用块大小
+    """
+    return max(min(call_size, max_users // (BLOCKS_PER_STRATUM * max(strata, 1))), 1)
+
+
+def assign_personas(population: Sequence[Persona], max_users: int, block_size: int = 1, seed: int = 0,
+                    language: str = "en") -> PersonaAssignment:
+    """
+    为一次运行的所有用户分配画像
+
+    以 block_size 个用户为一块分层分配，使同一次LLM调用（多候选或批量提示词）覆盖的用户共享同一画像与提示词
+
+    Args:
+        population: 受众画像
+        max_users: 每个版本的用户数
+        block_size: 每块用户数
+        seed: 随机种子
+        language: 提示词语言
+
+    Returns:
+        画像分配
+    """
+    if not population:
+        raise ValueError("受众画像不能为空")
+    block_size = max(block_size, 1)
+    blocks = -(-max_users // block_size)
+    strata = np.repeat(stratified_strata([persona.weight for persona in population], blocks, seed),
+                       block_size)[:max_users]
+    return PersonaAssignment(population=tuple(population), strata=strata, seed=seed,
+                             block_size=block_size, language=language)
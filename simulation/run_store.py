@@ -0,0 +1,229 @@
+"""
+逐用户结果存储
+把每个模拟用户的结果（互动指标、调用耗时、提供者、解析状态）保存在小整数类型的NumPy结构化数组中，
+可导出为带运行元数据的Parquet文件（或可零拷贝内存映射的Arrow IPC文件），
+供事后计算方差、分布与指标间相关性，以及跨多次运行分析
+"""
+import io
+import os
+import json
+import glob
+import logging
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认互动指标
+ENGAGEMENT_KEYS = ("like", "comment", "share", "quote")
+
+# 互动指标列的类型（超出范围的值截断到最大值）
+METRIC_DTYPE = np.uint16
+
+# Parquet/Arrow 文件中保存运行元数据的键
+RUN_METADATA_KEY = b"viral_predictor.run"
+
+
+def result_dtype(metrics: Sequence[str] = ENGAGEMENT_KEYS) -> np.dtype:
+    """逐用户结果的结构化数组类型；版本、提供者、状态以类别编码存储"""
+    return np.dtype(
+        [("variant", np.uint8), ("user", np.uint32)]
+        + [(metric, METRIC_DTYPE) for metric in metrics]
+        + [("latency_ms", np.float32), ("provider", np.uint8), ("status", np.uint8)]
+    )
+
+
+class CategoryCodes:
+    """字符串到 uint8 编码的映射，按首次出现的顺序分配编码"""
+    def __init__(self, values: Iterable[str] = ()):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value: str) -> int:
+        """返回取值的编码，新取值分配新编码"""
+        code = self._codes.get(value)
+        if code is None:
+            if len(self.values) > np.iinfo(np.uint8).max:
+                raise ValueError(f"类别数超过 uint8 上限: {value}")
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+
+class RunStore:
+    """
+    一次运行的逐用户结果（列式、预分配、容量不足时倍增）
+    """
+    def __init__(self, capacity: int, variants: Sequence[Hashable] = ("A", "B"),
+                 metrics: Sequence[str] = ENGAGEMENT_KEYS, metadata: Optional[Dict[str, Any]] = None):
+        """
+        初始化存储
+
+        Args:
+            capacity: 预分配的行数（通常为 版本数 × 用户数）
+            variants: 版本标识
+            metrics: 互动指标名称
+            metadata: 运行元数据（模型、参数等），随文件一起导出
+        """
+        self.metrics = tuple(metrics)
+        self.metadata = dict(metadata or {})
+        self.rows = np.zeros(max(capacity, 1), dtype=result_dtype(self.metrics))
+        self.variants = CategoryCodes(str(variant) for variant in variants)
+        self.providers = CategoryCodes()
+        self.statuses = CategoryCodes()
+        self._categories = {"variant": self.variants, "provider": self.providers, "status": self.statuses}
+        self._size = 0
+        self._metric_max = np.iinfo(METRIC_DTYPE).max
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def records(self) -> np.ndarray:
+        """已写入的结果（结构化数组视图）"""
+        return self.rows[:self._size]
+
+    def add(self, result):
+        """
+        写入一个用户的结果
+
+        Args:
+            result: 调度器产出的 PredictionResult
+        """
+        if self._size == len(self.rows):
+            self.rows = np.resize(self.rows, 2 * len(self.rows))
+
+        row = self.rows[self._size]
+        row["variant"] = self.variants.code(str(result.variant))
+        row["user"] = result.index
+        engagement = result.engagement or {}
+        for metric in self.metrics:
+            row[metric] = min(engagement.get(metric, 0), self._metric_max)
+        row["latency_ms"] = np.nan if result.latency is None else result.latency * 1000
+        row["provider"] = self.providers.code(result.provider or "")
+        row["status"] = self.statuses.code(result.status)
+        self._size += 1
+
+    def decode(self, column: str) -> np.ndarray:
+        """把类别编码列（variant / provider / status）还原为字符串数组"""
+        return np.array(self._categories[column].values, dtype=object)[self.records[column]]
+
+    def to_arrow(self):
+        """
+        转换为 Arrow RecordBatch：数值列零拷贝，类别列为字典编码列，运行元数据写入schema
+
+        Returns:
+            pyarrow.RecordBatch
+        """
+        import pyarrow as pa
+
+        records = self.records
+        columns, names = [], []
+        for name in records.dtype.names:
+            values = np.ascontiguousarray(records[name])
+            if name in self._categories:
+                dictionary = pa.array(self._categories[name].values, pa.string())
+                columns.append(pa.DictionaryArray.from_arrays(pa.array(values), dictionary))
+            else:
+                columns.append(pa.array(values))
+            names.append(name)
+
+        metadata = {RUN_METADATA_KEY: json.dumps(self.metadata, ensure_ascii=False, default=str).encode("utf-8")}
+        return pa.RecordBatch.from_arrays(columns, names=names).replace_schema_metadata(metadata)
+
+    def write(self, path: str):
+        """
+        导出为运行文件：.parquet 为Parquet，.arrow/.feather 为可零拷贝内存映射的Arrow IPC文件
+
+        Args:
+            path: 文件路径
+        """
+        import pyarrow as pa
+
+        batch = self.to_arrow()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith((".arrow", ".feather")):
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, batch.schema) as writer:
+                writer.write_batch(batch)
+        else:
+            import pyarrow.parquet as pq
+            pq.write_table(pa.Table.from_batches([batch]), path)
+
+    def to_parquet_bytes(self) -> bytes:
+        """导出为内存中的Parquet文件（例如供界面下载）"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_batches([self.to_arrow()]), buffer)
+        return buffer.getvalue()
+
+
+def read_run(path: str, columns: Optional[List[str]] = None):
+    """
+    以内存映射方式读取一个运行文件
+
+    Args:
+        path: .parquet 或 .arrow/.feather 文件
+        columns: 只读取的列
+
+    Returns:
+        pyarrow.Table（类别列保持字典编码）
+    """
+    import pyarrow as pa
+
+    if path.endswith((".arrow", ".feather")):
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        return table.select(columns) if columns else table
+
+    import pyarrow.parquet as pq
+    return pq.read_table(path, columns=columns, memory_map=True)
+
+
+def run_metadata(table) -> Dict[str, Any]:
+    """读取运行文件中保存的运行元数据"""
+    raw = (table.schema.metadata or {}).get(RUN_METADATA_KEY)
+    return json.loads(raw) if raw else {}
+
+
+def read_runs(paths: Union[str, Sequence[str]], columns: Optional[List[str]] = None):
+    """
+    读取多个运行文件并纵向合并，每行附带 run 列（文件名）
+
+    Args:
+        paths: 运行文件目录，或文件路径列表
+        columns: 只读取的列
+
+    Returns:
+        pyarrow.Table
+    """
+    import pyarrow as pa
+
+    if isinstance(paths, str):
+        paths = sorted(
+            path for pattern in ("*.parquet", "*.arrow", "*.feather")
+            for path in glob.glob(os.path.join(paths, pattern))
+        )
+
+    tables = []
+    for path in paths:
+        table = read_run(path, columns=columns).replace_schema_metadata(None)
+        # Parquet读回的字典列索引为int32，统一类型后才能与Arrow文件合并
+        table = table.cast(pa.schema([
+            pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type)) if pa.types.is_dictionary(f.type) else f
+            for f in table.schema
+        ]))
+        run = os.path.splitext(os.path.basename(path))[0]
+        tables.append(table.append_column("run", pa.DictionaryArray.from_arrays(
+            pa.array(np.zeros(table.num_rows, dtype=np.int32)), pa.array([run])
+        )))
+    if not tables:
+        raise FileNotFoundError(f"没有找到运行文件: {paths}")
+    return pa.concat_tables(tables)
@@ -0,0 +1,204 @@
+"""
+并发调度器
+以滑动窗口方式调度 predict_engagement 调用：始终保持固定数量的在途请求，
+任意一个请求完成后立即发起下一个，结果按完成顺序流式返回
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.rate_limiter import LLMRequestError
+from llms.response_parser import PARSE_OK, ResponseParseError
+from llms.call_context import served_by
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认的最大在途请求数
+DEFAULT_MAX_CONCURRENCY = 10
+
+# API调用失败（重试后）的结果状态；解析失败或超出预算时状态为异常的 reason
+STATUS_REQUEST_ERROR = "request_error"
+
+
+@dataclass
+class PredictionJob:
+    """一次LLM调用对应的预测任务，覆盖 [index, index + size) 范围内的模拟用户"""
+    variant: Hashable  # 内容版本标识，如 "A" / "B"
+    index: int         # 该版本下第一个用户的序号（从0开始）
+    prompt: str
+    size: int = 1      # 本次调用模拟的用户数
+    choices: int = 1   # 请求的独立候选数（API 的 n 参数）；>1 时每个候选对应一个用户，否则 size>1 为批量提示词
+
+
+@dataclass
+class PredictionResult:
+    """单个模拟用户的预测结果；请求失败时 engagement 为None，error 为失败原因"""
+    variant: Hashable
+    index: int
+    engagement: Optional[Dict[str, Any]]
+    error: Optional[str] = None
+    latency: Optional[float] = None  # 所在LLM调用的耗时（秒），批量调用的用户共享同一耗时
+    provider: Optional[str] = None   # 提供结果的 "provider/model"
+    status: str = PARSE_OK           # 解析状态，失败时为失败原因
+
+
+def interleave_jobs(prompts: Dict[Hashable, str], max_users: int,
+                    users_per_call: int = 1, choices_per_call: int = 1,
+                    personalize: Optional[Callable[[str, int], str]] = None) -> Iterator[PredictionJob]:
+    """
+    按用户序号交错生成各版本的预测任务，使各版本的进度大致同步
+
+    Args:
+        prompts: 版本标识到提示词的映射
+        max_users: 每个版本模拟的用户数
+        users_per_call: 批量提示词模式下每次LLM调用模拟的用户数
+        choices_per_call: 单用户提示词模式下每次调用请求的独立候选数（与批量提示词模式互斥）
+        personalize: 按任务第一个用户的序号改写提示词（例如注入受众画像）；各版本同一序号使用同一改写
+
+    Returns:
+        预测任务迭代器
+    """
+    if users_per_call < 1 or choices_per_call < 1:
+        raise ValueError(f"每次调用的用户数与候选数必须大于0: {users_per_call}, {choices_per_call}")
+    if users_per_call > 1 and choices_per_call > 1:
+        raise ValueError("批量提示词与多候选采样不能同时使用")
+
+    call_size = max(users_per_call, choices_per_call)
+    for index in range(0, max_users, call_size):
+        size = min(call_size, max_users - index)
+        for variant, prompt in prompts.items():
+            if personalize is not None:
+                prompt = personalize(prompt, index)
+            yield PredictionJob(variant=variant, index=index, prompt=prompt, size=size,
+                                choices=size if choices_per_call > 1 else 1)
+
+
+class PredictionScheduler:
+    """
+    基于 asyncio.Semaphore 的滑动窗口调度器
+
+    同一个调度器实例的所有 run() 调用共享同一个信号量，
+    因此多个版本（或多次运行）的请求共用一个并发上限
+    """
+    def __init__(self, llm_client, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        """
+        初始化调度器
+
+        Args:
+            llm_client: 提供 predict_engagement / predict_engagement_samples / predict_engagement_batch 协程方法的LLM客户端
+            max_concurrency: 最大在途请求数
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"最大并发数必须大于0: {max_concurrency}")
+
+        self.llm_client = llm_client
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _execute(self, job: PredictionJob) -> List[PredictionResult]:
+        """执行单个预测任务，返回任务覆盖的每个用户的结果"""
+        started_at = time.perf_counter()
+        try:
+            if job.size == 1:
+                engagements = [await self.llm_client.predict_engagement(job.prompt, sample_index=job.index)]
+            elif job.choices > 1:
+                engagements = await self.llm_client.predict_engagement_samples(job.prompt, job.choices, sample_index=job.index)
+            else:
+                engagements = await self.llm_client.predict_engagement_batch(job.prompt, job.size, sample_index=job.index)
+        except (LLMRequestError, ResponseParseError) as e:
+            # 请求失败或响应无法解析的用户单独标记，由调用方排除在统计之外
+            logger.error(f"版本 {job.variant} 用户 {job.index} 起的 {job.size} 个预测失败: {str(e)}")
+            latency = time.perf_counter() - started_at
+            status = getattr(e, "reason", None) or STATUS_REQUEST_ERROR
+            provider = getattr(e, "provider", None) or getattr(self.llm_client, "provider", None)
+            return [
+                PredictionResult(variant=job.variant, index=job.index + offset, engagement=None, error=str(e),
+                                 latency=latency, provider=provider, status=status)
+                for offset in range(job.size)
+            ]
+
+        latency = time.perf_counter() - started_at
+        provider = served_by.get() or getattr(self.llm_client, "provider", None)
+        results = []
+        for offset, engagement in enumerate(engagements):
+            if isinstance(engagement, Exception):
+                # 多候选调用中单独失败的用户
+                results.append(PredictionResult(
+                    variant=job.variant, index=job.index + offset, engagement=None, error=str(engagement),
+                    latency=latency, provider=provider,
+                    status=getattr(engagement, "reason", None) or STATUS_REQUEST_ERROR
+                ))
+                continue
+            results.append(PredictionResult(variant=job.variant, index=job.index + offset, engagement=engagement,
+                                            latency=latency, provider=provider))
+        return results
+
+    async def run(self, jobs: Iterable[PredictionJob]) -> AsyncIterator[PredictionResult]:
+        """
+        调度执行预测任务，按完成顺序逐个返回每个模拟用户的结果
+
+        调用方提前退出迭代时（例如提前停止），应通过 contextlib.aclosing
+        关闭生成器，以便立即取消尚未完成的请求
+
+        Args:
+            jobs: 预测任务（可以是惰性迭代器，任务只在有空闲并发槽位时才会被取出）
+
+        Returns:
+            预测结果的异步迭代器
+        """
+        done_queue: asyncio.Queue = asyncio.Queue()
+        pending = set()
+
+        def _on_done(task: asyncio.Task):
+            pending.discard(task)
+            self._semaphore.release()
+            done_queue.put_nowait(task)
+
+        async def _submit():
+            iterator = iter(jobs)
+            try:
+                while True:
+                    # 先占用并发槽位再取任务，使任务迭代器只在真正发起调用时才前进
+                    await self._semaphore.acquire()
+                    try:
+                        job = next(iterator, None)
+                    except BaseException:
+                        # 任务迭代器出错（例如输入文件中的无效行）时归还槽位，避免共享的信号量永久少一个
+                        self._semaphore.release()
+                        raise
+                    if job is None:
+                        self._semaphore.release()
+                        break
+                    task = asyncio.create_task(self._execute(job))
+                    pending.add(task)
+                    task.add_done_callback(_on_done)
+            finally:
+                # 哨兵：不会再有新任务提交
+                done_queue.put_nowait(None)
+
+        submitter = asyncio.create_task(_submit())
+        all_submitted = False
+        try:
+            while not (all_submitted and not pending and done_queue.empty()):
+                task = await done_queue.get()
+                if task is None:
+                    all_submitted = True
+                    continue
+                if task.cancelled():
+                    continue
+                for result in task.result():
+                    yield result
+            # 提交协程中的异常（例如任务迭代器出错）需要向上抛出
+            await submitter
+        finally:
+            submitter.cancel()
+            for task in list(pending):
+                task.cancel()
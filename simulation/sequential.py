@@ -0,0 +1,137 @@
+"""
+A/B序贯检验
+随着结果到达反复检验A/B差异，一旦越过停止边界即可提前结束模拟。
+采用 Lan-DeMets O'Brien-Fleming 型 alpha 消耗函数，每次检验只使用本次新增的 alpha，
+因此无论中途检验多少次，总体第一类错误率都不超过设定的 alpha
+"""
+import logging
+import math
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Optional
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+_NORMAL = NormalDist()
+
+
+@dataclass
+class SequentialDecision:
+    """序贯检验的停止决定"""
+    winner: str          # "A" 或 "B"
+    users: int           # 停止时每个版本的用户数
+    z_stat: float
+    p_value: float
+    alpha_spent: float   # 截至停止时累计消耗的alpha
+
+
+def obrien_fleming_spending(information: float, alpha: float) -> float:
+    """
+    Lan-DeMets O'Brien-Fleming 型 alpha 消耗函数（双侧）
+
+    Args:
+        information: 信息比例（已完成用户数 / 最大用户数），取值 (0, 1]
+        alpha: 总体显著性水平
+
+    Returns:
+        截至该信息比例允许消耗的累计alpha
+    """
+    if information <= 0:
+        return 0.0
+    information = min(information, 1.0)
+    z = _NORMAL.inv_cdf(1 - alpha / 2)
+    return 2 * (1 - _NORMAL.cdf(z / math.sqrt(information)))
+
+
+class SequentialABTest:
+    """
+    基于每用户总互动数的A/B序贯检验（Welch z检验）
+
+    每收到一对A/B用户结果调用一次 add_pair()，每满 look_every 对用户检验一次
+    """
+    def __init__(self, max_users: int, alpha: float = 0.05, look_every: int = 5, min_users: int = 10):
+        """
+        初始化序贯检验
+
+        Args:
+            max_users: 每个版本的最大用户数
+            alpha: 总体显著性水平
+            look_every: 每隔多少对用户检验一次
+            min_users: 开始检验前至少需要的用户数（至少为2，样本方差才有定义）
+        """
+        if max_users < 1:
+            raise ValueError(f"最大用户数必须大于0: {max_users}")
+        if not 0 < alpha < 1:
+            raise ValueError(f"显著性水平必须在0和1之间: {alpha}")
+
+        self.max_users = max_users
+        self.alpha = alpha
+        self.look_every = max(1, look_every)
+        self.min_users = max(min_users, 2)
+
+        self.users = 0
+        self.alpha_spent = 0.0
+        self.decision: Optional[SequentialDecision] = None
+        self._sum = {"A": 0.0, "B": 0.0}
+        self._sum_sq = {"A": 0.0, "B": 0.0}
+
+    def add_pair(self, value_a: float, value_b: float) -> Optional[SequentialDecision]:
+        """
+        添加一对用户结果，必要时进行一次检验
+
+        Args:
+            value_a: 版本A该用户的总互动数
+            value_b: 版本B该用户的总互动数
+
+        Returns:
+            越过停止边界时返回停止决定，否则返回None
+        """
+        if self.decision is not None:
+            return self.decision
+
+        self.users += 1
+        for variant, value in (("A", value_a), ("B", value_b)):
+            self._sum[variant] += value
+            self._sum_sq[variant] += value * value
+
+        if self.users < self.min_users:
+            return None
+        if self.users % self.look_every != 0 and self.users != self.max_users:
+            return None
+
+        return self._look()
+
+    def _variance(self, variant: str) -> float:
+        """样本方差"""
+        n = self.users
+        mean = self._sum[variant] / n
+        return max(self._sum_sq[variant] / n - mean * mean, 0.0) * n / (n - 1)
+
+    def _look(self) -> Optional[SequentialDecision]:
+        """在当前信息比例下进行一次检验"""
+        cumulative_alpha = obrien_fleming_spending(self.users / self.max_users, self.alpha)
+        look_alpha = cumulative_alpha - self.alpha_spent
+        self.alpha_spent = cumulative_alpha
+
+        n = self.users
+        diff = (self._sum["A"] - self._sum["B"]) / n
+        std_err = math.sqrt((self._variance("A") + self._variance("B")) / n)
+        if std_err == 0:
+            # 两个版本的结果完全没有波动，无法检验
+            return None
+
+        z_stat = diff / std_err
+        p_value = 2 * (1 - _NORMAL.cdf(abs(z_stat)))
+        logger.debug(f"序贯检验: n={n}, z={z_stat:.3f}, p={p_value:.4g}, 本次alpha={look_alpha:.4g}")
+
+        if p_value < look_alpha:
+            self.decision = SequentialDecision(
+                winner="A" if z_stat > 0 else "B",
+                users=n,
+                z_stat=z_stat,
+                p_value=p_value,
+                alpha_spent=cumulative_alpha
+            )
+            return self.decision
+        return None
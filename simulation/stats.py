@@ -0,0 +1,457 @@
+"""
+统计检验
+A/B两个版本互动指标的向量化显著性计算：输入两个版本的逐用户指标数组，一次计算所有指标（以及可选的
+多组比较）的两比例z检验、Welch t检验、自助法置信区间，并做多重比较校正。
+两个版本在同一批受众画像上配对模拟时，改用基于逐用户差值的（分层）配对t检验
+"""
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认显著性水平
+DEFAULT_ALPHA = 0.05
+# 默认自助法重抽样次数
+DEFAULT_BOOTSTRAP_SAMPLES = 2000
+# 支持的多重比较校正方法
+CORRECTION_METHODS = ("holm", "bonferroni", "fdr_bh", "none")
+
+
+def with_total(values: np.ndarray) -> np.ndarray:
+    """在最后一维追加各指标之和（总互动数）一列"""
+    values = np.asarray(values)
+    return np.concatenate([values, values.sum(axis=-1, keepdims=True)], axis=-1)
+
+
+def adjust_pvalues(p_values: np.ndarray, method: str = "holm", axis: Optional[int] = -1) -> np.ndarray:
+    """
+    多重比较校正（沿指定维度的每一组独立校正）
+
+    Args:
+        p_values: 原始p值数组；非有限值按1处理
+        method: "holm"、"bonferroni"、"fdr_bh"（Benjamini-Hochberg）或 "none"
+        axis: 同一族检验所在的维度；为None时把整个数组视为一族
+
+    Returns:
+        与输入形状相同的校正后p值
+    """
+    if method not in CORRECTION_METHODS:
+        raise ValueError(f"不支持的校正方法: {method}，可选 {CORRECTION_METHODS}")
+
+    p_values = np.asarray(p_values, dtype=np.float64)
+    if axis is None:
+        return adjust_pvalues(p_values.reshape(-1), method=method, axis=-1).reshape(p_values.shape)
+
+    p = np.moveaxis(np.where(np.isfinite(p_values), p_values, 1.0), axis, -1)
+    m = p.shape[-1]
+    if method == "none" or m == 0:
+        adjusted = p
+    elif method == "bonferroni":
+        adjusted = np.minimum(p * m, 1.0)
+    else:
+        order = np.argsort(p, axis=-1)
+        ranked = np.take_along_axis(p, order, axis=-1)
+        if method == "holm":
+            ranked = np.maximum.accumulate(ranked * (m - np.arange(m)), axis=-1)
+        else:
+            ranked = ranked * m / np.arange(1, m + 1)
+            ranked = np.flip(np.minimum.accumulate(np.flip(ranked, axis=-1), axis=-1), axis=-1)
+        adjusted = np.empty_like(ranked)
+        np.put_along_axis(adjusted, order, np.minimum(ranked, 1.0), axis=-1)
+    return np.moveaxis(adjusted, -1, axis)
+
+
+def two_proportion_ztest(successes_a: np.ndarray, successes_b: np.ndarray,
+                         nobs_a: int, nobs_b: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    向量化的合并方差两比例z检验（双侧）
+
+    方差为0时：两个比例相同则p=1，否则p=0
+
+    Returns:
+        (z统计量, p值)
+    """
+    successes_a = np.asarray(successes_a, dtype=np.float64)
+    successes_b = np.asarray(successes_b, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate_a = successes_a / nobs_a
+        rate_b = successes_b / nobs_b
+        pooled = (successes_a + successes_b) / (nobs_a + nobs_b)
+        se = np.sqrt(pooled * (1 - pooled) * (1 / nobs_a + 1 / nobs_b))
+        diff = rate_a - rate_b
+        z = np.where(se > 0, diff / se, np.where(diff == 0, 0.0, np.sign(diff) * np.inf))
+    # scipy 导入较慢，只在真正计算时才导入（界面冷启动与每次重新运行都不需要它）
+    from scipy import special
+
+    p = 2 * special.ndtr(-np.abs(z))
+    return z, np.where(np.isfinite(diff), p, np.nan)
+
+
+def welch_ttest(mean_a: np.ndarray, mean_b: np.ndarray, var_a: np.ndarray, var_b: np.ndarray,
+                nobs_a: int, nobs_b: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    向量化的Welch t检验（双侧，不假设方差相等），适用于取值为任意非负整数的计数指标
+
+    方差为0时：均值相同则p=1，否则p=0；样本不足（方差无定义）时p为NaN
+
+    Returns:
+        (t统计量, p值)
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se_a = var_a / nobs_a
+        se_b = var_b / nobs_b
+        se = np.sqrt(se_a + se_b)
+        df = (se_a + se_b) ** 2 / (se_a ** 2 / (nobs_a - 1) + se_b ** 2 / (nobs_b - 1))
+        diff = mean_a - mean_b
+        degenerate = se == 0
+        t = np.where(degenerate, np.where(diff == 0, 0.0, np.sign(diff) * np.inf), diff / se)
+    from scipy import special
+
+    p = np.where(degenerate, np.where(diff == 0, 1.0, 0.0),
+                 2 * special.stdtr(np.where(degenerate, 1, df), -np.abs(t)))
+    return t, p
+
+
+def bootstrap_mean_diff_ci(values_a: np.ndarray, values_b: np.ndarray, alpha: float = DEFAULT_ALPHA,
+                           n_samples: int = DEFAULT_BOOTSTRAP_SAMPLES,
+                           rng: Optional[np.random.Generator] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    人均差值 (A - B) 的自助法百分位置信区间
+
+    重抽样用多项分布权重矩阵表示，所有指标与所有比较共享同一组权重，一次矩阵乘法完成，
+    不需要物化 (重抽样次数 × 用户数) 的数据副本
+
+    Args:
+        values_a: 版本A的逐用户数组，形状 (..., 用户数, 指标数)
+        values_b: 版本B的逐用户数组
+        alpha: 1 - 置信水平
+        n_samples: 重抽样次数
+        rng: 随机数生成器
+
+    Returns:
+        (下界, 上界)，形状 (..., 指标数)
+    """
+    rng = rng or np.random.default_rng()
+    n_a, n_b = values_a.shape[-2], values_b.shape[-2]
+    weights_a = rng.multinomial(n_a, np.full(n_a, 1 / n_a), size=n_samples) / n_a
+    weights_b = rng.multinomial(n_b, np.full(n_b, 1 / n_b), size=n_samples) / n_b
+    # (..., 重抽样次数, 指标数)
+    diffs = np.einsum("...nk,sn->...sk", values_a, weights_a) - np.einsum("...nk,sn->...sk", values_b, weights_b)
+    low, high = np.quantile(diffs, [alpha / 2, 1 - alpha / 2], axis=-2)
+    return low, high
+
+
+def _strata_plan(strata: Optional[np.ndarray], weights: Optional[np.ndarray],
+                 n: int) -> Optional[Tuple[List[np.ndarray], np.ndarray]]:
+    """
+    分层估计所用的各层成员与权重
+
+    只有出现的每一层都至少有2个用户（层内方差有定义）且不止一层时才分层，否则返回None，由调用方退回普通估计
+
+    Returns:
+        (各层的用户位置, 按出现的层重新归一化的权重) 或 None
+    """
+    if strata is None or weights is None or n == 0:
+        return None
+    strata = np.asarray(strata)[:n]
+    layers = [np.flatnonzero(strata == stratum) for stratum in np.unique(strata)]
+    if len(layers) < 2 or any(len(members) < 2 for members in layers):
+        return None
+    layer_weights = np.asarray(weights, dtype=np.float64)[np.unique(strata)]
+    return layers, layer_weights / layer_weights.sum()
+
+
+def stratified_mean(values: np.ndarray, strata: Optional[np.ndarray] = None,
+                    weights: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    逐用户数组沿用户维度的均值及均值的方差
+
+    给出分层与各层权重时使用分层估计：均值为各层均值按权重加权，方差为 Σ w_h² s_h² / n_h，
+    只包含层内方差——层间差异（不同画像的互动水平）不再计入噪声
+
+    Args:
+        values: 形状 (..., 用户数, 指标数)
+        strata: 每个用户的层编号，形状 (用户数,)
+        weights: 各层在总体中的权重，按层编号索引
+
+    Returns:
+        (均值, 均值的方差, 自由度)
+    """
+    n = values.shape[-2]
+    plan = _strata_plan(strata, weights, n)
+    if plan is None:
+        mean = values.mean(axis=-2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = values.var(axis=-2, ddof=1) / n if n > 1 else np.full_like(mean, np.nan)
+        return mean, variance, n - 1
+
+    layers, layer_weights = plan
+    mean = 0.0
+    variance = 0.0
+    for members, weight in zip(layers, layer_weights):
+        layer = values[..., members, :]
+        mean = mean + weight * layer.mean(axis=-2)
+        variance = variance + weight ** 2 * layer.var(axis=-2, ddof=1) / len(members)
+    return mean, variance, n - len(layers)
+
+
+def paired_ttest(mean_diff: np.ndarray, variance: np.ndarray, df: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    向量化的配对t检验（双侧）
+
+    方差为0时：差值均值为0则p=1，否则p=0；自由度不足时p为NaN
+
+    Args:
+        mean_diff: 逐用户差值的均值
+        variance: 差值均值的方差
+        df: 自由度
+
+    Returns:
+        (t统计量, p值)
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se = np.sqrt(variance)
+        degenerate = se == 0
+        t = np.where(degenerate, np.where(mean_diff == 0, 0.0, np.sign(mean_diff) * np.inf), mean_diff / se)
+    if df < 1:
+        return t, np.full_like(t, np.nan)
+    from scipy import special
+
+    p = np.where(degenerate, np.where(mean_diff == 0, 1.0, 0.0), 2 * special.stdtr(df, -np.abs(t)))
+    return t, p
+
+
+def bootstrap_paired_diff_ci(diffs: np.ndarray, strata: Optional[np.ndarray] = None,
+                             weights: Optional[np.ndarray] = None, alpha: float = DEFAULT_ALPHA,
+                             n_samples: int = DEFAULT_BOOTSTRAP_SAMPLES,
+                             rng: Optional[np.random.Generator] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    配对差值均值的自助法百分位置信区间
+
+    整对重抽样（同一用户的A、B结果一起抽中）；分层时在每层内独立重抽样并按层权重加权
+
+    Args:
+        diffs: 逐用户差值 (A - B)，形状 (..., 用户数, 指标数)
+        strata: 每个用户的层编号
+        weights: 各层在总体中的权重
+        alpha: 1 - 置信水平
+        n_samples: 重抽样次数
+        rng: 随机数生成器
+
+    Returns:
+        (下界, 上界)，形状 (..., 指标数)
+    """
+    rng = rng or np.random.default_rng()
+    n = diffs.shape[-2]
+    plan = _strata_plan(strata, weights, n)
+    if plan is None:
+        resample_weights = rng.multinomial(n, np.full(n, 1 / n), size=n_samples) / n
+    else:
+        resample_weights = np.zeros((n_samples, n))
+        for members, weight in zip(*plan):
+            size = len(members)
+            resample_weights[:, members] = rng.multinomial(size, np.full(size, 1 / size), size=n_samples) * weight / size
+    means = np.einsum("...nk,sn->...sk", diffs, resample_weights)
+    low, high = np.quantile(means, [alpha / 2, 1 - alpha / 2], axis=-2)
+    return low, high
+
+
+@dataclass
+class ComparisonStats:
+    """
+    一次（或一批）A/B比较所有指标的检验结果
+
+    所有数组的形状均为 (..., 指标数)；前导维度对应批量比较
+    """
+    metrics: Tuple[str, ...]
+    users_a: int
+    users_b: int
+    sum_a: np.ndarray
+    sum_b: np.ndarray
+    mean_a: np.ndarray
+    mean_b: np.ndarray
+    ci_low: np.ndarray
+    ci_high: np.ndarray
+    binary: np.ndarray
+    statistic: np.ndarray
+    p_value: np.ndarray
+    p_adjusted: np.ndarray
+    alpha: float
+    paired: bool = False  # 是否为配对检验（两个版本的第 i 个用户使用同一受众画像）
+
+    @property
+    def diff(self) -> np.ndarray:
+        """人均差值 (A - B)"""
+        return self.mean_a - self.mean_b
+
+    @property
+    def winner(self) -> np.ndarray:
+        """均值较高的版本（"A"/"B"），没有差异时为 "-" """
+        diff = self.diff
+        return np.where(diff > 0, "A", np.where(diff < 0, "B", "-"))
+
+    @property
+    def confidence(self) -> np.ndarray:
+        """置信度百分比：(1 - 校正后p值) × 100，没有差异时为0"""
+        return np.where(self.winner == "-", 0.0, (1 - self.p_adjusted) * 100)
+
+    @property
+    def significant(self) -> np.ndarray:
+        """校正后是否显著"""
+        return (self.p_adjusted < self.alpha) & (self.winner != "-")
+
+    def metric(self, name: str) -> Dict[str, object]:
+        """单次比较中某个指标的结果（标量字典）"""
+        index = self.metrics.index(name)
+        return {
+            "a": int(self.sum_a[..., index]),
+            "b": int(self.sum_b[..., index]),
+            "winner": str(self.winner[..., index]),
+            "confidence": float(self.confidence[..., index]),
+            "p_value": float(self.p_adjusted[..., index]),
+            "diff": float(self.diff[..., index]),
+            "ci_low": float(self.ci_low[..., index]),
+            "ci_high": float(self.ci_high[..., index]),
+            "test": "paired" if self.paired else ("z" if self.binary[..., index] else "welch")
+        }
+
+
+def _empty_comparison(metrics: Sequence[str], n_a: int, n_b: int, sum_a: np.ndarray, sum_b: np.ndarray,
+                      result_shape: Tuple[int, ...], alpha: float, paired: bool = False) -> ComparisonStats:
+    """没有可比较用户时的结果：差值为0、p值为1"""
+    empty = np.full(result_shape, np.nan)
+    return ComparisonStats(
+        metrics=tuple(metrics), users_a=n_a, users_b=n_b,
+        sum_a=np.broadcast_to(sum_a, result_shape), sum_b=np.broadcast_to(sum_b, result_shape),
+        mean_a=np.zeros(result_shape), mean_b=np.zeros(result_shape),
+        ci_low=empty, ci_high=empty, binary=np.zeros(result_shape, dtype=bool),
+        statistic=empty, p_value=np.ones(result_shape), p_adjusted=np.ones(result_shape), alpha=alpha,
+        paired=paired
+    )
+
+
+def compare_variants(values_a: np.ndarray, values_b: np.ndarray, metrics: Sequence[str],
+                     alpha: float = DEFAULT_ALPHA, correction: str = "holm",
+                     n_bootstrap: int = DEFAULT_BOOTSTRAP_SAMPLES,
+                     rng: Optional[np.random.Generator] = None) -> ComparisonStats:
+    """
+    一次性比较两个版本的所有指标
+
+    只取0/1的指标使用两比例z检验，其余计数指标使用Welch t检验；
+    同一次比较内的各指标作为一族做多重比较校正
+
+    Args:
+        values_a: 版本A的逐用户指标，形状 (..., 用户数, 指标数)；前导维度可用于批量比较
+        values_b: 版本B的逐用户指标，前导维度与指标数需与 values_a 一致
+        metrics: 指标名称
+        alpha: 显著性水平（同时决定置信区间水平）
+        correction: 多重比较校正方法，见 CORRECTION_METHODS
+        n_bootstrap: 自助法重抽样次数；为0时不计算置信区间
+        rng: 随机数生成器
+
+    Returns:
+        检验结果
+    """
+    values_a = np.asarray(values_a, dtype=np.float64)
+    values_b = np.asarray(values_b, dtype=np.float64)
+    if values_a.shape[-1] != len(metrics) or values_b.shape[-1] != len(metrics):
+        raise ValueError(f"指标数不一致: {values_a.shape[-1]}, {values_b.shape[-1]}, {len(metrics)}")
+
+    n_a, n_b = values_a.shape[-2], values_b.shape[-2]
+    result_shape = np.broadcast_shapes(values_a.shape[:-2], values_b.shape[:-2]) + (len(metrics),)
+    sum_a = values_a.sum(axis=-2)
+    sum_b = values_b.sum(axis=-2)
+
+    if n_a == 0 or n_b == 0:
+        return _empty_comparison(metrics, n_a, n_b, sum_a, sum_b, result_shape, alpha)
+
+    mean_a = sum_a / n_a
+    mean_b = sum_b / n_b
+    binary = ((values_a <= 1).all(axis=-2) & (values_b <= 1).all(axis=-2))
+
+    z, p_z = two_proportion_ztest(sum_a, sum_b, n_a, n_b)
+    with np.errstate(invalid="ignore"):
+        var_a = values_a.var(axis=-2, ddof=1) if n_a > 1 else np.full_like(mean_a, np.nan)
+        var_b = values_b.var(axis=-2, ddof=1) if n_b > 1 else np.full_like(mean_b, np.nan)
+    t, p_t = welch_ttest(mean_a, mean_b, var_a, var_b, n_a, n_b)
+
+    statistic = np.where(binary, z, t)
+    p_value = np.where(binary, p_z, p_t)
+    p_adjusted = adjust_pvalues(p_value, method=correction, axis=-1)
+
+    if n_bootstrap > 0:
+        ci_low, ci_high = bootstrap_mean_diff_ci(values_a, values_b, alpha=alpha, n_samples=n_bootstrap, rng=rng)
+    else:
+        ci_low = ci_high = np.full(result_shape, np.nan)
+
+    return ComparisonStats(
+        metrics=tuple(metrics), users_a=n_a, users_b=n_b,
+        sum_a=sum_a, sum_b=sum_b, mean_a=mean_a, mean_b=mean_b,
+        ci_low=ci_low, ci_high=ci_high, binary=binary,
+        statistic=statistic, p_value=p_value, p_adjusted=p_adjusted, alpha=alpha
+    )
+
+
+def compare_paired(values_a: np.ndarray, values_b: np.ndarray, metrics: Sequence[str],
+                   strata: Optional[np.ndarray] = None, weights: Optional[np.ndarray] = None,
+                   alpha: float = DEFAULT_ALPHA, correction: str = "holm",
+                   n_bootstrap: int = DEFAULT_BOOTSTRAP_SAMPLES,
+                   rng: Optional[np.random.Generator] = None) -> ComparisonStats:
+    """
+    配对比较两个版本的所有指标
+
+    两个版本的第 i 行是同一模拟用户（同一受众画像）的结果：对逐用户差值 (A - B) 做配对t检验，
+    画像之间的互动水平差异在差值中抵消；给出分层与层权重时进一步使用分层估计
+
+    Args:
+        values_a: 版本A的逐用户指标，形状 (..., 用户数, 指标数)
+        values_b: 版本B的逐用户指标，形状与 values_a 相同
+        metrics: 指标名称
+        strata: 每个用户的层编号（受众画像），形状 (用户数,)
+        weights: 各层在总体中的权重，按层编号索引
+        alpha: 显著性水平（同时决定置信区间水平）
+        correction: 多重比较校正方法，见 CORRECTION_METHODS
+        n_bootstrap: 自助法重抽样次数；为0时不计算置信区间
+        rng: 随机数生成器
+
+    Returns:
+        检验结果
+    """
+    values_a = np.asarray(values_a, dtype=np.float64)
+    values_b = np.asarray(values_b, dtype=np.float64)
+    if values_a.shape[-1] != len(metrics) or values_b.shape[-1] != len(metrics):
+        raise ValueError(f"指标数不一致: {values_a.shape[-1]}, {values_b.shape[-1]}, {len(metrics)}")
+    if values_a.shape[-2] != values_b.shape[-2]:
+        raise ValueError(f"配对比较的用户数不一致: {values_a.shape[-2]}, {values_b.shape[-2]}")
+
+    n = values_a.shape[-2]
+    result_shape = np.broadcast_shapes(values_a.shape[:-2], values_b.shape[:-2]) + (len(metrics),)
+    sum_a = values_a.sum(axis=-2)
+    sum_b = values_b.sum(axis=-2)
+    if n == 0:
+        return _empty_comparison(metrics, n, n, sum_a, sum_b, result_shape, alpha, paired=True)
+
+    diffs = values_a - values_b
+    mean_a, _, _ = stratified_mean(values_a, strata, weights)
+    mean_b, _, _ = stratified_mean(values_b, strata, weights)
+    mean_diff, variance, df = stratified_mean(diffs, strata, weights)
+    binary = ((values_a <= 1).all(axis=-2) & (values_b <= 1).all(axis=-2))
+
+    statistic, p_value = paired_ttest(mean_diff, variance, df)
+    p_adjusted = adjust_pvalues(p_value, method=correction, axis=-1)
+
+    if n_bootstrap > 0:
+        ci_low, ci_high = bootstrap_paired_diff_ci(diffs, strata, weights, alpha=alpha, n_samples=n_bootstrap, rng=rng)
+    else:
+        ci_low = ci_high = np.full(result_shape, np.nan)
+
+    return ComparisonStats(
+        metrics=tuple(metrics), users_a=n, users_b=n,
+        sum_a=sum_a, sum_b=sum_b, mean_a=mean_a, mean_b=mean_b,
+        ci_low=ci_low, ci_high=ci_high, binary=binary,
+        statistic=statistic, p_value=p_value, p_adjusted=p_adjusted, alpha=alpha, paired=True
+    )
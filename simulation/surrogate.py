@@ -0,0 +1,349 @@
+"""
+代理互动模型
+用已完成的LLM模拟结果训练的本地轻量模型：内容文本经归一化后取词、词二元组与字符三元组，
+哈希为稀疏特征向量（L2归一化），在其上做贝叶斯线性回归（以对偶形式求解，等价于余弦相似度核的高斯过程回归）。
+预测同时给出各指标人均值与其后验标准差：与已训练内容越相似、相似内容的模拟用户越多，标准差越小；
+与训练内容都不相似的新内容标准差接近内容间的自然差异，不会被误判为有把握。
+
+用于主动学习：代理模型的标准差不大于一次新模拟本身的标准误时直接给出结果，否则交给LLM模拟，
+模拟结果再加入训练集。每个 (平台, 模型) 单独训练，训练样本可追加保存到JSONL文件供下次运行继续使用
+"""
+import os
+import re
+import sys
+import json
+import math
+import zlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulation.stats import DEFAULT_ALPHA, ComparisonStats, adjust_pvalues, with_total
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 互动指标；代理模型同时预测总互动数
+ENGAGEMENT_KEYS = ("like", "comment", "share", "quote")
+TARGETS = ENGAGEMENT_KEYS + ("total",)
+
+# 哈希特征空间的维数
+N_FEATURES = 2 ** 20
+# 每个平台保留的最近训练样本数（拟合耗时随样本数立方增长）
+DEFAULT_MAX_SAMPLES = 2000
+# 样本数少于该值时代理模型不作答
+DEFAULT_MIN_SAMPLES = 20
+# 新增多少个样本后重新拟合
+DEFAULT_REFIT_EVERY = 20
+# 作答条件：后验标准差 ≤ tolerance × 新模拟的标准误
+DEFAULT_TOLERANCE = 1.0
+# 方差下限，保证矩阵正定
+_MIN_VARIANCE = 1e-6
+
+_WORD = re.compile(r"\w+")
+_SPACE = re.compile(r"\s+")
+
+
+def hash_features(text: str) -> Dict[int, float]:
+    """
+    内容文本的哈希特征
+
+    小写并合并空白后取词、词二元组与字符三元组，用 CRC32 哈希到 N_FEATURES 维（符号位决定正负以抵消碰撞偏差），
+    词频取次线性 1 + log(tf)，最后做L2归一化，使两段内容特征的内积即余弦相似度
+
+    Args:
+        text: 内容文本
+
+    Returns:
+        稀疏特征（维度序号到取值的映射）；空文本返回空字典
+    """
+    normalized = _SPACE.sub(" ", text.lower()).strip()
+    words = _WORD.findall(normalized)
+    padded = f" {normalized} "
+    tokens = ([f"w:{word}" for word in words]
+              + [f"b:{first} {second}" for first, second in zip(words, words[1:])]
+              + [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)])
+
+    counts: Dict[int, float] = {}
+    for token in tokens:
+        digest = zlib.crc32(token.encode("utf-8"))
+        index = digest % N_FEATURES
+        counts[index] = counts.get(index, 0.0) + (1.0 if digest & 0x80000000 else -1.0)
+
+    features = {index: math.copysign(1 + math.log(abs(count)), count) for index, count in counts.items() if count}
+    norm = math.sqrt(sum(value * value for value in features.values()))
+    return {index: value / norm for index, value in features.items()} if norm > 0 else {}
+
+
+def _to_matrix(rows: Sequence[Dict[int, float]]):
+    """稀疏特征列表转为 CSR 矩阵 (行数, N_FEATURES)"""
+    from scipy import sparse
+
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter((index for row in rows for index in row), dtype=np.int64, count=indptr[-1])
+    data = np.fromiter((value for row in rows for value in row.values()), dtype=np.float64, count=indptr[-1])
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), N_FEATURES))
+
+
+@dataclass
+class SurrogatePrediction:
+    """一段内容的代理预测"""
+    means: np.ndarray   # 各目标（TARGETS）的人均值
+    std: np.ndarray     # 人均值的后验标准差
+    confident: bool     # 是否足够可靠，可以代替一次新的模拟
+
+
+class SurrogateModel:
+    """单个 (平台, 模型) 的代理模型"""
+    def __init__(self, max_samples: int = DEFAULT_MAX_SAMPLES):
+        """
+        初始化模型
+
+        Args:
+            max_samples: 保留的最近训练样本数
+        """
+        self.max_samples = max_samples
+        self.features: List[Dict[int, float]] = []
+        self.means: List[np.ndarray] = []
+        self.variances: List[np.ndarray] = []
+        self.users: List[int] = []
+        self.pending = 0  # 上次拟合后新增的样本数
+        self._fitted = None
+
+    @property
+    def size(self) -> int:
+        """训练样本数"""
+        return len(self.features)
+
+    def add(self, features: Dict[int, float], means: np.ndarray, variances: np.ndarray, users: int):
+        """
+        加入一个训练样本
+
+        Args:
+            features: 内容的哈希特征
+            means: 各目标的人均值
+            variances: 各目标的逐用户方差
+            users: 模拟用户数
+        """
+        self.features.append(features)
+        self.means.append(np.asarray(means, dtype=np.float64))
+        self.variances.append(np.asarray(variances, dtype=np.float64))
+        self.users.append(users)
+        if len(self.features) > self.max_samples:
+            del self.features[0], self.means[0], self.variances[0], self.users[0]
+        self.pending += 1
+
+    @property
+    def noise(self) -> np.ndarray:
+        """各目标的逐用户方差（所有样本的平均）"""
+        return np.maximum(np.mean(self.variances, axis=0), _MIN_VARIANCE)
+
+    def fit(self):
+        """
+        拟合：内容的真实人均值 = 总体均值 + 高斯过程(协方差 τ²·余弦相似度)，
+        观测噪声方差为 逐用户方差 / 用户数；τ² 由人均值在内容间的方差减去平均观测噪声估计
+        """
+        from scipy import linalg
+
+        matrix = _to_matrix(self.features)
+        kernel = (matrix @ matrix.T).toarray()
+        means = np.array(self.means)
+        observation = self.noise[None, :] / np.array(self.users, dtype=np.float64)[:, None]
+        prior_mean = means.mean(axis=0)
+        prior_variance = np.maximum(means.var(axis=0) - observation.mean(axis=0), _MIN_VARIANCE)
+
+        factors, weights = [], []
+        for target in range(len(TARGETS)):
+            covariance = prior_variance[target] * kernel + np.diag(observation[:, target])
+            factor = linalg.cho_factor(covariance, lower=True)
+            factors.append(factor)
+            weights.append(linalg.cho_solve(factor, means[:, target] - prior_mean[target]))
+        self._fitted = (matrix, prior_mean, prior_variance, factors, np.array(weights))
+        self.pending = 0
+
+    def predict(self, features: Sequence[Dict[int, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        预测各目标的人均值与后验标准差
+
+        Args:
+            features: 内容的哈希特征列表
+
+        Returns:
+            (人均值, 标准差)，形状均为 (内容数, 目标数)
+        """
+        from scipy import linalg
+
+        matrix, prior_mean, prior_variance, factors, weights = self._fitted
+        queries = _to_matrix(features)
+        similarity = (queries @ matrix.T).toarray()
+        self_similarity = np.asarray(queries.multiply(queries).sum(axis=1)).ravel()
+
+        means = np.empty((len(features), len(TARGETS)))
+        variances = np.empty_like(means)
+        for target, factor in enumerate(factors):
+            tau2 = prior_variance[target]
+            means[:, target] = prior_mean[target] + tau2 * similarity @ weights[target]
+            solved = linalg.cho_solve(factor, similarity.T)
+            variances[:, target] = tau2 * self_similarity - tau2 ** 2 * np.einsum("mn,nm->m", similarity, solved)
+        # 与训练内容都不相似的空文本至少保留先验方差
+        variances[self_similarity == 0] = prior_variance
+        return means, np.sqrt(np.maximum(variances, 0.0))
+
+
+class EngagementSurrogate:
+    """
+    一个模型（provider/model）在各平台上的代理模型与主动学习路由
+
+    方法是线程安全的（拟合与预测用同一把锁串行执行），异步调用方应通过 asyncio.to_thread 调用，
+    避免拟合阻塞事件循环上的其他LLM调用
+    """
+    def __init__(self, model_key: str, path: Optional[str] = None, tolerance: float = DEFAULT_TOLERANCE,
+                 min_samples: int = DEFAULT_MIN_SAMPLES, refit_every: int = DEFAULT_REFIT_EVERY,
+                 max_samples: int = DEFAULT_MAX_SAMPLES):
+        """
+        初始化代理模型
+
+        Args:
+            model_key: 训练数据来源的模型标识（"provider/model"），不同模型的结果不混用
+            path: 训练样本的JSONL文件；存在时读取其中同一模型的样本，新样本追加写入
+            tolerance: 作答条件：所有目标的后验标准差 ≤ tolerance × 新模拟的标准误
+            min_samples: 平台样本数少于该值时不作答
+            refit_every: 新增多少个样本后重新拟合
+            max_samples: 每个平台保留的最近训练样本数
+        """
+        self.model_key = model_key
+        self.path = path
+        self.tolerance = tolerance
+        self.min_samples = min_samples
+        self.refit_every = refit_every
+        self.max_samples = max_samples
+        self.models: Dict[str, SurrogateModel] = {}
+        self.answered = 0
+        self.routed = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _model(self, platform: str) -> SurrogateModel:
+        model = self.models.get(platform)
+        if model is None:
+            model = self.models[platform] = SurrogateModel(max_samples=self.max_samples)
+        return model
+
+    def _load(self):
+        """读取训练样本文件中同一模型的样本"""
+        loaded = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                sample = json.loads(line)
+                if sample.get("model") != self.model_key:
+                    continue
+                self._model(sample["platform"]).add(hash_features(sample["content"]), sample["means"],
+                                                    sample["variances"], sample["users"])
+                loaded += 1
+        logger.info(f"代理模型读取了 {loaded} 个 {self.model_key} 的训练样本")
+
+    def observe(self, platform: str, content: str, values: np.ndarray):
+        """
+        加入一次LLM模拟的结果
+
+        Args:
+            platform: 发布平台
+            content: 内容文本
+            values: 逐用户指标，形状 (用户数, len(ENGAGEMENT_KEYS))
+        """
+        values = with_total(np.asarray(values, dtype=np.float64))
+        users = len(values)
+        if users < 2:
+            return
+        means = values.mean(axis=0)
+        variances = values.var(axis=0, ddof=1)
+        features = hash_features(content)
+        with self._lock:
+            self._model(platform).add(features, means, variances, users)
+            if self.path:
+                sample = {"model": self.model_key, "platform": platform, "content": content, "users": users,
+                          "means": means.round(6).tolist(), "variances": variances.round(6).tolist()}
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+
+    def predict(self, platform: str, contents: Sequence[str], users: int) -> Optional[List[SurrogatePrediction]]:
+        """
+        预测内容的人均互动
+
+        Args:
+            platform: 发布平台
+            contents: 内容文本
+            users: 代替的模拟每个版本的用户数（决定作答所需的精度）
+
+        Returns:
+            每段内容的预测；该平台样本不足时返回None
+        """
+        with self._lock:
+            return self._predict(platform, contents, users)
+
+    def _predict(self, platform: str, contents: Sequence[str], users: int) -> Optional[List[SurrogatePrediction]]:
+        """predict 的实现（调用方持有锁）；需要时先重新拟合"""
+        model = self.models.get(platform)
+        if model is None or model.size < self.min_samples:
+            return None
+        if model._fitted is None or model.pending >= self.refit_every:
+            model.fit()
+
+        means, std = model.predict([hash_features(content) for content in contents])
+        # 一次新模拟的标准误
+        standard_error = np.sqrt(model.noise / max(users, 1))
+        return [SurrogatePrediction(means=mean, std=deviation,
+                                    confident=bool((deviation <= self.tolerance * standard_error).all()))
+                for mean, deviation in zip(means, std)]
+
+    def compare(self, platform: str, content_a: str, content_b: str, users: int,
+                alpha: float = DEFAULT_ALPHA, correction: str = "holm") -> Optional[ComparisonStats]:
+        """
+        两段内容都有把握时直接给出比较结果，否则返回None（交给LLM模拟）
+
+        累计值为按预测人均值折算的 users 个用户的期望值；检验为两个预测人均值之差的z检验
+
+        Args:
+            platform: 发布平台
+            content_a: 版本A的内容
+            content_b: 版本B的内容
+            users: 每个版本的模拟用户数
+            alpha: 显著性水平
+            correction: 多重比较校正方法
+
+        Returns:
+            比较结果或None
+        """
+        with self._lock:
+            predictions = self._predict(platform, [content_a, content_b], users)
+            if predictions is None or not all(prediction.confident for prediction in predictions):
+                self.routed += 1
+                return None
+            self.answered += 1
+
+        from scipy import special
+
+        prediction_a, prediction_b = predictions
+        diff = prediction_a.means - prediction_b.means
+        se = np.sqrt(prediction_a.std ** 2 + prediction_b.std ** 2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.where(se > 0, diff / se, np.where(diff == 0, 0.0, np.sign(diff) * np.inf))
+        p_value = 2 * special.ndtr(-np.abs(z))
+        margin = special.ndtri(1 - alpha / 2) * se
+        return ComparisonStats(
+            metrics=TARGETS, users_a=0, users_b=0,
+            sum_a=prediction_a.means * users, sum_b=prediction_b.means * users,
+            mean_a=prediction_a.means, mean_b=prediction_b.means,
+            ci_low=diff - margin, ci_high=diff + margin, binary=np.zeros(len(TARGETS), dtype=bool),
+            statistic=z, p_value=p_value, p_adjusted=adjust_pvalues(p_value, method=correction), alpha=alpha
+        )
@@ -0,0 +1,468 @@
+"""
+多版本锦标赛
+用多臂老虎机分配模拟用户，从多个候选版本中选出互动最高者：模拟用户集中投向仍有可能胜出的版本，
+而不是让每个版本都跑满 max_users。支持两种策略：
+- thompson: top-two Thompson 抽样，每次有空闲并发槽位时按当前后验选择下一个要模拟的版本，
+  最优版本的后验概率达到 confidence 时停止
+- halving: 逐轮减半（successive halving），每轮给剩余版本平均分配用户，淘汰表现较差的一半
+"""
+import os
+import sys
+import math
+import time
+import logging
+from contextlib import aclosing
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.metrics import MetricsRegistry
+from llms.usage import STATUS_BUDGET_EXCEEDED, UsageTracker
+from simulation.scheduler import PredictionJob, PredictionScheduler
+from simulation.aggregator import ENGAGEMENT_KEYS
+from simulation.run_store import RunStore
+from simulation.engine import RunEstimate, SimulationConfig, estimate_run, run_accounting
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 分配策略
+STRATEGIES = ("thompson", "halving")
+
+# 停止原因
+STOP_CONFIDENT = "confident"        # 最优版本的后验概率达到 confidence
+STOP_USER_BUDGET = "user_budget"    # 模拟用户总数用完
+STOP_COST_BUDGET = "cost_budget"    # 费用或token预算用完
+STOP_HALVING_DONE = "halving_done"  # 逐轮减半只剩一个版本
+STOP_EXHAUSTED = "exhausted"        # 所有版本都已达到 max_users
+
+# 估计后验概率时的蒙特卡洛抽样次数
+POSTERIOR_DRAWS = 4000
+# 方差收缩时合并方差所占的伪观测数（避免用户很少或结果全相同时方差为0导致过度自信）
+PRIOR_OBSERVATIONS = 2.0
+# top-two Thompson 抽样中选择后验最优版本（而不是挑战者）的概率
+TOP_TWO_BETA = 0.5
+
+
+@dataclass
+class TournamentConfig:
+    """锦标赛参数（每个版本的用户上限、并发与预算见 SimulationConfig）"""
+    strategy: str = "thompson"
+    user_budget: Optional[int] = None   # 所有版本合计的模拟用户上限，None表示 版本数 × max_users 的一半
+    min_users: int = 5                  # 每个版本至少模拟的用户数
+    confidence: float = 0.95            # thompson 策略的停止阈值
+    metric: str = "total"               # 排名依据：总互动数或单个指标
+    seed: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class ArmsSnapshot:
+    """各版本统计某一时刻的只读快照，供其他线程（例如界面轮询）展示部分结果"""
+    variants: Tuple[Hashable, ...]
+    users: np.ndarray
+    means: np.ndarray
+    finished: int
+
+
+class BanditArms:
+    """
+    各版本的流式统计：每个版本的用户数、各指标累计值与排名依据（奖励）的一、二阶矩
+    """
+    def __init__(self, variants: Sequence[Hashable], metrics: Sequence[str] = ENGAGEMENT_KEYS,
+                 metric: str = "total"):
+        """
+        初始化统计
+
+        Args:
+            variants: 版本标识
+            metrics: 互动指标名称
+            metric: 奖励："total" 为各指标之和，否则为单个指标
+        """
+        if metric != "total" and metric not in metrics:
+            raise ValueError(f"未知的指标: {metric}")
+        self.variants = tuple(variants)
+        self.metrics = tuple(metrics)
+        self.metric = metric
+        self._index = {variant: index for index, variant in enumerate(self.variants)}
+        self.users = np.zeros(len(self.variants), dtype=np.int64)
+        self.sums = np.zeros((len(self.variants), len(self.metrics)), dtype=np.int64)
+        self.reward_sum = np.zeros(len(self.variants))
+        self.reward_sq = np.zeros(len(self.variants))
+        self.finished = 0
+        self.failed = 0
+
+    def add(self, result) -> Optional[int]:
+        """
+        加入一个用户的结果
+
+        Args:
+            result: 调度器产出的 PredictionResult
+
+        Returns:
+            版本序号；请求失败的用户不计入统计，返回None
+        """
+        self.finished += 1
+        if result.error is not None:
+            self.failed += 1
+            return None
+        arm = self._index[result.variant]
+        values = np.array([result.engagement[metric] for metric in self.metrics])
+        reward = values.sum() if self.metric == "total" else values[self.metrics.index(self.metric)]
+        self.users[arm] += 1
+        self.sums[arm] += values
+        self.reward_sum[arm] += reward
+        self.reward_sq[arm] += reward * reward
+        return arm
+
+    @property
+    def means(self) -> np.ndarray:
+        """各版本的人均奖励（没有用户的版本为0）"""
+        return self.reward_sum / np.maximum(self.users, 1)
+
+    def standard_errors(self) -> np.ndarray:
+        """
+        各版本人均奖励的标准误
+
+        各版本的方差向所有用户的合并方差收缩（PRIOR_OBSERVATIONS 个伪观测），
+        没有用户的版本标准误等于合并标准差
+        """
+        total_users = self.users.sum()
+        if total_users > 1:
+            pooled_mean = self.reward_sum.sum() / total_users
+            pooled_var = max(self.reward_sq.sum() / total_users - pooled_mean ** 2, 0.0) * total_users / (total_users - 1)
+        else:
+            pooled_var = 0.0
+        # 全部结果相同时仍保留一定的不确定性
+        pooled_var = max(pooled_var, 0.25)
+
+        users = self.users.astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            arm_var = np.where(users > 1, (self.reward_sq - users * self.means ** 2) / (users - 1), 0.0)
+        arm_var = np.maximum(arm_var, 0.0)
+        shrunk_var = (users * arm_var + PRIOR_OBSERVATIONS * pooled_var) / (users + PRIOR_OBSERVATIONS)
+        return np.sqrt(shrunk_var / np.maximum(users, 1))
+
+    def posterior_draws(self, rng: np.random.Generator, draws: int = 1) -> np.ndarray:
+        """从各版本人均奖励的正态近似后验中抽样，形状 (draws, 版本数)"""
+        return rng.normal(self.means, self.standard_errors(), size=(draws, len(self.variants)))
+
+    def prob_best(self, rng: np.random.Generator, draws: int = POSTERIOR_DRAWS) -> np.ndarray:
+        """各版本是最优版本的后验概率"""
+        best = self.posterior_draws(rng, draws).argmax(axis=1)
+        return np.bincount(best, minlength=len(self.variants)) / draws
+
+    def metric_means(self) -> np.ndarray:
+        """各版本各指标的人均值，形状 (版本数, 指标数)"""
+        return self.sums / np.maximum(self.users, 1)[:, None]
+
+    def snapshot(self) -> ArmsSnapshot:
+        """当前各版本用户数与人均奖励的只读快照"""
+        users = self.users.copy()
+        means = self.means
+        users.flags.writeable = False
+        means.flags.writeable = False
+        return ArmsSnapshot(variants=self.variants, users=users, means=means, finished=self.finished)
+
+
+@dataclass
+class TournamentResult:
+    """一次锦标赛的结果"""
+    arms: BanditArms
+    p_best: np.ndarray
+    stop_reason: str
+    calls_started: int
+    exhaustive_calls: int   # 每个版本都跑满 max_users 所需的调用数
+    eliminated: Dict[Hashable, int]  # halving 策略中各版本被淘汰的轮次
+    store: Optional[RunStore] = None
+    usage: Optional[UsageTracker] = None
+    metrics: Optional[MetricsRegistry] = None
+
+    @property
+    def saved_calls(self) -> int:
+        """相对逐个跑满 max_users 节省的LLM调用数"""
+        return max(self.exhaustive_calls - self.calls_started, 0)
+
+    @property
+    def budget_exhausted(self) -> bool:
+        """是否因费用或token预算用完而停止"""
+        return self.stop_reason == STOP_COST_BUDGET
+
+    @property
+    def winner_index(self) -> int:
+        """胜出版本的序号：未被淘汰的版本中后验最优概率最高者"""
+        candidates = [arm for arm, variant in enumerate(self.arms.variants) if variant not in self.eliminated]
+        return max(candidates, key=lambda arm: self.p_best[arm])
+
+    @property
+    def winner(self) -> Hashable:
+        """胜出版本（halving 策略中只在最后剩下的版本里选）"""
+        return self.arms.variants[self.winner_index]
+
+    @property
+    def winner_p_best(self) -> float:
+        """胜出版本是最优版本的后验概率"""
+        return float(self.p_best[self.winner_index])
+
+    def ranking(self, alpha: float = 0.05) -> List[Dict[str, Any]]:
+        """
+        按人均奖励从高到低排列的各版本结果
+
+        Args:
+            alpha: 置信区间的显著性水平
+
+        Returns:
+            每个版本一行：版本、用户数、人均奖励及其置信区间、最优概率、淘汰轮次与各指标人均值
+        """
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        means = self.arms.means
+        errors = self.arms.standard_errors()
+        metric_means = self.arms.metric_means()
+        rows = []
+        for arm in np.argsort(-means, kind="stable"):
+            variant = self.arms.variants[arm]
+            row = {
+                "variant": variant,
+                "users": int(self.arms.users[arm]),
+                "mean": float(means[arm]),
+                "ci_low": float(means[arm] - z * errors[arm]),
+                "ci_high": float(means[arm] + z * errors[arm]),
+                "p_best": float(self.p_best[arm]),
+                "eliminated_round": self.eliminated.get(variant)
+            }
+            row.update({metric: float(value) for metric, value in zip(self.arms.metrics, metric_means[arm])})
+            rows.append(row)
+        return rows
+
+    def summary(self) -> Dict[str, Any]:
+        """结果摘要：胜出版本、停止原因、调用数与用量"""
+        summary = {
+            "winner": self.winner,
+            "p_best": round(self.winner_p_best, 4),
+            "stop_reason": self.stop_reason,
+            "users": int(self.arms.users.sum()),
+            "failed": self.arms.failed,
+            "calls_started": self.calls_started,
+            "exhaustive_calls": self.exhaustive_calls
+        }
+        if self.usage is not None:
+            total = self.usage.total()
+            summary.update({"prompt_tokens": total.prompt_tokens, "cache_hit_tokens": total.cache_hit_tokens,
+                            "completion_tokens": total.completion_tokens,
+                            "cost": round(total.cost, 6)})
+        return summary
+
+
+def estimate_tournament(provider: str, model: str, prompts: Dict[Hashable, str], config: SimulationConfig,
+                        tournament: TournamentConfig) -> RunEstimate:
+    """
+    运行前估算一次锦标赛的token数、费用与耗时上限（按模拟用户总上限平均分配到各版本估算）
+
+    Args:
+        provider: 模型提供商
+        model: 模型名称
+        prompts: 版本标识到提示词的映射
+        config: 模拟参数
+        tournament: 锦标赛参数
+
+    Returns:
+        估算结果
+    """
+    budget = tournament_user_budget(len(prompts), config, tournament)
+    users = math.ceil(budget / len(prompts)) if prompts else 0
+    return estimate_run(provider, model, [(prompt, users) for prompt in prompts.values()], config)
+
+
+def halving_schedule(variants: int) -> List[int]:
+    """逐轮减半时每轮参赛的版本数（每轮保留较好的一半，直到只剩一个版本）"""
+    schedule = []
+    while variants > 1:
+        schedule.append(variants)
+        variants = math.ceil(variants / 2)
+    return schedule
+
+
+def tournament_user_budget(variants: int, config: SimulationConfig, tournament: TournamentConfig) -> int:
+    """
+    模拟用户总上限：至少保证每个版本 min_users 个，最多每个版本 max_users 个
+
+    halving 策略还至少保证每轮每个参赛版本一个新用户，使最后一轮不会因预算用完而中断
+    """
+    budget = tournament.user_budget or variants * config.max_users // 2
+    budget = max(budget, variants * tournament.min_users)
+    if tournament.strategy == "halving":
+        budget = max(budget, sum(halving_schedule(variants)))
+    return min(budget, variants * config.max_users)
+
+
+async def run_tournament(llm_client, prompts: Dict[Hashable, str], config: SimulationConfig,
+                         tournament: Optional[TournamentConfig] = None,
+                         scheduler: Optional[PredictionScheduler] = None,
+                         on_result: Optional[Callable[[BanditArms], None]] = None) -> TournamentResult:
+    """
+    运行一次多版本锦标赛
+
+    Args:
+        llm_client: ViralPredictionLLM / RoutingLLM 等提供预测方法的客户端
+        prompts: 版本标识到提示词的映射（至少两个版本）
+        config: 模拟参数，max_users 为每个版本的用户上限
+        tournament: 锦标赛参数
+        scheduler: 共享的调度器；为None时按 config.max_concurrency 新建
+        on_result: 每收到一个用户结果后的回调，参数为各版本的统计
+
+    Returns:
+        锦标赛结果
+
+    Raises:
+        CacheMissError: 回放模式下缓存未命中
+    """
+    tournament = tournament or TournamentConfig()
+    if len(prompts) < 2:
+        raise ValueError(f"至少需要两个版本: {len(prompts)}")
+    if tournament.strategy not in STRATEGIES:
+        raise ValueError(f"未知的分配策略: {tournament.strategy}，可选: {STRATEGIES}")
+
+    with run_accounting(config) as (usage, metrics):
+        result = await _run_tournament(llm_client, prompts, config, tournament, usage, scheduler, on_result)
+    result.metrics = metrics
+    return result
+
+
+async def _run_tournament(llm_client, prompts: Dict[Hashable, str], config: SimulationConfig,
+                          tournament: TournamentConfig, usage: UsageTracker,
+                          scheduler: Optional[PredictionScheduler],
+                          on_result: Optional[Callable[[BanditArms], None]]) -> TournamentResult:
+    if scheduler is None:
+        scheduler = PredictionScheduler(llm_client, max_concurrency=config.max_concurrency)
+
+    variants = tuple(prompts)
+    arms = BanditArms(variants, metric=tournament.metric)
+    max_choices = getattr(llm_client, "max_choices", 1)
+    choices = config.resolve_choices(max_choices)
+    call_size = config.call_size(max_choices)
+    rng = np.random.default_rng(tournament.seed)
+    budget = tournament_user_budget(len(variants), config, tournament)
+    store = RunStore(capacity=budget, variants=variants, metadata={
+        "provider": getattr(llm_client, "provider", None),
+        "model": getattr(llm_client, "model", None),
+        "max_users": config.max_users,
+        "users_per_call": config.users_per_call,
+        "choices_per_call": choices,
+        "strategy": tournament.strategy,
+        "user_budget": budget,
+        "metric": tournament.metric,
+        "started_at": time.time()
+    })
+
+    # 已分配（已发起调用）的用户数，决定每个版本下一个用户的序号
+    assigned = np.zeros(len(variants), dtype=np.int64)
+    calls_started = 0
+    stop_reason = None
+
+    def _job(arm: int, users: int) -> PredictionJob:
+        nonlocal calls_started
+        size = min(call_size, users)
+        job = PredictionJob(variant=variants[arm], index=int(assigned[arm]), prompt=prompts[variants[arm]], size=size,
+                            choices=size if choices > 1 else 1)
+        assigned[arm] += size
+        calls_started += 1
+        return job
+
+    async def _consume(jobs: Iterable[PredictionJob], check_confidence: bool):
+        """执行任务并汇总结果；thompson 策略在后验足够确定时关闭结果流（取消在途请求）"""
+        nonlocal stop_reason
+        async with aclosing(scheduler.run(jobs)) as results:
+            async for result in results:
+                if result.status == STATUS_BUDGET_EXCEEDED:
+                    stop_reason = STOP_COST_BUDGET
+                    continue
+                arms.add(result)
+                store.add(result)
+                if on_result is not None:
+                    on_result(arms)
+                if check_confidence and result.error is None and (arms.users >= tournament.min_users).all():
+                    if arms.prob_best(rng).max() >= tournament.confidence:
+                        stop_reason = STOP_CONFIDENT
+                        break
+
+    def _budget_left() -> bool:
+        """检查费用与用户数预算，用完时记录停止原因"""
+        nonlocal stop_reason
+        if usage.exhausted:
+            stop_reason = stop_reason or STOP_COST_BUDGET
+            logger.warning(f"运行预算已用完，停止发起新调用: {usage.total().to_dict()}")
+            return False
+        if assigned.sum() >= budget:
+            stop_reason = stop_reason or STOP_USER_BUDGET
+            return False
+        return True
+
+    def _thompson_jobs() -> Iterator[PredictionJob]:
+        """每次有空闲槽位时选择下一个版本：先补足 min_users，再做 top-two Thompson 抽样"""
+        while stop_reason is None and _budget_left():
+            open_arms = assigned < config.max_users
+            if not open_arms.any():
+                return
+            warmup = open_arms & (assigned < tournament.min_users)
+            if warmup.any():
+                arm = int(np.flatnonzero(warmup)[np.argmin(assigned[warmup])])
+            else:
+                draws = arms.posterior_draws(rng, draws=2)
+                draws[:, ~open_arms] = -np.inf
+                arm = int(draws[0].argmax())
+                # 一半的概率改选挑战者（第二次抽样中的最优者，不同于首选时才采用），提高识别最优版本的效率
+                if rng.random() > TOP_TWO_BETA and int(draws[1].argmax()) != arm:
+                    arm = int(draws[1].argmax())
+            yield _job(arm, min(config.max_users - assigned[arm], budget - assigned.sum()))
+
+    eliminated: Dict[Hashable, int] = {}
+
+    if tournament.strategy == "thompson":
+        await _consume(_thompson_jobs(), check_confidence=True)
+        if stop_reason is None:
+            stop_reason = STOP_EXHAUSTED
+    else:
+        # 每轮给剩余版本分配相同的新增用户数，本轮结果全部返回后淘汰人均奖励较低的一半。
+        # 剩余预算平均分给剩下的各轮，并为之后每轮每个版本至少留一个用户，保证不超预算且最后一轮跑完
+        remaining = list(range(len(variants)))
+        schedule = halving_schedule(len(variants))
+        for round_index in range(len(schedule)):
+            users_left = int(budget - assigned.sum())
+            reserved = sum(schedule[round_index + 1:])
+            per_arm = max(users_left // ((len(schedule) - round_index) * len(remaining)), tournament.min_users)
+            per_arm = max(min(per_arm, (users_left - reserved) // len(remaining)), 1)
+
+            def _round_jobs() -> Iterator[PredictionJob]:
+                targets = {arm: min(assigned[arm] + per_arm, config.max_users) for arm in remaining}
+                while any(assigned[arm] < target for arm, target in targets.items()):
+                    for arm, target in targets.items():
+                        if assigned[arm] < target:
+                            if not _budget_left():
+                                return
+                            yield _job(arm, target - assigned[arm])
+
+            await _consume(_round_jobs(), check_confidence=False)
+            if stop_reason is not None:
+                break
+            means = arms.means
+            remaining.sort(key=lambda arm: -means[arm])
+            for arm in remaining[math.ceil(len(remaining) / 2):]:
+                eliminated[variants[arm]] = round_index + 1
+            remaining = remaining[:math.ceil(len(remaining) / 2)]
+            if len(remaining) == 1:
+                stop_reason = STOP_HALVING_DONE
+                break
+        else:
+            stop_reason = stop_reason or STOP_EXHAUSTED
+
+    exhaustive_calls = len(variants) * math.ceil(config.max_users / call_size)
+    result = TournamentResult(arms=arms, p_best=arms.prob_best(rng), stop_reason=stop_reason,
+                              calls_started=calls_started, exhaustive_calls=exhaustive_calls, eliminated=eliminated,
+                              store=store, usage=usage)
+    logger.info(f"锦标赛结束（{stop_reason}）：{calls_started}/{exhaustive_calls} 次调用，"
+                f"最优版本 {result.winner} (P={result.winner_p_best:.3f})")
+    return result
@@ -0,0 +1,55 @@
+"""
+流式结果聚合的测试
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulation.aggregator import StreamingAggregator
+
+ENGAGEMENT = {"like": 1, "comment": 0, "share": 0, "quote": 0}
+
+
+def result(variant, index, error=None):
+    return SimpleNamespace(variant=variant, index=index, engagement=None if error else ENGAGEMENT, error=error)
+
+
+def test_contiguous_users_stops_at_first_missing_index():
+    aggregator = StreamingAggregator(max_users=10)
+    # 滑动窗口下结果乱序到达；提前停止时序号 3 尚未完成
+    for index in (0, 2, 1, 4, 5):
+        aggregator.add(result("A", index))
+    for index in (1, 0):
+        aggregator.add(result("B", index))
+    aggregator.add(result("B", 2, error="timeout"))
+    aggregator.add(result("B", 3))
+
+    assert aggregator.paired == 3
+    assert aggregator.contiguous_users("A") == 3
+    assert aggregator.contiguous_users("B") == 2
+
+
+def test_contiguous_users_when_all_users_finished():
+    aggregator = StreamingAggregator(max_users=3, pair_by_index=True)
+    for index in range(3):
+        for variant in ("A", "B"):
+            aggregator.add(result(variant, index))
+    assert aggregator.contiguous_users("A") == aggregator.contiguous_users("B") == 3
+
+
+def test_snapshot_is_unaffected_by_later_results():
+    aggregator = StreamingAggregator(max_users=5)
+    for index in range(2):
+        for variant in ("A", "B"):
+            aggregator.add(result(variant, index))
+    snapshot = aggregator.snapshot()
+    for variant in ("A", "B"):
+        aggregator.add(result(variant, 2))
+
+    assert aggregator.paired == 3
+    assert snapshot.paired == 2
+    assert snapshot.chart_rows(0, 2)["A"].tolist() == [1, 2]
+    assert not snapshot.cumulative_totals["A"].flags.writeable
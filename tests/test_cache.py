@@ -0,0 +1,62 @@
+"""
+LLM响应缓存的测试
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.cache import CacheMissError, ResponseCache
+from llms.llm import ViralPredictionLLM
+from llms.mock_provider import set_mock_profile
+
+KEY_ARGS = {"provider": "mock", "model": "mock-fast", "prompt": "prompt", "temperature": 0.7,
+            "sample_index": 0, "batch_size": 1}
+
+
+@pytest.mark.parametrize("field, value", [
+    ("temperature", 0.0),
+    ("sample_index", 1),
+    ("batch_size", 5),
+    ("prompt", "other prompt"),
+    ("model", "mock-realistic"),
+])
+def test_keys_differ_by_each_field(field, value):
+    assert ResponseCache.make_key(**KEY_ARGS) != ResponseCache.make_key(**{**KEY_ARGS, field: value})
+    assert ResponseCache.make_key(**KEY_ARGS) == ResponseCache.make_key(**KEY_ARGS)
+
+
+def test_entries_are_separate_per_key(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    single = ResponseCache.make_key(**KEY_ARGS)
+    batch = ResponseCache.make_key(**{**KEY_ARGS, "batch_size": 2})
+    cache.put(single, "mock", "mock-fast", "{}", {"like": 1})
+    assert cache.get(batch) is None
+    cache.put(batch, "mock", "mock-fast", "[]", [{"like": 0}, {"like": 1}])
+    assert cache.get(single)["engagement"] == {"like": 1}
+    assert cache.get(batch)["engagement"] == [{"like": 0}, {"like": 1}]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_replay_reads_cache_and_raises_on_miss(tmp_path):
+    set_mock_profile("mock-fast", median_latency=0.001)
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    live = ViralPredictionLLM(provider="mock", model="mock-fast", cache=cache)
+    expected = asyncio.run(live.predict_engagement("prompt", sample_index=3))
+
+    replay = ViralPredictionLLM(provider="mock", model="mock-fast", cache=cache, replay=True)
+    assert replay.client is None
+    assert asyncio.run(replay.predict_engagement("prompt", sample_index=3)) == expected
+    with pytest.raises(CacheMissError):
+        asyncio.run(replay.predict_engagement("prompt", sample_index=4))
+    with pytest.raises(CacheMissError):
+        asyncio.run(replay.predict_engagement("prompt"))
+
+
+def test_replay_requires_cache():
+    with pytest.raises(ValueError):
+        ViralPredictionLLM(provider="mock", model="mock-fast", replay=True)
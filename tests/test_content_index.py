@@ -0,0 +1,79 @@
+"""
+近似重复内容索引的测试
+"""
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulation.content_index import ContentIndex, content_similarity, normalize_content
+
+PLATFORM = "Twitter"
+MODEL = "mock/mock-fast"
+CONTENT = "Big launch today: our new editor is finally out, try it now and tell us what you think"
+OTHER = "Release notes for version 2.3 are available on the website with the full changelog"
+
+
+def make_index() -> ContentIndex:
+    index = ContentIndex(":memory:")
+    index.add(PLATFORM, MODEL, "en", CONTENT, 20)
+    index.add(PLATFORM, MODEL, "en", OTHER, 10)
+    return index
+
+
+def test_normalization_ignores_whitespace_punctuation_and_emoji():
+    assert normalize_content("Big  launch, TODAY!! 🚀🔥\n") == normalize_content("big launch today")
+
+
+def test_lookup_finds_near_duplicate():
+    similar = make_index().lookup(PLATFORM, MODEL, "en", CONTENT.upper() + " 🚀")
+    assert similar is not None
+    assert similar.content == CONTENT
+    assert similar.similarity == 1.0
+    assert similar.users == 20
+
+
+def test_lookup_is_segmented_by_platform_model_and_language():
+    index = make_index()
+    assert index.lookup("LinkedIn", MODEL, "en", CONTENT) is None
+    assert index.lookup(PLATFORM, "mock/other", "en", CONTENT) is None
+    assert index.lookup(PLATFORM, MODEL, "zh", CONTENT) is None
+
+
+def test_lookup_pair_reuses_distinct_versions():
+    similar_a, similar_b = make_index().lookup_pair(PLATFORM, MODEL, "en", CONTENT + "!", OTHER + " 🚀")
+    assert similar_a is not None and similar_a.content == CONTENT
+    assert similar_b is not None and similar_b.content == OTHER
+
+
+def test_lookup_pair_refuses_when_versions_are_near_duplicates():
+    # B 是 A 的单词改动，两者都与已模拟的内容近似重复：复用会让两个版本使用同一提示词
+    version_b = CONTENT.replace("finally", "now")
+    assert content_similarity(CONTENT, version_b) >= 0.8
+    assert make_index().lookup_pair(PLATFORM, MODEL, "en", CONTENT, version_b) == (None, None)
+
+
+def test_lookup_pair_refuses_when_versions_resolve_to_same_content():
+    index = make_index()
+    # 两个版本彼此相似度低于阈值，但都与同一条已模拟内容近似重复
+    version_a = CONTENT + " Thanks to everyone!"
+    version_b = "PSA: " + CONTENT
+    assert content_similarity(version_a, version_b) < index.threshold
+    similar_a = index.lookup(PLATFORM, MODEL, "en", version_a)
+    similar_b = index.lookup(PLATFORM, MODEL, "en", version_b)
+    assert similar_a is not None and similar_b is not None and similar_a.content == similar_b.content
+    assert index.lookup_pair(PLATFORM, MODEL, "en", version_a, version_b) == (None, None)
+
+
+def test_add_keeps_largest_user_count_and_persists(tmp_path):
+    path = str(tmp_path / "contents.sqlite3")
+    index = ContentIndex(path)
+    index.add(PLATFORM, MODEL, "en", CONTENT, 20)
+    index.add(PLATFORM, MODEL, "en", CONTENT, 5)
+    index.close()
+
+    reopened = ContentIndex(path)
+    similar = reopened.lookup(PLATFORM, MODEL, "en", CONTENT)
+    assert similar is not None and similar.users == 20
+    reopened.close()
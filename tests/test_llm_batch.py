@@ -0,0 +1,27 @@
+"""
+批量提示词模式的测试（基于离线模拟提供商）
+"""
+import os
+import sys
+import asyncio
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.cache import ResponseCache
+from llms.llm import ViralPredictionLLM
+from llms.mock_provider import set_mock_profile
+
+
+def test_replay_rebuilds_short_batch(tmp_path, monkeypatch):
+    set_mock_profile("mock-fast", median_latency=0.001)
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    live = ViralPredictionLLM(provider="mock", model="mock-fast", cache=cache)
+    parse_batch = live.parser.parse_engagement_batch
+    # 模型只返回了前两个用户，其余用户回退到单用户模式补齐
+    monkeypatch.setattr(live.parser, "parse_engagement_batch", lambda text, size: parse_batch(text, size)[:2])
+    expected = asyncio.run(live.predict_engagement_batch("prompt", 5, sample_index=10))
+    assert len(expected) == 5
+
+    replay = ViralPredictionLLM(provider="mock", model="mock-fast", cache=cache, replay=True)
+    assert asyncio.run(replay.predict_engagement_batch("prompt", 5, sample_index=10)) == expected
@@ -0,0 +1,42 @@
+"""
+流式调用的测试（基于离线模拟提供商）
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llms.llm
+from llms.llm import ViralPredictionLLM
+from llms.mock_provider import set_mock_profile
+
+
+def streaming_client(monkeypatch, stream_usage: bool):
+    set_mock_profile("mock-fast", median_latency=0.001)
+    monkeypatch.setattr(llms.llm, "supports_stream_usage", lambda provider: stream_usage)
+    client = ViralPredictionLLM(provider="mock", model="mock-fast", stream=True)
+    requests = []
+    create = client.client.chat.completions.create
+
+    async def spy(**kwargs):
+        requests.append(kwargs)
+        return await create(**kwargs)
+
+    monkeypatch.setattr(client.client.chat.completions, "create", spy)
+    return client, requests
+
+
+@pytest.mark.parametrize("stream_usage", [True, False])
+def test_stream_options_only_sent_to_supporting_providers(monkeypatch, stream_usage):
+    client, requests = streaming_client(monkeypatch, stream_usage)
+    engagement = asyncio.run(client.predict_engagement("prompt"))
+    assert set(engagement) >= {"like", "comment", "share", "quote"}
+    assert requests and all(request["stream"] for request in requests)
+    assert all(("stream_options" in request) == stream_usage for request in requests)
+    # 提供商不返回用量时按收到的文本估算，用量统计仍然有值
+    usage = next(iter(client.get_usage().values()))
+    assert usage["prompt_tokens"] > 0 and usage["completion_tokens"] > 0
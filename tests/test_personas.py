@@ -0,0 +1,34 @@
+"""
+受众画像抽样的测试
+"""
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.model_config import get_max_choices
+from simulation.personas import assign_personas, get_population, persona_block_size, stratified_strata
+
+
+def test_stratified_prefixes_stay_balanced():
+    weights = [0.4, 0.25, 0.2, 0.15]
+    strata = stratified_strata(weights, 100, seed=3)
+    for size in (10, 37, 100):
+        counts = [int((strata[:size] == stratum).sum()) for stratum in range(len(weights))]
+        assert all(abs(count - weight * size) < 1 for count, weight in zip(counts, weights))
+
+
+def test_default_choices_cover_most_strata_with_few_users():
+    # 默认按提供商能力取候选数上限（n=16）时，20 个用户不能只分成两块画像
+    population = get_population("Twitter")
+    call_size = get_max_choices("mock", "mock-fast")
+    assert call_size > 2
+    block_size = persona_block_size(call_size, 20, len(population))
+    assignment = assign_personas(population, 20, block_size=block_size, seed=0)
+    assert len(set(assignment.strata.tolist())) > 2
+
+
+def test_block_size_unchanged_with_many_users():
+    assert persona_block_size(16, 500, 4) == 16
+    assert persona_block_size(16, 3, 4) == 1
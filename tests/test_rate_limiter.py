@@ -0,0 +1,49 @@
+"""
+限流与重试策略的测试
+"""
+import os
+import sys
+import asyncio
+
+import httpx
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.rate_limiter import RETRY_CONFIG, LLMRequestError, call_with_rate_limit
+
+
+def flaky_request(error: BaseException, failures: int):
+    attempts = []
+
+    async def request():
+        attempts.append(len(attempts))
+        if len(attempts) <= failures:
+            raise error
+        return "ok"
+
+    return request, attempts
+
+
+def test_transport_errors_are_retried(monkeypatch):
+    monkeypatch.setitem(RETRY_CONFIG, "base_delay", 0)
+    request, attempts = flaky_request(httpx.ReadError("connection reset"), failures=1)
+    assert asyncio.run(call_with_rate_limit("mock", request)) == "ok"
+    assert len(attempts) == 2
+
+
+def test_programming_errors_propagate_without_retry():
+    request, attempts = flaky_request(KeyError("choices"), failures=1)
+    with pytest.raises(KeyError):
+        asyncio.run(call_with_rate_limit("mock", request))
+    assert len(attempts) == 1
+
+
+def test_exhausted_retries_raise_request_error(monkeypatch):
+    monkeypatch.setitem(RETRY_CONFIG, "base_delay", 0)
+    monkeypatch.setitem(RETRY_CONFIG, "max_retries", 2)
+    request, attempts = flaky_request(asyncio.TimeoutError(), failures=5)
+    with pytest.raises(LLMRequestError):
+        asyncio.run(call_with_rate_limit("mock", request))
+    assert len(attempts) == 3
@@ -0,0 +1,60 @@
+"""
+模型响应解析的测试
+"""
+import os
+import sys
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.response_parser import (
+    PARSE_INVALID_VALUE, PARSE_MISSING_KEYS, PARSE_OK, PARSE_REGEX_FALLBACK, ResponseParseError, ResponseParser
+)
+
+
+def test_parses_last_json_after_reasoning():
+    parser = ResponseParser()
+    text = '<think>maybe {"like": 9}</think>Result: {"like": 1, "comment": "0", "share": true, "quote": 2.0}'
+    assert parser.parse_engagement(text) == {"like": 1, "comment": 0, "share": 1, "quote": 2}
+    assert parser.snapshot() == {PARSE_OK: 1}
+
+
+@pytest.mark.parametrize("value", ["Infinity", "-Infinity", "NaN", "1e999", '"1e999"', '"inf"'])
+def test_non_finite_values_are_parse_errors(value):
+    parser = ResponseParser()
+    with pytest.raises(ResponseParseError) as excinfo:
+        parser.parse_engagement(f'{{"like": {value}, "comment": 0, "share": 0, "quote": 0}}')
+    assert excinfo.value.reason == PARSE_INVALID_VALUE
+
+
+@pytest.mark.parametrize("text", ["{}", '{"answer": "I would scroll past"}'])
+def test_objects_without_engagement_keys_are_parse_errors(text):
+    parser = ResponseParser()
+    with pytest.raises(ResponseParseError) as excinfo:
+        parser.parse_engagement(text)
+    assert excinfo.value.reason == PARSE_MISSING_KEYS
+    assert parser.snapshot() == {PARSE_MISSING_KEYS: 1}
+
+
+def test_partially_missing_keys_default_to_zero():
+    parser = ResponseParser()
+    assert parser.parse_engagement('{"like": 1}') == {"like": 1, "comment": 0, "share": 0, "quote": 0}
+    assert parser.snapshot() == {PARSE_MISSING_KEYS: 1}
+
+
+def test_regex_fallback_rejects_overflowing_numbers():
+    parser = ResponseParser()
+    assert parser.parse_engagement('"like": 1, "comment": 0, "share": 0, "quote": 1 ...') == {
+        "like": 1, "comment": 0, "share": 0, "quote": 1
+    }
+    assert parser.snapshot() == {PARSE_REGEX_FALLBACK: 1}
+    with pytest.raises(ResponseParseError):
+        parser.parse_engagement(f'"like": {"9" * 400}, "comment": 0, "share": 0, "quote": 0')
+
+
+def test_batch_skips_items_without_engagement_keys():
+    parser = ResponseParser()
+    results = parser.parse_engagement_batch('{"users": [{"like": 1}, {}, {"like": Infinity}]}', 3)
+    assert results == [{"like": 1, "comment": 0, "share": 0, "quote": 0}]
@@ -0,0 +1,33 @@
+"""
+多提供商路由的测试
+"""
+import os
+import sys
+import asyncio
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llms.cache import ResponseCache
+from llms.llm import ViralPredictionLLM
+from llms.mock_provider import set_mock_profile
+from llms.router import RoutingLLM
+
+
+def test_cache_hits_do_not_record_latency(tmp_path):
+    set_mock_profile("mock-fast", median_latency=0.001)
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    router = RoutingLLM([ViralPredictionLLM(provider="mock", model="mock-fast", cache=cache)])
+
+    async def run():
+        for index in range(10):
+            await router.predict_engagement("prompt", sample_index=index)
+
+    asyncio.run(run())
+    stats = router.stats[0]
+    assert len(stats.latencies) == stats.calls == 10
+
+    # 第二遍全部命中缓存：不计入延迟样本，对冲阈值不受影响
+    asyncio.run(run())
+    assert len(stats.latencies) == stats.calls == 10
+    assert cache.stats()["hits"] == 10
@@ -0,0 +1,54 @@
+"""
+并发调度器的测试
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulation.scheduler import PredictionJob, PredictionScheduler, interleave_jobs
+
+
+class FakeClient:
+    provider = "fake"
+
+    async def predict_engagement(self, prompt, sample_index=None):
+        await asyncio.sleep(0)
+        return {"like": 1, "comment": 0, "share": 0, "quote": 0}
+
+
+def test_runs_all_jobs_with_bounded_concurrency():
+    async def run():
+        scheduler = PredictionScheduler(FakeClient(), max_concurrency=3)
+        results = [result async for result in scheduler.run(interleave_jobs({"A": "a", "B": "b"}, 10))]
+        return scheduler, results
+
+    scheduler, results = asyncio.run(run())
+    assert sorted((result.variant, result.index) for result in results) == [
+        (variant, index) for variant in ("A", "B") for index in range(10)
+    ]
+    assert scheduler._semaphore._value == 3
+
+
+def test_failing_job_iterator_releases_its_slot():
+    def jobs():
+        yield PredictionJob(variant="A", index=0, prompt="a")
+        raise ValueError("bad row")
+
+    async def run(scheduler):
+        return [result async for result in scheduler.run(jobs())]
+
+    async def main():
+        scheduler = PredictionScheduler(FakeClient(), max_concurrency=2)
+        with pytest.raises(ValueError):
+            await run(scheduler)
+        # 共享同一个调度器的后续运行仍有全部并发槽位
+        assert scheduler._semaphore._value == 2
+        results = [result async for result in scheduler.run(interleave_jobs({"A": "a"}, 4))]
+        assert len(results) == 4
+
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+"""
+A/B序贯检验的测试
+"""
+import os
+import sys
+from statistics import NormalDist
+
+import numpy as np
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulation.sequential import SequentialABTest, obrien_fleming_spending
+
+ALPHA = 0.05
+
+
+def test_obrien_fleming_boundaries_are_monotone():
+    information = np.linspace(0.1, 1.0, 19)
+    spent = np.array([obrien_fleming_spending(fraction, ALPHA) for fraction in information])
+    # 累计消耗的alpha随信息比例递增，对应的z边界递减，最后一次检验用满alpha
+    assert (np.diff(spent) > 0).all()
+    boundaries = np.array([NormalDist().inv_cdf(1 - value / 2) for value in spent])
+    assert (np.diff(boundaries) < 0).all()
+    assert spent[-1] == pytest.approx(ALPHA)
+    assert obrien_fleming_spending(0, ALPHA) == 0.0
+
+
+@pytest.mark.parametrize("max_users, look_every", [(20, 5), (37, 4), (100, 1)])
+def test_cumulative_spend_never_exceeds_alpha(max_users, look_every):
+    rng = np.random.default_rng(0)
+    test = SequentialABTest(max_users, alpha=ALPHA, look_every=look_every, min_users=1)
+    spent = []
+    for _ in range(max_users):
+        test.add_pair(rng.poisson(2.0), rng.poisson(2.0))
+        spent.append(test.alpha_spent)
+    assert all(value <= ALPHA + 1e-12 for value in spent)
+    assert spent == sorted(spent)
+
+
+def test_identical_results_never_stop_early():
+    rng = np.random.default_rng(1)
+    test = SequentialABTest(50, alpha=ALPHA, look_every=1, min_users=2)
+    for value in rng.poisson(3.0, size=50):
+        assert test.add_pair(value, value) is None
+    assert test.decision is None
+
+
+def test_identical_variants_rarely_stop():
+    # A/A：两个版本来自同一分布，提前停止（误判）的比例不超过 alpha
+    rng = np.random.default_rng(2)
+    trials = 1000
+    stopped = 0
+    for _ in range(trials):
+        test = SequentialABTest(60, alpha=ALPHA, look_every=5)
+        for value_a, value_b in rng.poisson(2.0, size=(60, 2)):
+            if test.add_pair(value_a, value_b) is not None:
+                stopped += 1
+                break
+    assert stopped / trials <= ALPHA + 0.02
@@ -0,0 +1,84 @@
+"""
+统计检验的测试（参考值来自 scipy.stats / statsmodels 对同一组数据的计算结果）
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulation.stats import (
+    adjust_pvalues, bootstrap_mean_diff_ci, bootstrap_paired_diff_ci, compare_paired, compare_variants,
+    two_proportion_ztest, welch_ttest
+)
+
+VALUES_A = np.array([0, 1, 3, 2, 5, 0, 1, 4, 2, 2, 7, 1], dtype=float)
+VALUES_B = np.array([1, 0, 0, 2, 1, 0, 3, 1, 0, 1], dtype=float)
+P_VALUES = np.array([0.01, 0.04, 0.03, 0.20, 0.002])
+STRATA = np.array([0, 0, 0, 0, 0, 1, 1, 1, 1, 1])
+STRATUM_WEIGHTS = np.array([0.3, 0.7])
+
+
+def test_two_proportion_ztest_matches_statsmodels():
+    # statsmodels.stats.proportion.proportions_ztest([30, 18], [100, 90])
+    z, p = two_proportion_ztest(30, 18, 100, 90)
+    assert z == pytest.approx(1.5839200790764056)
+    assert p == pytest.approx(0.11321190745396498)
+
+
+def test_welch_ttest_matches_scipy():
+    # scipy.stats.ttest_ind(VALUES_A, VALUES_B, equal_var=False)
+    t, p = welch_ttest(VALUES_A.mean(), VALUES_B.mean(), VALUES_A.var(ddof=1), VALUES_B.var(ddof=1),
+                       len(VALUES_A), len(VALUES_B))
+    assert t == pytest.approx(2.096144451065366)
+    assert p == pytest.approx(0.052054604299721724)
+
+
+def test_compare_variants_uses_welch_for_counts():
+    stats = compare_variants(VALUES_A[:, None], VALUES_B[:, None], ["x"], n_bootstrap=0)
+    assert not stats.binary[0]
+    assert stats.p_value[0] == pytest.approx(0.052054604299721724)
+
+
+@pytest.mark.parametrize("method, expected", [
+    # statsmodels.stats.multitest.multipletests(P_VALUES, method=...)[1]
+    ("holm", [0.04, 0.09, 0.09, 0.2, 0.01]),
+    ("fdr_bh", [0.025, 0.05, 0.05, 0.2, 0.01]),
+    ("bonferroni", [0.05, 0.2, 0.15, 1.0, 0.01]),
+])
+def test_adjust_pvalues_matches_statsmodels(method, expected):
+    np.testing.assert_allclose(adjust_pvalues(P_VALUES, method=method), expected)
+    # 每一行是独立的一族检验
+    np.testing.assert_allclose(adjust_pvalues(np.stack([P_VALUES, P_VALUES]), method=method), [expected, expected])
+
+
+def test_bootstrap_ci_matches_scipy():
+    # scipy.stats.bootstrap(..., method="percentile", n_resamples=200000)
+    rng = np.random.default_rng(0)
+    low, high = bootstrap_mean_diff_ci(VALUES_A[:, None], VALUES_B[:, None], n_samples=20000, rng=rng)
+    assert low[0] == pytest.approx(0.2167, abs=0.05)
+    assert high[0] == pytest.approx(2.7667, abs=0.05)
+
+    low, high = bootstrap_paired_diff_ci((VALUES_A[:10] - VALUES_B)[:, None], n_samples=20000, rng=rng)
+    assert low[0] == pytest.approx(0.0, abs=0.05)
+    assert high[0] == pytest.approx(2.2, abs=0.05)
+
+
+def test_paired_ttest_matches_scipy():
+    # scipy.stats.ttest_rel(VALUES_A[:10], VALUES_B)
+    stats = compare_paired(VALUES_A[:10, None], VALUES_B[:, None], ["x"], n_bootstrap=0)
+    assert stats.statistic[0] == pytest.approx(1.819348893185905)
+    assert stats.p_value[0] == pytest.approx(0.10220876091613064)
+
+
+def test_stratified_paired_ttest_matches_reference():
+    # 均值 Σ w_h d̄_h = 0.98，方差 Σ w_h² s_h² / n_h = 0.44，自由度 10 - 2：
+    # t = 0.98 / sqrt(0.44)，p = 2 * scipy.stats.t.sf(t, 8)
+    stats = compare_paired(VALUES_A[:10, None], VALUES_B[:, None], ["x"], strata=STRATA,
+                           weights=STRATUM_WEIGHTS, n_bootstrap=0)
+    assert stats.diff[0] == pytest.approx(0.98)
+    assert stats.statistic[0] == pytest.approx(1.4774055884310417)
+    assert stats.p_value[0] == pytest.approx(0.17781777620798944)
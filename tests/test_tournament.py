@@ -0,0 +1,74 @@
+"""
+多版本锦标赛的测试
+"""
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 模拟引擎依赖提示词模板模块
+pytest.importorskip("prompt.content_prediction")
+
+from llms.cache import ResponseCache
+from llms.llm import ViralPredictionLLM
+from llms.mock_provider import set_mock_profile
+from simulation.engine import SimulationConfig
+from simulation.tournament import (
+    STOP_HALVING_DONE, BanditArms, TournamentConfig, TournamentResult, halving_schedule, run_tournament,
+    tournament_user_budget
+)
+
+
+def run_halving(tmp_path, variants, max_users, user_budget, min_users=5):
+    set_mock_profile("mock-fast", median_latency=0.001)
+    llm = ViralPredictionLLM(provider="mock", model="mock-fast", cache=ResponseCache(str(tmp_path / "responses.sqlite3")))
+    prompts = {f"v{index}": f"candidate {index}" for index in range(variants)}
+    config = SimulationConfig(max_users=max_users, choices_per_call=1)
+    tournament = TournamentConfig(strategy="halving", user_budget=user_budget, min_users=min_users, seed=0)
+    result = asyncio.run(run_tournament(llm, prompts, config, tournament))
+    return result, tournament_user_budget(variants, config, tournament)
+
+
+@pytest.mark.parametrize("variants, max_users, user_budget, min_users", [
+    (20, 20, 200, 5),
+    (20, 20, None, 5),
+    (7, 10, 7, 1),
+    (3, 4, 100, 5),
+])
+def test_halving_stays_within_budget_and_finishes(tmp_path, variants, max_users, user_budget, min_users):
+    result, budget = run_halving(tmp_path, variants, max_users, user_budget, min_users)
+    assert result.stop_reason == STOP_HALVING_DONE
+    assert result.arms.finished <= budget
+    assert len(result.eliminated) == variants - 1
+    assert result.winner not in result.eliminated
+
+
+def test_halving_schedule_ends_with_two_versions():
+    assert halving_schedule(20) == [20, 10, 5, 3, 2]
+    assert halving_schedule(2) == [2]
+
+
+def test_winner_is_never_an_eliminated_version():
+    arms = BanditArms(("a", "b", "c"))
+    result = TournamentResult(arms=arms, p_best=np.array([0.6, 0.3, 0.1]), stop_reason=STOP_HALVING_DONE,
+                              calls_started=0, exhaustive_calls=0, eliminated={"a": 1, "c": 2})
+    assert result.winner == "b"
+    assert result.summary()["p_best"] == 0.3
+
+
+def test_arms_snapshot_is_unaffected_by_later_results():
+    arms = BanditArms(("a", "b"))
+    engagement = {"like": 1, "comment": 1, "share": 0, "quote": 0}
+    arms.add(SimpleNamespace(variant="a", engagement=engagement, error=None))
+    snapshot = arms.snapshot()
+    arms.add(SimpleNamespace(variant="b", engagement=engagement, error=None))
+
+    assert snapshot.users.tolist() == [1, 0]
+    assert snapshot.means.tolist() == [2.0, 0.0]
+    assert snapshot.finished == 1
@@ -1,11 +1,9 @@
 import streamlit as st
-from scipy import stats
-from statsmodels.stats.proportion import proportions_ztest
-import numpy as np
-import asyncio
-import json
+import pandas as pd
 import os
 import sys
+import time
+import uuid
 from dotenv import load_dotenv
 
 # 添加项目根目录到Python路径
@@ -16,12 +14,142 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)),
 
 # 导入自定义模块
 from llms.llm import ViralPredictionLLM
-from prompt.content_prediction import get_engagement_prompt
+from llms.cache import ResponseCache, CacheMissError
+from llms.client_pool import get_event_loop_thread
+from llms.router import RoutingLLM
+from llms.metrics import start_metrics_server
 from config.language import TEXTS
+from simulation.scheduler import DEFAULT_MAX_CONCURRENCY
+from simulation.aggregator import DEFAULT_MAX_FPS, FrameThrottle
+from simulation.engine import (
+    PLATFORMS, SimulationConfig, build_prompt, estimate_ab_test, estimate_run, run_ab_test, run_platform_sweep
+)
+from simulation.tournament import STRATEGIES, TournamentConfig, estimate_tournament, run_tournament, tournament_user_budget
+from simulation.content_index import ContentIndex
+from simulation.jobs import JOB_CANCELLED, JOB_DONE, JOB_FAILED, JOB_PENDING, get_job_manager as get_process_job_manager
+
+# 检验方法的显示名称（ComparisonStats.metric 返回的 test 字段）
+TEST_LABELS = {"z": "z", "welch": "Welch t", "paired": "paired stratified t"}
+
+# 新增界面文本（config.language 中尚未收录时使用）
+EXTRA_TEXTS = {
+    "en": {
+        "advanced_settings": "Advanced settings",
+        "max_concurrency": "Max concurrent LLM calls",
+        "users_per_call": "Simulated users per LLM call",
+        "early_stopping": "Stop early once the winner is clear (sequential test)",
+        "early_stopped": "Stopped early after {} users per version: version {} leads (p={:.4f}). Saved {} of {} LLM calls ({:.0f}%).",
+        "use_cache": "Reuse cached responses for identical prompts",
+        "replay_mode": "Replay a previous run from the cache (no network calls)",
+        "cache_miss": "Replay failed, the cache has no entry for this run: {}",
+        "cache_stats": "Cache: {} hits, {} misses",
+        "failed_users": "{} simulated users failed (API errors after retries or unparseable responses) and were excluded from the statistics.",
+        "parse_stats": "Response parsing issues: {}",
+        "extra_backends": "Spread users across additional providers",
+        "hedge_requests": "Hedge slow calls (duplicate to another provider after p95 latency)",
+        "routing_stats": "Provider routing",
+        "download_run": "Download per-user results (Parquet)",
+        "cost_budget": "Cost budget per run in USD (0 = unlimited)",
+        "preflight": "Estimated upper bound: {} LLM calls, ~{:,} tokens, ~${:.4f}, ~{:.0f}s",
+        "usage_summary": "Token usage: {:,} prompt ({:,} served from the provider's prefix cache) + {:,} completion ({:,} reasoning), cost ${:.4f}",
+        "show_diagnostics": "Show call diagnostics (latency, throughput, retries)",
+        "diagnostics": "Call diagnostics",
+        "budget_exhausted": "The cost budget was used up. The run stopped early, and the results cover only the users completed before that.",
+        "metric_detail": "Per-user difference {:+.2f} (95% CI {:+.2f} to {:+.2f}), adjusted p={:.4f}, {} test",
+        "mode": "Mode",
+        "mode_ab": "A/B test (two versions)",
+        "mode_sweep": "Platform sweep (A/B on every platform)",
+        "mode_tournament": "Tournament (many versions)",
+        "need_platforms": "Select at least one platform.",
+        "sweep_matrix": "Results by platform",
+        "sweep_complete": "Simulated {} users per version on {} platforms in {:.1f}s.",
+        "winner_column": "{} winner",
+        "candidates": "Candidate versions, one per line",
+        "need_candidates": "Enter at least two candidate versions, one per line.",
+        "tournament_strategy": "Allocation strategy",
+        "strategy_thompson": "Thompson sampling (stop once the best is clear)",
+        "strategy_halving": "Successive halving",
+        "tournament_confidence": "Stop when the leader is best with probability",
+        "tournament_budget": "Simulated users across all versions (0 = half of versions × max users)",
+        "tournament_result": "Best version: {} (probability best {:.0%}) after {} simulated users. Used {} of {} LLM calls ({:.0f}% saved).",
+        "tournament_ranking": "Ranking",
+        "candidate": "Content",
+        "p_best": "P(best)",
+        "mean_engagement": "Engagement per user",
+        "stream_responses": "Stream responses and stop reading as soon as the result JSON is complete",
+        "sample_choices": "Draw several users per request with the API's n parameter (where the provider supports it)",
+        "persona_sampling": "Give each simulated user an audience persona and compare both versions on the same personas (paired test)",
+        "reuse_similar": "Reuse results of near-duplicate content already simulated (only the missing users are simulated)",
+        "similar_reused": "Version {} nearly duplicates content already simulated for {} users (similarity {:.0%}). Its cached results are reused and only the remaining users are simulated.",
+        "similar_found": "Version {} nearly duplicates content already simulated for {} users (similarity {:.0%}). Enable reuse in the advanced settings to top up those results instead of starting over.",
+        "cancel_run": "Cancel run",
+        "run_queued": "Queued, waiting for other runs to finish...",
+        "run_in_background": "Running in the background ({:.0f}s). You can change settings or switch language without interrupting it.",
+        "run_cancelled": "The run was cancelled.",
+        "run_failed": "The run failed: {}",
+    },
+    "zh": {
+        "advanced_settings": "高级设置",
+        "max_concurrency": "最大并发LLM调用数",
+        "users_per_call": "每次LLM调用模拟的用户数",
+        "early_stopping": "胜出版本明确后提前停止（序贯检验）",
+        "early_stopped": "每个版本模拟 {} 个用户后提前停止：版本 {} 领先 (p={:.4f})。节省了 {}/{} 次LLM调用 ({:.0f}%)。",
+        "use_cache": "相同提示词复用缓存的响应",
+        "replay_mode": "从缓存回放之前的运行（不发起网络调用）",
+        "cache_miss": "回放失败，缓存中没有本次运行的记录：{}",
+        "cache_stats": "缓存：命中 {} 次，未命中 {} 次",
+        "failed_users": "{} 个模拟用户失败（重试后仍然出错或响应无法解析），已从统计中排除。",
+        "parse_stats": "响应解析问题：{}",
+        "extra_backends": "将用户分散到更多提供商",
+        "hedge_requests": "对冲慢请求（超过p95延迟后向另一个提供商发送重复请求）",
+        "routing_stats": "提供商路由",
+        "download_run": "下载逐用户结果（Parquet）",
+        "cost_budget": "单次运行的费用预算（美元，0表示不限制）",
+        "preflight": "预计上限：{} 次LLM调用，约 {:,} 个token，约 ${:.4f}，约 {:.0f} 秒",
+        "usage_summary": "token用量：输入 {:,}（其中命中提供商前缀缓存 {:,}）+ 输出 {:,}（其中推理 {:,}），费用 ${:.4f}",
+        "show_diagnostics": "显示调用诊断信息（耗时、吞吐量、重试）",
+        "diagnostics": "调用诊断",
+        "budget_exhausted": "费用预算已用完，运行已提前停止，结果只包含此前完成的用户。",
+        "metric_detail": "人均差值 {:+.2f}（95%置信区间 {:+.2f} 至 {:+.2f}），校正后 p={:.4f}，{} 检验",
+        "mode": "模式",
+        "mode_ab": "A/B测试（两个版本）",
+        "mode_sweep": "平台扫描（在每个平台上做A/B测试）",
+        "mode_tournament": "锦标赛（多个版本）",
+        "need_platforms": "请至少选择一个平台。",
+        "sweep_matrix": "各平台结果",
+        "sweep_complete": "在 {1} 个平台上每个版本模拟了 {0} 个用户，用时 {2:.1f} 秒。",
+        "winner_column": "{} 胜出版本",
+        "candidates": "候选版本，每行一个",
+        "need_candidates": "请至少输入两个候选版本，每行一个。",
+        "tournament_strategy": "分配策略",
+        "strategy_thompson": "Thompson 抽样（最优版本明确后停止）",
+        "strategy_halving": "逐轮减半",
+        "tournament_confidence": "领先版本为最优的概率达到该值时停止",
+        "tournament_budget": "所有版本合计的模拟用户数（0表示 版本数 × 最大用户数 的一半）",
+        "tournament_result": "最优版本：{}（为最优的概率 {:.0%}），共模拟 {} 个用户。使用了 {}/{} 次LLM调用（节省 {:.0f}%）。",
+        "tournament_ranking": "排名",
+        "candidate": "内容",
+        "p_best": "最优概率",
+        "mean_engagement": "人均互动数",
+        "stream_responses": "流式读取响应，结果JSON一完整就停止读取",
+        "sample_choices": "用API的 n 参数在一次请求中采样多个用户（提供商支持时）",
+        "persona_sampling": "为每个模拟用户分配受众画像，两个版本在同一批画像上配对比较（配对检验）",
+        "reuse_similar": "复用已模拟过的近似重复内容的结果（只模拟不足的用户）",
+        "similar_reused": "版本 {} 与已模拟 {} 个用户的内容近似重复（相似度 {:.0%}），将复用其缓存结果，只模拟剩余的用户。",
+        "similar_found": "版本 {} 与已模拟 {} 个用户的内容近似重复（相似度 {:.0%}）。在高级设置中启用复用即可在其结果上补充用户，而不必从头模拟。",
+        "cancel_run": "取消运行",
+        "run_queued": "排队中，等待其他运行结束……",
+        "run_in_background": "正在后台运行（{:.0f} 秒）。修改设置或切换语言不会中断运行。",
+        "run_cancelled": "运行已取消。",
+        "run_failed": "运行失败：{}",
+    },
+}
 
 # 初始化会话状态
 if 'language' not in st.session_state:
     st.session_state.language = 'en'  # 默认英文
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # 标识本会话提交的后台任务
 
 # 语言切换函数
 def toggle_language():
@@ -35,7 +163,10 @@ def toggle_language():
 # 获取当前语言的文本
 def get_text(key):
     """获取当前语言的文本"""
-    return TEXTS[st.session_state.language][key]
+    texts = TEXTS[st.session_state.language]
+    if key not in texts:
+        return EXTRA_TEXTS[st.session_state.language][key]
+    return texts[key]
 
 # 转义特殊字符
 def escape_markdown(text):
@@ -44,9 +175,39 @@ def escape_markdown(text):
         return text
     return st.markdown(text, escape=True)
 
-# 设置页面配置
+# 跨重新运行共享的资源：响应缓存与承载LLM请求的常驻事件循环（连接池绑定在该循环上）
+@st.cache_resource
+def get_response_cache():
+    """获取共享的响应缓存"""
+    return ResponseCache()
+
+@st.cache_resource
+def get_content_index():
+    """获取共享的近似重复内容索引"""
+    return ContentIndex()
+
+@st.cache_resource
+def get_llm_event_loop():
+    """获取承载LLM网络请求的常驻事件循环"""
+    return get_event_loop_thread()
+
+@st.cache_resource
+def get_job_manager():
+    """获取进程级的后台任务管理器（所有会话共享，运行在独立的事件循环线程中）"""
+    return get_process_job_manager()
+
+@st.cache_resource
+def get_metrics_server():
+    """设置了 VIRAL_METRICS_PORT 时启动 /metrics 端点（Prometheus/OpenMetrics）"""
+    port = os.getenv("VIRAL_METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+# 设置页面配置（必须是第一个Streamlit命令，缓存资源的调用也要放在其后）
 st.set_page_config(layout="wide", page_title=get_text("title"))
 
+get_llm_event_loop()
+get_metrics_server()
+
 # 设置页面样式
 st.markdown("""
 <style>
@@ -177,40 +338,69 @@ st.markdown(f'<h4 class="sub-header">{get_text("subtitle")}</h4>', unsafe_allow_
 st.markdown("---")
 st.markdown(f"### {get_text('input_section') if 'input_section' in TEXTS[st.session_state.language] else '内容设置'}")
 
-# 版本A和版本B的输入区域
-col_a, col_b = st.columns(2)
-
-with col_a:
-    st.markdown(f"#### {get_text('version_a')}", help=None)
-    version_a = st.text_area(
-        label=get_text('version_a'),
-        placeholder=get_text('input_placeholder'),
-        height=200, 
-        key="version_a_input", 
-        label_visibility="collapsed"
-    )
-
-with col_b:
-    st.markdown(f"#### {get_text('version_b')}", help=None)
-    version_b = st.text_area(
-        label=get_text('version_b'),
+mode = st.radio(
+    label=get_text("mode"),
+    options=["ab", "sweep", "tournament"],
+    format_func=lambda option: get_text(f"mode_{option}"),
+    horizontal=True,
+    key="mode_input"
+)
+
+if mode in ("ab", "sweep"):
+    # 版本A和版本B的输入区域
+    col_a, col_b = st.columns(2)
+
+    with col_a:
+        st.markdown(f"#### {get_text('version_a')}", help=None)
+        version_a = st.text_area(
+            label=get_text('version_a'),
+            placeholder=get_text('input_placeholder'),
+            height=200, 
+            key="version_a_input", 
+            label_visibility="collapsed"
+        )
+
+    with col_b:
+        st.markdown(f"#### {get_text('version_b')}", help=None)
+        version_b = st.text_area(
+            label=get_text('version_b'),
+            placeholder=get_text('input_placeholder'),
+            height=200, 
+            key="version_b_input", 
+            label_visibility="collapsed"
+        )
+else:
+    # 锦标赛模式：每行一个候选版本
+    candidates_text = st.text_area(
+        label=get_text("candidates"),
         placeholder=get_text('input_placeholder'),
-        height=200, 
-        key="version_b_input", 
-        label_visibility="collapsed"
+        height=250,
+        key="candidates_input"
     )
+    candidates = [line.strip() for line in candidates_text.splitlines() if line.strip()]
 
 # 平台和模型选择
 col_platform, col_provider = st.columns(2)
 
 with col_platform:
     st.markdown(f"#### {get_text('platform')}", help=None)
-    platform = st.selectbox(
-        label=get_text('platform'),
-        options=["Twitter", "Facebook", "Instagram", "LinkedIn", "TikTok"], 
-        key="platform_select", 
-        label_visibility="collapsed"
-    )
+    if mode == "sweep":
+        # 平台扫描：所有选中平台共用一个并发上限与缓存同时模拟
+        sweep_platforms = st.multiselect(
+            label=get_text('platform'),
+            options=PLATFORMS,
+            default=list(PLATFORMS),
+            key="sweep_platforms_select",
+            label_visibility="collapsed"
+        )
+        platform = ", ".join(sweep_platforms)
+    else:
+        platform = st.selectbox(
+            label=get_text('platform'),
+            options=PLATFORMS,
+            key="platform_select",
+            label_visibility="collapsed"
+        )
 
 with col_provider:
     st.markdown(f"#### {get_text('model_provider')}", help=None)
@@ -247,7 +437,170 @@ with col_users:
         key="max_users_input", 
         label_visibility="collapsed"
     )
-    standard_batch_size = 5  # 每批处理的用户数
+
+# 高级设置
+with st.expander(get_text("advanced_settings"), expanded=False):
+    max_concurrency = st.number_input(
+        label=get_text("max_concurrency"),
+        min_value=1,
+        max_value=50,
+        value=DEFAULT_MAX_CONCURRENCY,
+        step=1,
+        key="max_concurrency_input"
+    )
+    users_per_call = st.number_input(
+        label=get_text("users_per_call"),
+        min_value=1,
+        max_value=20,
+        value=1,
+        step=1,
+        key="users_per_call_input"
+    )
+    sample_choices = st.checkbox(
+        label=get_text("sample_choices"),
+        value=True,
+        key="sample_choices_input",
+        disabled=users_per_call > 1
+    )
+    persona_sampling = st.checkbox(
+        label=get_text("persona_sampling"),
+        value=False,
+        key="persona_sampling_input",
+        disabled=mode == "tournament"
+    )
+    early_stopping = st.checkbox(
+        label=get_text("early_stopping"),
+        value=False,
+        key="early_stopping_input",
+        disabled=mode == "tournament"
+    )
+    if mode == "tournament":
+        tournament_strategy = st.selectbox(
+            label=get_text("tournament_strategy"),
+            options=STRATEGIES,
+            format_func=lambda option: get_text(f"strategy_{option}"),
+            key="tournament_strategy_input"
+        )
+        tournament_confidence = st.slider(
+            label=get_text("tournament_confidence"),
+            min_value=0.8,
+            max_value=0.99,
+            value=0.95,
+            step=0.01,
+            key="tournament_confidence_input",
+            disabled=tournament_strategy != "thompson"
+        )
+        tournament_budget = st.number_input(
+            label=get_text("tournament_budget"),
+            min_value=0,
+            value=0,
+            step=10,
+            key="tournament_budget_input"
+        )
+    stream_responses = st.checkbox(
+        label=get_text("stream_responses"),
+        value=False,
+        key="stream_responses_input"
+    )
+    use_cache = st.checkbox(
+        label=get_text("use_cache"),
+        value=True,
+        key="use_cache_input"
+    )
+    replay_mode = st.checkbox(
+        label=get_text("replay_mode"),
+        value=False,
+        key="replay_mode_input",
+        disabled=not use_cache
+    )
+    reuse_similar = st.checkbox(
+        label=get_text("reuse_similar"),
+        value=False,
+        key="reuse_similar_input",
+        disabled=not use_cache or replay_mode or mode != "ab"
+    )
+    extra_backends = st.multiselect(
+        label=get_text("extra_backends"),
+        options=[
+            (extra_provider, extra_model)
+            for extra_provider in ViralPredictionLLM.get_available_providers()
+            for extra_model in ViralPredictionLLM.get_available_models(extra_provider)
+            if (extra_provider, extra_model) != (provider, model)
+        ],
+        format_func=lambda backend: f"{backend[0]}: {backend[1]}",
+        key="extra_backends_input",
+        disabled=use_cache and replay_mode
+    )
+    hedge_requests = st.checkbox(
+        label=get_text("hedge_requests"),
+        value=False,
+        key="hedge_requests_input",
+        disabled=use_cache and replay_mode
+    )
+    cost_budget = st.number_input(
+        label=get_text("cost_budget"),
+        min_value=0.0,
+        value=0.0,
+        step=0.1,
+        format="%.2f",
+        key="cost_budget_input"
+    )
+    show_diagnostics = st.checkbox(
+        label=get_text("show_diagnostics"),
+        value=False,
+        key="show_diagnostics_input"
+    )
+
+# 运行前估算（按当前输入实时更新）
+simulation_config = SimulationConfig(
+    max_users=max_users,
+    max_concurrency=int(max_concurrency),
+    users_per_call=int(users_per_call),
+    early_stopping=early_stopping,
+    cost_budget=cost_budget or None,
+    choices_per_call=None if sample_choices else 1,
+    personas=persona_sampling and mode != "tournament"
+)
+if mode == "ab":
+    # 查找近似重复的已模拟内容（需要响应缓存才能复用其结果；两个版本互为近似重复时不复用）
+    ab_contents = {"A": version_a, "B": version_b}
+    if use_cache and not replay_mode:
+        similar_pair = get_content_index().lookup_pair(platform, f"{provider}/{model}", st.session_state.language,
+                                                       version_a, version_b)
+        for variant, similar in zip(("A", "B"), similar_pair):
+            if similar is None:
+                continue
+            if reuse_similar:
+                ab_contents[variant] = similar.content
+                st.info(get_text("similar_reused").format(variant, similar.users, similar.similarity))
+            else:
+                st.info(get_text("similar_found").format(variant, similar.users, similar.similarity))
+    run_estimate = estimate_ab_test(
+        provider, model,
+        build_prompt(platform, ab_contents["A"], st.session_state.language),
+        build_prompt(platform, ab_contents["B"], st.session_state.language),
+        simulation_config
+    )
+elif mode == "sweep":
+    run_estimate = estimate_run(provider, model, [
+        (build_prompt(sweep_platform, version, st.session_state.language), max_users)
+        for sweep_platform in sweep_platforms for version in (version_a, version_b)
+    ], simulation_config)
+else:
+    tournament_config = TournamentConfig(
+        strategy=tournament_strategy,
+        user_budget=int(tournament_budget) or None,
+        confidence=tournament_confidence
+    )
+    # 候选版本以 V1、V2…… 标识
+    tournament_prompts = {
+        f"V{number}": build_prompt(platform, candidate, st.session_state.language)
+        for number, candidate in enumerate(candidates, start=1)
+    }
+    run_estimate = estimate_tournament(provider, model, tournament_prompts, simulation_config, tournament_config)
+st.caption(get_text("preflight").format(
+    run_estimate.calls, run_estimate.total_tokens, run_estimate.cost, run_estimate.duration
+))
 
 # 预测按钮
 predict_col1, predict_col2, predict_col3 = st.columns([1, 1, 1])
@@ -256,179 +609,388 @@ with predict_col2:
 
 # 添加间隙
 st.markdown("<div style='margin-bottom: 30px;'></div>", unsafe_allow_html=True)
+def show_run_details(run_usage, diagnostics, llm_client, response_cache):
+    """显示一次运行的用量、解析问题、调用诊断、提供商路由与缓存统计"""
+    if run_usage.calls:
+        st.caption(get_text("usage_summary").format(
+            run_usage.prompt_tokens, run_usage.cache_hit_tokens, run_usage.completion_tokens,
+            run_usage.reasoning_tokens, run_usage.cost
+        ))
+
+    parse_issues = {reason: count for reason, count in llm_client.get_parse_stats().items() if reason != "ok"}
+    if parse_issues:
+        st.caption(get_text("parse_stats").format(
+            ", ".join(f"{reason}={count}" for reason, count in sorted(parse_issues.items()))
+        ))
+
+    if show_diagnostics:
+        with st.expander(get_text("diagnostics"), expanded=True):
+            st.table(diagnostics)
+
+    if isinstance(llm_client, RoutingLLM):
+        with st.expander(get_text("routing_stats"), expanded=False):
+            st.table(llm_client.get_stats())
+
+    if response_cache is not None:
+        cache_stats = response_cache.stats()
+        st.caption(get_text("cache_stats").format(cache_stats["hits"], cache_stats["misses"]))
+
+
+def cumulative_chart_data(aggregator, start, stop):
+    """累计总互动图表中第 start+1 ~ stop 个配对用户的数据"""
+    rows = aggregator.chart_rows(start, stop)
+    return pd.DataFrame(
+        {f"{get_text('version')} A": rows["A"], f"{get_text('version')} B": rows["B"]},
+        index=pd.RangeIndex(start + 1, stop + 1, name=get_text("users"))
+    )
 
-# 图表数据
-chart_data = {
-    "engagement_a": [0],
-    "engagement_b": [0],
-    "users": [0]
-}
 
-async def get_prediction(prompt, llm_client):
-    """使用LLM客户端获取预测结果"""
-    return await llm_client.predict_engagement(prompt)
+def show_ab_result(run_result, context):
+    """显示A/B测试的结果"""
+    aggregator = run_result.aggregator
+    llm_client = context["llm_client"]
 
-async def main():
-    if predict_button:
-        # 初始化计数器
-        users = 0
-        like_a = comment_a = share_a = quote_a = total_a = 0
-        like_b = comment_b = share_b = quote_b = total_b = 0
-
-        # 初始化LLM客户端
-        try:
-            llm_client = ViralPredictionLLM(provider=provider, model=model)
-            st.info(get_text("using_model").format(provider, model))
-        except Exception as e:
-            st.error(get_text("init_model_failed").format(str(e)))
+    # 累计互动图表
+    st.subheader(get_text('cumulative_engagement'))
+    st.line_chart(cumulative_chart_data(aggregator, 0, aggregator.paired))
+
+    users = run_result.users
+    failed = run_result.failed
+    decision = run_result.decision
+
+    if decision is not None:
+        st.info(get_text("early_stopped").format(
+            decision.users, decision.winner, decision.p_value,
+            run_result.saved_calls, run_result.total_calls,
+            run_result.saved_calls / run_result.total_calls * 100
+        ))
+
+    if run_result.budget_exhausted:
+        st.warning(get_text("budget_exhausted"))
+
+    if failed:
+        st.warning(get_text("failed_users").format(failed))
+
+    show_run_details(run_result.usage.total(), run_result.metrics.summary(), llm_client, context["response_cache"])
+
+    # 一次性检验所有指标（含总互动数），并做多重比较校正
+    comparison = run_result.compare()
+    results = {metric: comparison.metric(metric) for metric in comparison.metrics}
+
+    def show_metric(result, highlight=False):
+        """显示某个指标的胜出版本、置信度与人均差值的置信区间"""
+        if result["winner"] == "-":
+            st.write(f"{get_text('no_difference')}")
             return
+        message = get_text('better_version').format(result["winner"], result["confidence"])
+        if not highlight:
+            st.write(message)
+        elif result["winner"] == "A":
+            st.success(message)
+        else:
+            st.info(message)
+        st.caption(get_text("metric_detail").format(
+            result["diff"], result["ci_low"], result["ci_high"], result["p_value"],
+            TEST_LABELS.get(result["test"], result["test"])
+        ))
+
+    # 显示结果
+    st.success(get_text("prediction_complete").format(users))
+    st.markdown("---")
+
+    # 显示统计置信度
+    st.subheader(get_text('statistical_confidence'))
+
+    # 创建结果卡片 - 使用st.container()替代HTML div
+    with st.container():
+        # 使用expander组件代替自定义HTML
+        with st.expander(get_text("total_engagement"), expanded=True):
+            # 显示总互动量结果
+            show_metric(results["total"], highlight=True)
+
+    # 显示详细指标
+    columns = st.columns(len(aggregator.metrics))
+    labels = {"like": "likes", "comment": "comments", "share": "shares", "quote": "quotes"}
+    for column, metric in zip(columns, aggregator.metrics):
+        with column:
+            with st.expander(get_text(labels[metric]), expanded=True):
+                st.write(f"A: {results[metric]['a']} | B: {results[metric]['b']}")
+                show_metric(results[metric])
+
+    # 导出逐用户结果（互动指标、耗时、提供者、解析状态）
+    run_result.store.metadata.update({"platform": context["platform"]})
+    st.download_button(
+        label=get_text("download_run"),
+        data=run_result.store.to_parquet_bytes(),
+        file_name=f"run-{time.strftime('%Y%m%d-%H%M%S')}.parquet",
+        mime="application/octet-stream"
+    )
+
 
-        # 获取当前语言的提示词模板
-        prompt_template = get_engagement_prompt(st.session_state.language)
-        
-        # 创建提示词
-        prompt_a = prompt_template.format(platform=platform, content=version_a)
-        prompt_b = prompt_template.format(platform=platform, content=version_b)
-
-        progress_bar = st.progress(0)
-        
-        while users < max_users:
-            # 每次预测5个用户（或剩余的用户数）
-            batch_size = min(standard_batch_size, max_users - users)
-            predictions_a = []
-            predictions_b = []
-            
-            # 并行获取多个用户的预测
-            tasks_a = [get_prediction(prompt_a, llm_client) for _ in range(batch_size)]
-            tasks_b = [get_prediction(prompt_b, llm_client) for _ in range(batch_size)]
-            
-            predictions_a = await asyncio.gather(*tasks_a)
-            predictions_b = await asyncio.gather(*tasks_b)
-            
-            # 处理这批预测结果
-            for pred_a, pred_b in zip(predictions_a, predictions_b):
-                users += 1
-                
-                like_a += pred_a["like"]
-                comment_a += pred_a["comment"]
-                share_a += pred_a["share"]
-                quote_a += pred_a["quote"]
-                total_a = like_a + comment_a + share_a + quote_a
-
-                like_b += pred_b["like"]
-                comment_b += pred_b["comment"]
-                share_b += pred_b["share"]
-                quote_b += pred_b["quote"]
-                total_b = like_b + comment_b + share_b + quote_b
-                
-                # 更新图表数据
-                chart_data["engagement_a"].append(total_a)
-                chart_data["engagement_b"].append(total_b)
-                chart_data["users"].append(users)
-                
-                # 更新进度条
-                progress_bar.progress(users / max_users)
-        
-        # 显示结果
-        st.success(get_text("prediction_complete").format(users))
-        st.markdown("---")
-        
-        # 显示累计互动图表
-        st.subheader(get_text('cumulative_engagement'))
-        
-        chart_df = {
-            get_text("users"): chart_data["users"][1:],
-            f"{get_text('version')} A": chart_data["engagement_a"][1:],
-            f"{get_text('version')} B": chart_data["engagement_b"][1:]
+def show_sweep_result(sweep, context, elapsed):
+    """显示平台扫描的平台 × 指标结果矩阵"""
+    llm_client = context["llm_client"]
+
+    if sweep.budget_exhausted:
+        st.warning(get_text("budget_exhausted"))
+    failed = sum(result.failed for result in sweep.results.values())
+    if failed:
+        st.warning(get_text("failed_users").format(failed))
+    show_run_details(
+        sweep.usage.total(),
+        [{get_text("platform"): sweep_platform, **row}
+         for sweep_platform, result in sweep.results.items() for row in result.metrics.summary()],
+        llm_client, context["response_cache"]
+    )
+
+    st.success(get_text("sweep_complete").format(
+        min(result.users for result in sweep.results.values()), len(sweep.results), elapsed
+    ))
+    st.markdown("---")
+
+    # 平台 × 指标矩阵：每个平台一行，每个指标显示胜出版本与置信度
+    st.subheader(get_text("sweep_matrix"))
+    labels = {"like": "likes", "comment": "comments", "share": "shares", "quote": "quotes", "total": "total_engagement"}
+    matrix = pd.DataFrame([
+        {
+            get_text("platform"): row["platform"],
+            get_text("users"): row["users"],
+            **{
+                get_text("winner_column").format(get_text(label)):
+                    "-" if row[f"{metric}_winner"] == "-"
+                    else f"{row[f'{metric}_winner']} ({row[f'{metric}_confidence']:.1f}%)"
+                for metric, label in labels.items()
+            }
         }
-        
-        st.line_chart(chart_df, x=get_text("users"))
-        
-        # 显示统计置信度
-        st.subheader(get_text('statistical_confidence'))
-        
-        # 创建结果卡片 - 使用st.container()替代HTML div
-        with st.container():
-            # 使用expander组件代替自定义HTML
-            with st.expander(get_text("total_engagement"), expanded=True):
-                # 显示总互动量结果
-                winner, confidence = calc_confidence(users, total_a, total_b)
-                if confidence > 0:
-                    if winner == "A":
-                        st.success(f"{get_text('better_version').format(winner, confidence)}")
-                    else:
-                        st.info(f"{get_text('better_version').format(winner, confidence)}")
-                else:
-                    st.write(f"{get_text('no_difference')}")
-        
-        # 显示详细指标
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            with st.expander(get_text("likes"), expanded=True):
-                st.write(f"A: {like_a} | B: {like_b}")
-                winner, confidence = calc_confidence(users, like_a, like_b)
-                if confidence > 0:
-                    st.write(f"{get_text('better_version').format(winner, confidence)}")
-                else:
-                    st.write(f"{get_text('no_difference')}")
-        
-        with col2:
-            with st.expander(get_text("comments"), expanded=True):
-                st.write(f"A: {comment_a} | B: {comment_b}")
-                winner, confidence = calc_confidence(users, comment_a, comment_b)
-                if confidence > 0:
-                    st.write(f"{get_text('better_version').format(winner, confidence)}")
-                else:
-                    st.write(f"{get_text('no_difference')}")
-        
-        with col3:
-            with st.expander(get_text("shares"), expanded=True):
-                st.write(f"A: {share_a} | B: {share_b}")
-                winner, confidence = calc_confidence(users, share_a, share_b)
-                if confidence > 0:
-                    st.write(f"{get_text('better_version').format(winner, confidence)}")
-                else:
-                    st.write(f"{get_text('no_difference')}")
-        
-        with col4:
-            with st.expander(get_text("quotes"), expanded=True):
-                st.write(f"A: {quote_a} | B: {quote_b}")
-                winner, confidence = calc_confidence(users, quote_a, quote_b)
-                if confidence > 0:
-                    st.write(f"{get_text('better_version').format(winner, confidence)}")
-                else:
-                    st.write(f"{get_text('no_difference')}")
-
-def calc_confidence(users, vote_a, vote_b):
-    if vote_a == 0 and vote_b == 0:
-        return "-", 0.0
-    
-    if vote_a == 0:
-        return "B", 100.0
-    if vote_b == 0:
-        return "A", 100.0
-    
+        for row in sweep.matrix(n_bootstrap=0)
+    ]).set_index(get_text("platform"))
+    st.dataframe(matrix, use_container_width=True)
+
+    # 各平台每个版本的累计总互动数
+    st.bar_chart(pd.DataFrame({
+        f"{get_text('version')} {variant}": [int(result.aggregator.paired_values(variant).sum())
+                                              for result in sweep.results.values()]
+        for variant in ("A", "B")
+    }, index=list(sweep.results)))
+
+
+def tournament_progress_table(arms):
+    """锦标赛各版本的实时用户数与人均互动数"""
+    return pd.DataFrame({
+        get_text("users"): arms.users,
+        get_text("mean_engagement"): arms.means.round(2)
+    }, index=arms.variants)
+
+
+def show_tournament_result(run_result, context):
+    """显示锦标赛的排名"""
+    llm_client = context["llm_client"]
+    arms = run_result.arms
+
+    if run_result.budget_exhausted:
+        st.warning(get_text("budget_exhausted"))
+    if arms.failed:
+        st.warning(get_text("failed_users").format(arms.failed))
+    show_run_details(run_result.usage.total(), run_result.metrics.summary(), llm_client, context["response_cache"])
+
+    st.success(get_text("tournament_result").format(
+        run_result.winner, run_result.winner_p_best, int(arms.users.sum()),
+        run_result.calls_started, run_result.exhaustive_calls,
+        run_result.saved_calls / run_result.exhaustive_calls * 100
+    ))
+    st.markdown("---")
+
+    # 排名表：候选内容、模拟用户数、人均互动数及置信区间、为最优的概率、各指标人均值
+    st.subheader(get_text("tournament_ranking"))
+    contents = context["candidates"]
+    ranking = pd.DataFrame(run_result.ranking()).set_index("variant")
+    ranking.insert(0, get_text("candidate"), [contents[variant] for variant in ranking.index])
+    ranking = ranking.rename(columns={"users": get_text("users"), "mean": get_text("mean_engagement"),
+                                      "p_best": get_text("p_best")})
+    st.dataframe(ranking.round(3), use_container_width=True)
+
+    run_result.store.metadata.update({"platform": context["platform"], "candidates": contents})
+    st.download_button(
+        label=get_text("download_run"),
+        data=run_result.store.to_parquet_bytes(),
+        file_name=f"tournament-{time.strftime('%Y%m%d-%H%M%S')}.parquet",
+        mime="application/octet-stream"
+    )
+
+
+def submit_run(job_manager):
+    """
+    按当前输入创建LLM客户端并提交后台运行任务
+
+    运行参数在提交时取值并绑定到任务上，之后修改输入或切换语言不会影响运行中的任务
+
+    Returns:
+        任务；输入无效或客户端初始化失败时返回None
+    """
+    if mode == "sweep" and not sweep_platforms:
+        st.warning(get_text("need_platforms"))
+        return None
+    if mode == "tournament" and len(candidates) < 2:
+        st.warning(get_text("need_candidates"))
+        return None
+
+    # 初始化LLM客户端
     try:
-        if vote_a >= vote_b:
-            z_stat, vote_confidence_a = proportions_ztest(
-                count=[vote_a, vote_b],
-                nobs=[users, users],
-                alternative='larger'
-            )
-            vote_confidence_a = (1 - vote_confidence_a) * 100
-            return "A", vote_confidence_a if not np.isnan(vote_confidence_a) else 50.0
+        response_cache = get_response_cache() if use_cache else None
+        replay = use_cache and replay_mode
+        llm_client = ViralPredictionLLM(
+            provider=provider,
+            model=model,
+            cache=response_cache,
+            replay=replay,
+            stream=stream_responses
+        )
+        # 多提供商分流与对冲（回放模式只读取所选模型的缓存）
+        if not replay and (extra_backends or hedge_requests):
+            backends = [llm_client] + [
+                ViralPredictionLLM(provider=extra_provider, model=extra_model, cache=response_cache,
+                                   stream=stream_responses)
+                for extra_provider, extra_model in extra_backends
+            ]
+            llm_client = RoutingLLM(backends, hedge=hedge_requests)
+    except Exception as e:
+        st.error(get_text("init_model_failed").format(str(e)))
+        return None
+
+    config = simulation_config
+    language = st.session_state.language
+    context = {"mode": mode, "provider": provider, "model": model, "platform": platform,
+               "llm_client": llm_client, "response_cache": response_cache}
+
+    if mode == "ab":
+        ab_platform, model_key = platform, f"{provider}/{model}"
+        content_a, content_b = ab_contents["A"], ab_contents["B"]
+        prompt_a = build_prompt(ab_platform, content_a, language)
+        prompt_b = build_prompt(ab_platform, content_b, language)
+        planned_users = 2 * config.max_users
+        content_index = get_content_index() if response_cache is not None and not replay else None
+
+        async def run(job):
+            # 滑动窗口调度 + 流式聚合 + 可选的序贯检验提前停止与预算上限；
+            # 部分结果以快照发布给界面线程，快照按界面帧率节流
+            throttle = FrameThrottle()
+
+            def on_result(aggregator):
+                job.report(min(aggregator.finished, planned_users) / planned_users,
+                           aggregator.snapshot() if throttle.ready() else None)
+            result = await run_ab_test(llm_client, prompt_a, prompt_b, config, on_result=on_result,
+                                       platform=ab_platform, language=language)
+            # 记录已模拟的内容，之后提交的近似重复内容可以复用缓存的结果
+            if content_index is not None:
+                content_index.add(ab_platform, model_key, language, content_a, result.aggregator.contiguous_users("A"))
+                content_index.add(ab_platform, model_key, language, content_b, result.aggregator.contiguous_users("B"))
+            return result
+    elif mode == "sweep":
+        content_a, content_b, platforms = version_a, version_b, list(sweep_platforms)
+        planned_users = 2 * config.max_users * len(platforms)
+        finished = {}
+
+        async def run(job):
+            def on_result(sweep_platform, aggregator):
+                finished[sweep_platform] = aggregator.finished
+                job.report(sum(finished.values()) / planned_users)
+            return await run_platform_sweep(llm_client, content_a, content_b, platforms, config,
+                                            language=language, on_result=on_result)
+    else:
+        prompts, tournament = dict(tournament_prompts), tournament_config
+        context["candidates"] = dict(zip(prompts, candidates))
+        planned_users = tournament_user_budget(len(prompts), config, tournament)
+
+        async def run(job):
+            throttle = FrameThrottle()
+
+            def on_result(arms):
+                job.report(arms.finished / planned_users, arms.snapshot() if throttle.ready() else None)
+            return await run_tournament(llm_client, prompts, config, tournament, on_result=on_result)
+
+    return job_manager.submit(run, kind=mode, owner=st.session_state.session_id, context=context)
+
+
+def poll_job(job_manager, job):
+    """轮询运行中的任务，刷新进度与部分结果直到任务结束（脚本重新运行时会中断轮询，任务不受影响）"""
+    status = st.empty()
+    if st.button(get_text("cancel_run"), key=f"cancel_{job.id}"):
+        job_manager.cancel(job.id)
+        # 等待在途请求取消完成（通常很快）
+        job.wait(timeout=5)
+        return
+    progress_bar = st.progress(0)
+    live = st.empty()
+
+    # 部分结果是任务发布的快照，配对用户只增不减：A/B 图表只需追加新配对完成的用户
+    chart = None
+    drawn = 0
+    while not job.finished:
+        if job.status == JOB_PENDING:
+            status.info(get_text("run_queued"))
+        else:
+            status.info(get_text("run_in_background").format(job.elapsed))
+        progress, partial = job.latest()
+        progress_bar.progress(progress)
+
+        if partial is not None and job.kind == "ab":
+            if chart is None:
+                with live.container():
+                    st.subheader(get_text('cumulative_engagement'))
+                    chart = st.line_chart(cumulative_chart_data(partial, 0, 0))
+            paired = partial.paired
+            if paired > drawn:
+                chart.add_rows(cumulative_chart_data(partial, drawn, paired))
+                drawn = paired
+        elif partial is not None and job.kind == "tournament":
+            live.dataframe(tournament_progress_table(partial), use_container_width=True)
+
+        job.wait(timeout=1 / DEFAULT_MAX_FPS)
+
+    status.empty()
+    progress_bar.empty()
+    live.empty()
+
+
+def show_job(job_manager, job):
+    """显示后台任务：运行中时显示进度与部分结果，结束后显示结果"""
+    context = job.context
+    st.info(get_text("using_model").format(context["provider"], context["model"]))
+
+    if not job.finished:
+        poll_job(job_manager, job)
+
+    if job.status == JOB_CANCELLED:
+        st.warning(get_text("run_cancelled"))
+    elif job.status == JOB_FAILED:
+        if isinstance(job.error, CacheMissError):
+            st.error(get_text("cache_miss").format(str(job.error)))
+        else:
+            st.error(get_text("run_failed").format(str(job.error)))
+    elif job.status == JOB_DONE:
+        if job.kind == "sweep":
+            show_sweep_result(job.result, context, job.elapsed)
+        elif job.kind == "tournament":
+            show_tournament_result(job.result, context)
         else:
-            z_stat, vote_confidence_b = proportions_ztest(
-                count=[vote_b, vote_a],
-                nobs=[users, users],
-                alternative='larger'
-            )
-            vote_confidence_b = (1 - vote_confidence_b) * 100
-            return "B", vote_confidence_b if not np.isnan(vote_confidence_b) else 50.0
-    except:
-        return "-", 0.0
+            show_ab_result(job.result, context)
+
+
+def main():
+    job_manager = get_job_manager()
+    if predict_button:
+        # 新的运行取代本会话尚未结束的运行
+        previous_job_id = st.session_state.get("job_id")
+        if previous_job_id:
+            job_manager.cancel(previous_job_id)
+        job = submit_run(job_manager)
+        st.session_state.job_id = job.id if job is not None else None
+
+    # 任务在后台运行，脚本重新运行（修改输入、切换语言）后从这里继续显示进度或结果
+    job = job_manager.get(st.session_state.get("job_id") or "")
+    if job is not None:
+        show_job(job_manager, job)
 
 if __name__ == "__main__":
     # 运行主应用程序
-    asyncio.run(main())
+    main()